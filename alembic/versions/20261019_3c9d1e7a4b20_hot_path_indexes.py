@@ -0,0 +1,59 @@
+"""hot path indexes
+
+Composite indexes for the per-user history listings (keyset pagination) and
+the other filters that used to scan whole tables.
+
+Tables are still created by init_db()/create_all, so on a fresh database these
+indexes already exist; upgrade() skips any index that is already there.
+
+Revision ID: 3c9d1e7a4b20
+Revises:
+Create Date: 2026-10-19 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9d1e7a4b20'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns, extra kwargs)
+INDEXES = [
+    ("ix_driving_sessions_user_start", "driving_sessions", ["user_id", "start_time", "id"], {}),
+    ("ix_photo_uploads_user_created", "photo_uploads", ["user_id", "created_at", "id"], {}),
+    ("ix_user_rewards_user_claimed", "user_rewards", ["user_id", "claimed_at", "id"], {}),
+    ("ix_point_events_session", "point_events", ["session_id"], {}),
+    ("ix_feedback_reports_session", "feedback_reports", ["session_id"], {}),
+    ("ix_password_reset_codes_user_code", "password_reset_codes", ["user_id", "code", "expires_at"],
+     {"mysql_length": {"code": 32}}),
+    ("ix_user_quiz_results_user_taken", "user_quiz_results", ["user_id", "taken_at"], {}),
+    ("ix_cars_user", "cars", ["user_id"], {}),
+    ("ix_quiz_options_question", "quiz_options", ["question_id"], {}),
+]
+
+
+def _existing_indexes(table):
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return None
+    return {ix["name"] for ix in inspector.get_indexes(table)}
+
+
+def upgrade():
+    for name, table, columns, kwargs in INDEXES:
+        existing = _existing_indexes(table)
+        if existing is None or name in existing:
+            continue
+        op.create_index(name, table, columns, **kwargs)
+
+
+def downgrade():
+    for name, table, columns, kwargs in reversed(INDEXES):
+        existing = _existing_indexes(table)
+        if existing and name in existing:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,76 @@
+"""delta sync columns
+
+updated_at/sync_version on the synced tables, users.sync_version and the
+sync_tombstones table (see backend/sync.py). Like the previous revision it
+skips anything create_all has already created.
+
+Revision ID: 8e2f5a61c7d3
+Revises: 3c9d1e7a4b20
+Create Date: 2026-10-19 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2f5a61c7d3'
+down_revision = '3c9d1e7a4b20'
+branch_labels = None
+depends_on = None
+
+
+SYNCED_TABLES = {
+    "cars": "ix_cars_user_sync",
+    "driving_sessions": "ix_driving_sessions_user_sync",
+    "photo_uploads": "ix_photo_uploads_user_sync",
+    "user_rewards": "ix_user_rewards_user_sync",
+}
+
+
+def _columns(inspector, table):
+    return {c["name"] for c in inspector.get_columns(table)}
+
+
+def _indexes(inspector, table):
+    return {ix["name"] for ix in inspector.get_indexes(table)}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if "sync_version" not in _columns(inspector, "users"):
+        op.add_column("users", sa.Column("sync_version", sa.Integer(), nullable=False, server_default="0"))
+
+    for table, index in SYNCED_TABLES.items():
+        columns = _columns(inspector, table)
+        if "updated_at" not in columns:
+            op.add_column(table, sa.Column("updated_at", sa.DateTime(), nullable=True))
+        if "sync_version" not in columns:
+            op.add_column(table, sa.Column("sync_version", sa.Integer(), nullable=False, server_default="0"))
+        if index not in _indexes(inspector, table):
+            op.create_index(index, table, ["user_id", "sync_version"])
+
+    if not inspector.has_table("sync_tombstones"):
+        op.create_table(
+            "sync_tombstones",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("entity", sa.String(20), nullable=False),
+            sa.Column("entity_id", sa.Integer(), nullable=False),
+            sa.Column("sync_version", sa.Integer(), nullable=False),
+            sa.Column("deleted_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_sync_tombstones_id", "sync_tombstones", ["id"])
+        op.create_index("ix_sync_tombstones_user_sync", "sync_tombstones", ["user_id", "sync_version"])
+
+
+def downgrade():
+    op.drop_table("sync_tombstones")
+    for table, index in SYNCED_TABLES.items():
+        op.drop_index(index, table_name=table)
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("sync_version")
+            batch.drop_column("updated_at")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("sync_version")
@@ -0,0 +1,45 @@
+"""maintenance indexes
+
+expires_at indexes for the purge/expiry jobs in backend/maintenance.py and
+the scheduler_leases table. Skips anything create_all has already created.
+
+Revision ID: b71e0c9f2a45
+Revises: 8e2f5a61c7d3
+Create Date: 2026-10-19 16:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e0c9f2a45'
+down_revision = '8e2f5a61c7d3'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ("ix_password_reset_codes_expires", "password_reset_codes", ["expires_at"]),
+    ("ix_user_rewards_expires", "user_rewards", ["expires_at"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name not in {ix["name"] for ix in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+    if not inspector.has_table("scheduler_leases"):
+        op.create_table(
+            "scheduler_leases",
+            sa.Column("name", sa.String(50), primary_key=True),
+            sa.Column("owner", sa.String(100), nullable=False),
+            sa.Column("expires_at", sa.DateTime(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table("scheduler_leases")
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
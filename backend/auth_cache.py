@@ -0,0 +1,200 @@
+# auth_cache.py
+#
+# Caches what get_current_user needs on every authenticated request:
+#   * verified JWT claims, keyed by a hash of the token and kept until the
+#     token's own `exp` (in-process LRU, claims never change)
+#   * a small identity snapshot of the user, kept for AUTH_CACHE_TTL_SECONDS in
+#     a backend: the in-process LocalBackend by default, or Redis when
+#     AUTH_CACHE_REDIS_URL is set so every worker sees the same invalidations.
+#
+# Call invalidate_user() after anything that changes or deletes a user.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+from metrics import metrics
+
+AUTH_CACHE_MAX_TOKENS = int(os.getenv("AUTH_CACHE_MAX_TOKENS", "10000"))
+AUTH_CACHE_MAX_USERS = int(os.getenv("AUTH_CACHE_MAX_USERS", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+# Valfri delad backend för flera workers, t.ex. redis://localhost:6379/0 (kräver paketet `redis`)
+AUTH_CACHE_REDIS_URL = os.getenv("AUTH_CACHE_REDIS_URL")
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Identity fields only. Anything that changes often (points) is read from the DB."""
+    id: int
+    email: str
+    firstname: str
+    lastname: str
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        return cls(id=user.id, email=user.email, firstname=user.firstname, lastname=user.lastname)
+
+
+class LocalBackend:
+    """In-process LRU+TTL store. The default, and the stand-in for Redis in tests."""
+
+    def __init__(self, max_items: int = AUTH_CACHE_MAX_USERS):
+        self.max_items = max_items
+        self._items = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    async def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    async def set(self, key: str, value: str, ttl: float):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    async def delete(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("AUTH_CACHE_REDIS_URL is set but the `redis` package is not installed") from e
+        self._redis = aioredis.from_url(url)
+
+    async def get(self, key: str):
+        value = await self._redis.get(key)
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._redis.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    def __len__(self):
+        return 0   # okänt lokalt
+
+
+class AuthCache:
+    def __init__(self, backend=None, max_tokens: int = AUTH_CACHE_MAX_TOKENS,
+                 ttl: float = AUTH_CACHE_TTL_SECONDS):
+        self.backend = backend if backend is not None else LocalBackend()
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self._tokens = OrderedDict()   # token hash -> (exp as unix time, claims)
+        self._lock = threading.Lock()
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"safedrive:auth:user:{user_id}"
+
+    # ─── Verifierade claims ───────────────────────────────────────────
+
+    def get_claims(self, token: str, verify):
+        """Cached claims for `token`, or verify(token) on a miss. None if the token is invalid/expired."""
+        key = self._token_key(token)
+        now = time.time()
+        with self._lock:
+            item = self._tokens.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._tokens.move_to_end(key)
+                    self.token_hits += 1
+                    return item[1]
+                del self._tokens[key]
+            self.token_misses += 1
+        claims = verify(token)
+        if not claims or "exp" not in claims or self.max_tokens <= 0:
+            return claims
+        with self._lock:
+            self._tokens[key] = (float(claims["exp"]), claims)
+            while len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+        return claims
+
+    # ─── Användarsnapshot ─────────────────────────────────────────────
+
+    async def get_user(self, user_id: int, load):
+        """
+        Cached snapshot of the user, or `await load(user_id)` (returning a User or
+        None) on a miss. Returns None if the user does not exist.
+        """
+        raw = await self.backend.get(self._user_key(user_id))
+        if raw is not None:
+            self.user_hits += 1
+            return UserSnapshot(**json.loads(raw))
+        self.user_misses += 1
+        user = await load(user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        await self.backend.set(self._user_key(user_id), json.dumps(asdict(snapshot)), self.ttl)
+        return snapshot
+
+    async def invalidate_user(self, user_id: int):
+        await self.backend.delete(self._user_key(user_id))
+
+    def stats(self) -> dict:
+        with self._lock:
+            tokens = len(self._tokens)
+        return {
+            "backend": type(self.backend).__name__,
+            "token_hits": self.token_hits,
+            "token_misses": self.token_misses,
+            "user_hits": self.user_hits,
+            "user_misses": self.user_misses,
+            "tokens": tokens,
+            "users": len(self.backend),
+        }
+
+
+auth_cache = AuthCache(RedisBackend(AUTH_CACHE_REDIS_URL) if AUTH_CACHE_REDIS_URL else None)
+
+
+async def invalidate_user(user_id: int):
+    """Drop the cached snapshot after the user was changed or deleted (all workers with Redis)."""
+    await auth_cache.invalidate_user(user_id)
+
+
+def _collect_auth_cache_metrics():
+    st = auth_cache.stats()
+    return [
+        ("safedrive_auth_cache_lookups_total", "counter", "Auth cache lookups by kind and result.",
+         [({"kind": "token", "result": "hit"}, st["token_hits"]),
+          ({"kind": "token", "result": "miss"}, st["token_misses"]),
+          ({"kind": "user", "result": "hit"}, st["user_hits"]),
+          ({"kind": "user", "result": "miss"}, st["user_misses"])]),
+    ]
+
+
+metrics.register_collector(_collect_auth_cache_metrics)
@@ -0,0 +1,160 @@
+# benchmarks/bench_inference_server.py
+#
+# N API-worker-like processes calling the lane model, two ways:
+#   local  - every process loads its own ONNX session (INFERENCE_SOCKET unset)
+#   shared - one inference_server.py process, workers go through inference_ipc
+# Reports calls/s over all workers, per-call latency and the summed RSS of
+# every process involved (workers + server), i.e. what the host pays.
+#
+#   cd backend
+#   python benchmarks/bench_inference_server.py
+#   python benchmarks/bench_inference_server.py --workers 1 4 8 --calls 200
+#   python benchmarks/bench_inference_server.py --model ../assets/models/lane_net.onnx   # the real model
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+LANE_INPUT_SHAPE = (1, 3, 288, 800)
+
+
+def _rss_kb(pid: int) -> int:
+    """Current RSS of a process (Linux /proc); 0 where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+# ─── Child: en worker ─────────────────────────────────────────────────
+
+def run_worker(calls: int, ready_path: str, go_path: str):
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+
+    if os.getenv("INFERENCE_SOCKET"):
+        from inference_ipc import RemoteRegistry
+        registry = RemoteRegistry(os.environ["INFERENCE_SOCKET"])
+    else:
+        from model_registry import ModelRegistry, DEFAULT_MODELS
+        registry = ModelRegistry()
+        registry.load("lane", "bench", DEFAULT_MODELS["lane"][1], activate=True)
+
+    rng = np.random.default_rng(os.getpid())
+    x = rng.random(LANE_INPUT_SHAPE, dtype=np.float32)
+    mv = registry.acquire("lane")
+    mv.run({"input": x})   # värm upp (och anslut)
+
+    # Alla workers startar samtidigt, så de tävlar om CPU:n som i produktion
+    open(ready_path, "w").close()
+    while not os.path.exists(go_path):
+        time.sleep(0.005)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        mv.run({"input": x})
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"elapsed": elapsed, "latencies": latencies, "rss_kb": _rss_kb(os.getpid())}))
+
+
+# ─── Parent ───────────────────────────────────────────────────────────
+
+def _start_server(env: dict, socket_path: str, threads: int):
+    server = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "inference_server.py"),
+                               "--socket", socket_path, "--threads", str(threads)],
+                              env=env, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 60
+    while not os.path.exists(socket_path):
+        if server.poll() is not None or time.time() > deadline:
+            raise RuntimeError(f"inference server did not start:\n{server.stderr.read().decode()[-2000:]}")
+        time.sleep(0.05)
+    return server
+
+
+def run_mode(mode: str, workers: int, calls: int, env: dict, workdir: str, threads: int) -> dict:
+    env = dict(env)
+    server = None
+    if mode == "shared":
+        env["INFERENCE_SOCKET"] = os.path.join(workdir, f"inference-{workers}.sock")
+        server = _start_server(env, env["INFERENCE_SOCKET"], threads)
+    go_path = os.path.join(workdir, f"go-{mode}-{workers}")
+    procs = []
+    try:
+        for i in range(workers):
+            ready = os.path.join(workdir, f"ready-{mode}-{workers}-{i}")
+            procs.append((ready, subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--child", str(calls), ready, go_path],
+                env=env, cwd=BACKEND_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)))
+        while not all(os.path.exists(ready) for ready, _ in procs):
+            if any(p.poll() not in (None, 0) for _, p in procs):
+                break
+            time.sleep(0.01)
+        server_rss = _rss_kb(server.pid) if server else 0
+        open(go_path, "w").close()
+        results = []
+        for _, p in procs:
+            out, err = p.communicate()
+            if p.returncode != 0:
+                raise RuntimeError(f"worker failed:\n{err[-2000:]}")
+            results.append(json.loads(out.strip().splitlines()[-1]))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies = sorted(l for r in results for l in r["latencies"])
+    wall = max(r["elapsed"] for r in results)
+    return {
+        "calls_per_s": round(len(latencies) / wall, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "rss_mb": round((sum(r["rss_kb"] for r in results) + server_rss) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--calls", type=int, default=100, help="model calls per worker")
+    parser.add_argument("--threads", type=int, default=2, help="inference server model threads")
+    parser.add_argument("--model", help="ONNX lane model to use instead of the stub")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_worker(int(args.child[0]), args.child[1], args.child[2])
+        return
+
+    with tempfile.TemporaryDirectory(prefix="safedrive-infsrv-") as workdir:
+        if args.model:
+            shutil.copy(args.model, os.path.join(workdir, "lane.onnx"))
+        else:
+            sys.path.insert(0, BENCH_DIR)
+            from synthetic import write_stub_lane_model
+            write_stub_lane_model(os.path.join(workdir, "lane.onnx"))
+        env = dict(os.environ, MODEL_DIR=workdir, LANE_MODEL_FILE="lane.onnx", DEPTH_MODEL_FILE="lane.onnx")
+
+        print(f"{'mode':<7} {'workers':>7} {'calls/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}")
+        for workers in args.workers:
+            for mode in ("local", "shared"):
+                r = run_mode(mode, workers, args.calls, env, workdir, args.threads)
+                print(f"{mode:<7} {workers:>7} {r['calls_per_s']:>9} {r['p50_ms']:>8} "
+                      f"{r['p99_ms']:>8} {r['rss_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/bench_json.py
+#
+# Serialization cost of the list endpoints: FastAPI's default response_model
+# path (validate, jsonable_encoder, json.dumps) vs. fast_json (prebuilt
+# TypeAdapter writing bytes directly), with and without gzip, for 10 to 5000
+# driving sessions. Then the same end to end through a minimal app and
+# TestClient, so routing and response overhead are included.
+#
+#   cd backend
+#   python benchmarks/bench_json.py
+#   python benchmarks/bench_json.py --sizes 50 500 5000 --repeat 50
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def _sessions(n: int):
+    """Transient stand-ins for DrivingSession rows (attribute access, like the ORM objects)."""
+    start = datetime(2024, 1, 1)
+    return [
+        SimpleNamespace(id=i, user_id=1, file_path=f"uploads/videos/session_{i}.mp4",
+                        start_time=start + timedelta(minutes=i), end_time=start + timedelta(minutes=i, seconds=540),
+                        total_points=i % 250, duration=540.0, updated_at=start + timedelta(minutes=i))
+        for i in range(n)
+    ]
+
+
+def _time(fn, repeat: int) -> float:
+    fn()  # värm upp (bygger adaptrar m.m.)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def bench_serialize(sizes, repeat: int):
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from fast_json import dump_list, JSON_COMPRESS_LEVEL
+    from schemas import DrivingSessionResponse
+
+    field = TypeAdapter(List[DrivingSessionResponse])
+
+    def default_path(rows):
+        # Vad FastAPI gör med response_model: validera, koda till JSON-typer, json.dumps
+        validated = field.validate_python(rows, from_attributes=True)
+        content = jsonable_encoder(field.dump_python(validated, mode="json"))
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                          separators=(",", ":")).encode("utf-8")
+
+    print("serialization only")
+    print(f"{'rows':>6} {'bytes':>9} {'gzip':>8} {'default ms':>11} {'fast ms':>8} {'fast+gzip ms':>13}")
+    for n in sizes:
+        rows = _sessions(n)
+        body = dump_list(DrivingSessionResponse, rows)
+        assert json.loads(body) == json.loads(default_path(rows))   # samma innehåll
+        print(f"{n:>6} {len(body):>9} {len(gzip.compress(body, JSON_COMPRESS_LEVEL)):>8} "
+              f"{_time(lambda: default_path(rows), repeat):>11.3f} "
+              f"{_time(lambda: dump_list(DrivingSessionResponse, rows), repeat):>8.3f} "
+              f"{_time(lambda: gzip.compress(dump_list(DrivingSessionResponse, rows), JSON_COMPRESS_LEVEL), repeat):>13.3f}")
+
+
+def bench_endpoint(sizes, repeat: int):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from fast_json import list_response
+    from schemas import DrivingSessionResponse
+
+    app = FastAPI()
+    data = {n: _sessions(n) for n in sizes}
+
+    @app.get("/default/{n}", response_model=List[DrivingSessionResponse])
+    async def default_endpoint(n: int):
+        return data[n]
+
+    @app.get("/fast/{n}", response_model=List[DrivingSessionResponse])
+    async def fast_endpoint(n: int, request: Request):
+        return list_response(DrivingSessionResponse, data[n], request)
+
+    client = TestClient(app)
+    plain = {"Accept-Encoding": "identity"}
+    gz = {"Accept-Encoding": "gzip"}
+    print("\nend to end (TestClient)")
+    print(f"{'rows':>6} {'default ms':>11} {'fast ms':>8} {'fast+gzip ms':>13}")
+    for n in sizes:
+        assert client.get(f"/fast/{n}", headers=gz).json() == client.get(f"/default/{n}").json()
+        print(f"{n:>6} {_time(lambda: client.get(f'/default/{n}', headers=plain), repeat):>11.3f} "
+              f"{_time(lambda: client.get(f'/fast/{n}', headers=plain), repeat):>8.3f} "
+              f"{_time(lambda: client.get(f'/fast/{n}', headers=gz), repeat):>13.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("FAST_JSON_ENABLED", "true")
+    bench_serialize(args.sizes, args.repeat)
+    bench_endpoint(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
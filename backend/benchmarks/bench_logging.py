@@ -0,0 +1,125 @@
+# benchmarks/bench_logging.py
+#
+# Caller-side cost of one log call on the hot path, with stdout replaced by a
+# sink that takes --write-us microseconds per write (a busy terminal, pipe or
+# container log driver): print(), a plain StreamHandler, the QueueHandler
+# from logging_setup, and the QueueHandler with the event sampled at 1%.
+# Runs from several threads at once, like uvicorn's threadpool.
+#
+#   cd backend
+#   python benchmarks/bench_logging.py
+#   python benchmarks/bench_logging.py --calls 20000 --threads 8 --write-us 100
+
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+class SlowSink:
+    """File-like object whose writes block for a fixed time, serialized like a real fd."""
+
+    def __init__(self, write_seconds: float):
+        self.write_seconds = write_seconds
+        self.lines = 0
+        self._lock = threading.Lock()
+
+    def write(self, text: str):
+        with self._lock:
+            time.sleep(self.write_seconds)
+            self.lines += text.count("\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _run(call, calls: int, threads: int):
+    """Per-call latencies in µs, collected over all threads."""
+    latencies = []
+    lock = threading.Lock()
+    per_thread = calls // threads
+
+    def worker(i):
+        local = []
+        for n in range(per_thread):
+            t0 = time.perf_counter()
+            call(i, n)
+            local.append((time.perf_counter() - t0) * 1e6)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=8000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--write-us", type=float, default=50.0, help="simulated cost of one stdout write")
+    args = parser.parse_args()
+
+    import logging_setup
+    from logging_setup import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, LogSampler, log_event
+
+    def fresh_logger(name, handler):
+        logger = logging.getLogger(f"bench.{name}")
+        logger.handlers[:] = [handler]
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        return logger
+
+    print(f"{'variant':<22} {'p50 µs':>9} {'p99 µs':>9} {'wall s':>8} {'lines':>7}")
+
+    def report(name, result, sink):
+        p50, p99, wall = result
+        print(f"{name:<22} {p50:>9.1f} {p99:>9.1f} {wall:>8.2f} {sink.lines:>7}")
+
+    # print() – vad lane_overlay gjorde tidigare
+    sink = SlowSink(args.write_us / 1e6)
+    report("print", _run(lambda i, n: print(f"Detected {n % 4} red lines in this frame.", file=sink),
+                         args.calls, args.threads), sink)
+
+    # Synkron StreamHandler
+    sink = SlowSink(args.write_us / 1e6)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(JsonFormatter())
+    logger = fresh_logger("stream", handler)
+    report("StreamHandler", _run(lambda i, n: logger.info("Detected %d red lines in this frame", n % 4),
+                                 args.calls, args.threads), sink)
+
+    for name, rate in (("QueueHandler", 1.0), ("QueueHandler 1%", 0.01)):
+        sink = SlowSink(args.write_us / 1e6)
+        output = logging.StreamHandler(sink)
+        output.setFormatter(JsonFormatter())
+        q = queue.Queue(args.calls + 1)   # ingen drop i mätningen
+        qh = NonBlockingQueueHandler(q)
+        qh.addFilter(SamplingFilter())
+        listener = logging.handlers.QueueListener(q, output)
+        logging_setup.sampler = LogSampler({"lane.red_lines": rate})
+        logger = fresh_logger(name.replace(" ", ""), qh)
+        listener.start()
+        result = _run(lambda i, n: log_event(logger, logging.INFO, "lane.red_lines",
+                                             "Detected %d red lines in this frame", n % 4, red_lines=n % 4),
+                      args.calls, args.threads)
+        listener.stop()   # väntar tills kön är skriven, så 'lines' är komplett
+        report(name, result, sink)
+
+
+if __name__ == "__main__":
+    main()
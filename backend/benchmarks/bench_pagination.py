@@ -0,0 +1,111 @@
+# benchmarks/bench_pagination.py
+#
+# Page fetch latency for driving-session history as it grows: keyset cursor
+# (what the API uses) vs. OFFSET, on the first page and deep into the history.
+# With the (user_id, start_time, id) index the keyset numbers should stay flat
+# while OFFSET grows with the page depth.
+#
+#   cd backend
+#   python benchmarks/bench_pagination.py
+#   python benchmarks/bench_pagination.py --sizes 1000 10000 100000 --limit 50
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+
+def _setup_env(workdir: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'pagination.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.pop("READ_DATABASE_URL", None)
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def _seed(SessionLocal, DrivingSession, User, sizes):
+    """One user per history size; sessions one minute apart, some sharing a start_time."""
+    user_ids = {}
+    with SessionLocal() as db:
+        for n in sizes:
+            user = User(firstname="Bench", lastname=str(n), gender="x", age=30,
+                        email=f"bench-{n}@example.com", hashed_password="!", points=0)
+            db.add(user)
+            db.flush()
+            start = datetime(2024, 1, 1)
+            db.bulk_insert_mappings(DrivingSession, [
+                # var tionde session delar start_time med föregående – testar tie-breaken på id
+                {"user_id": user.id, "file_path": f"s{i}.mp4",
+                 "start_time": start + timedelta(minutes=i - (i % 10 == 1)), "duration": 60.0}
+                for i in range(n)
+            ])
+            user_ids[n] = user.id
+        db.commit()
+    return user_ids
+
+
+async def _time(fn, repeat: int) -> float:
+    await fn()  # värm upp
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+async def run(sizes, limit: int, repeat: int):
+    from sqlalchemy import select
+    from db import AsyncSessionLocal, SessionLocal, init_db, async_engine
+    from models import DrivingSession, User
+    from pagination import paginate, encode_cursor
+
+    init_db()
+    user_ids = _seed(SessionLocal, DrivingSession, User, sizes)
+
+    print(f"{'sessions':>9} {'page':>6} {'keyset ms':>10} {'offset ms':>10}")
+    async with AsyncSessionLocal() as db:
+        for n in sizes:
+            uid = user_ids[n]
+            base = select(DrivingSession).where(DrivingSession.user_id == uid)
+            ordered = base.order_by(DrivingSession.start_time.desc(), DrivingSession.id.desc())
+            for depth in (0, n // 2, max(n - limit, 0)):
+                cursor = None
+                if depth:
+                    row = (await db.execute(ordered.offset(depth - 1).limit(1))).scalars().one()
+                    cursor = encode_cursor(row.start_time, row.id)
+
+                async def keyset():
+                    rows, _ = await paginate(db, base, DrivingSession.start_time, DrivingSession.id, limit, cursor)
+                    db.expunge_all()
+                    return rows
+
+                async def offset():
+                    rows = (await db.execute(ordered.offset(depth).limit(limit))).scalars().all()
+                    db.expunge_all()
+                    return rows
+
+                # samma sida oavsett metod
+                assert [r.id for r in await keyset()] == [r.id for r in await offset()]
+                print(f"{n:>9} {depth // limit:>6} {await _time(keyset, repeat):>10.2f} "
+                      f"{await _time(offset, repeat):>10.2f}")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _setup_env(workdir)
+        asyncio.run(run(args.sizes, args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# benchmarks/bench_pipeline.py
+#
+# Reproducible ML pipeline benchmarks on synthetic dashcam video and a stub
+# lane model. Every case runs in its own subprocess so peak RSS is per case.
+#
+#   cd backend
+#   python benchmarks/bench_pipeline.py                    # run all, compare to baseline
+#   python benchmarks/bench_pipeline.py --case video-720p  # one case
+#   python benchmarks/bench_pipeline.py --save-baseline    # store current numbers
+#
+# Exit code 1 means at least one metric regressed beyond --tolerance.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+CASES = {
+    "warp-360p":          {"kind": "warp", "size": (640, 360), "iterations": 300},
+    "warp-720p":          {"kind": "warp", "size": (1280, 720), "iterations": 200},
+    "warp-1080p":         {"kind": "warp", "size": (1920, 1080), "iterations": 100},
+    "overlay-720p":       {"kind": "overlay", "size": (1280, 720), "iterations": 40},
+    "video-360p":         {"kind": "video", "size": (640, 360), "frames": 150},
+    "video-720p":         {"kind": "video", "size": (1280, 720), "frames": 150},
+    "video-720p-parked":  {"kind": "video", "size": (1280, 720), "frames": 300, "stationary": 0.6},
+    "video-1080p":        {"kind": "video", "size": (1920, 1080), "frames": 90},
+}
+
+# Mått där högre är bättre; resten (ms, kB) är lägre-är-bättre
+HIGHER_IS_BETTER = {"fps"}
+
+
+# ─── Child: kör ett enskilt case ──────────────────────────────────────
+
+def _import_backend(workdir: str):
+    """Import inference.py against a throwaway sqlite DB and the stub model in `workdir`."""
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("MAIL_USERNAME", "bench")
+    os.environ.setdefault("MAIL_PASSWORD", "bench")
+    os.environ.setdefault("MAIL_FROM", "bench@example.com")
+    os.environ.setdefault("MAIL_SERVER", "localhost")
+    os.environ["MODEL_DIR"] = workdir
+    os.environ["INFERENCE_CACHE_MAX_ITEMS"] = "0"   # mät modellen, inte cachen
+    os.chdir(workdir)
+    os.makedirs("static", exist_ok=True)
+    sys.path.insert(0, BACKEND_DIR)
+    import inference
+    inference.model_registry.load("lane", "stub", "stub_lane.onnx", activate=True)
+    return inference
+
+
+def _stage_means_ms(family, **match) -> dict:
+    means = {}
+    for key, hist in family.series():
+        labels = dict(key)
+        if all(labels.get(k) == v for k, v in match.items()) and hist.count:
+            means[f"stage_{labels['stage']}_ms"] = round(hist.total / hist.count * 1000, 3)
+    return means
+
+
+def _alloc_kb(samples: list) -> float:
+    return round(sum(samples) / len(samples) / 1024, 1) if samples else 0.0
+
+
+def _run_warp(ml, case):
+    import numpy as np
+    from synthetic import draw_road_frame
+
+    w, h = case["size"]
+    frame = draw_road_frame(w, h, 0)
+    src_pts = np.float32([[0, h * 0.88], [w, h * 0.88], [w, h * 0.37], [0, h * 0.37]])
+    n = case["iterations"]
+
+    start = time.perf_counter()
+    for _ in range(n):
+        ml.perspective_warp(frame, src_pts, (1640, 590), crop_bottom=-40)
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    allocs = []
+    tracemalloc.start()
+    for _ in range(min(n, 20)):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        ml.perspective_warp(frame, src_pts, (1640, 590), crop_bottom=-40)
+        allocs.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return {"fps": round(n / elapsed, 2), "stage_warp_ms": round(elapsed / n * 1000, 3),
+            "peak_rss_kb": rss, "alloc_kb_per_frame": _alloc_kb(allocs)}
+
+
+class _Upload:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    async def read(self):
+        return self.content
+
+
+def _run_overlay(ml, case):
+    import cv2
+    from synthetic import draw_road_frame
+
+    w, h = case["size"]
+    n = case["iterations"]
+    images = [cv2.imencode(".jpg", draw_road_frame(w, h, t))[1].tobytes() for t in range(n)]
+
+    async def run_all(batch):
+        for content in batch:
+            await ml.lane_overlay(_Upload(content))
+
+    start = time.perf_counter()
+    asyncio.run(run_all(images))
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stages = _stage_means_ms(ml.endpoint_stage_seconds, endpoint="lane_overlay")
+
+    allocs = []
+    tracemalloc.start()
+    for content in images[:10]:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        asyncio.run(run_all([content]))
+        allocs.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return {"fps": round(n / elapsed, 2), **stages, "peak_rss_kb": rss,
+            "alloc_kb_per_frame": _alloc_kb(allocs)}
+
+
+def _run_video(ml, case, workdir):
+    from synthetic import write_synthetic_video
+
+    w, h = case["size"]
+    src = write_synthetic_video(os.path.join(workdir, "input.mp4"), w, h, case["frames"],
+                                stationary_ratio=case.get("stationary", 0.0))
+
+    start = time.perf_counter()
+    stats = ml.run_model_on_video(src, os.path.join(workdir, "out.mp4"), progress_key="bench")
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stages = _stage_means_ms(ml.job_stage_seconds, job="bench")
+
+    # Per-frame allokering via pipelinens egen per-frame-hook (FrameTracer)
+    allocs = []
+
+    class AllocTracer(ml.FrameTracer):
+        def start_frame(self, timer):
+            self._base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        def end_frame(self, timer, frame_idx, **extra):
+            allocs.append(tracemalloc.get_traced_memory()[1] - self._base)
+
+    ml.FrameTracer = AllocTracer
+    short = write_synthetic_video(os.path.join(workdir, "short.mp4"), w, h, 20)
+    tracemalloc.start()
+    ml.run_model_on_video(short, os.path.join(workdir, "short_out.mp4"), progress_key="bench-alloc")
+    tracemalloc.stop()
+    return {"fps": round(stats["frames"] / elapsed, 2), "skipped_frames": stats["skipped_frames"],
+            **stages, "peak_rss_kb": rss, "alloc_kb_per_frame": _alloc_kb(allocs)}
+
+
+def run_child(name: str) -> dict:
+    case = CASES[name]
+    sys.path.insert(0, BENCH_DIR)
+    from synthetic import write_stub_lane_model
+
+    with tempfile.TemporaryDirectory(prefix="safedrive-bench-") as workdir:
+        write_stub_lane_model(os.path.join(workdir, "stub_lane.onnx"))
+        ml = _import_backend(workdir)
+        if case["kind"] == "warp":
+            return _run_warp(ml, case)
+        if case["kind"] == "overlay":
+            return _run_overlay(ml, case)
+        return _run_video(ml, case, workdir)
+
+
+# ─── Parent: kör cases, jämför mot baseline ───────────────────────────
+
+def run_case(name: str) -> dict:
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name],
+                          capture_output=True, text=True, cwd=BACKEND_DIR)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{proc.stderr[-2000:]}")
+    # Backendens loggar kan hamna på stdout; resultatet är sista raden.
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            ref = base.get(metric)
+            if not ref or metric == "skipped_frames":
+                continue
+            change = (value - ref) / ref
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append((name, metric, ref, value, change))
+    return regressions
+
+
+def machine_info() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine(),
+            "processor": platform.processor(), "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SafeDrive ML pipeline benchmarks")
+    parser.add_argument("--case", action="append", choices=sorted(CASES), help="run only these cases")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child)))
+        return 0
+
+    results = {}
+    for name in args.case or CASES:
+        results[name] = run_case(name)
+        print(f"{name:20s} " + "  ".join(f"{k}={v}" for k, v in results[name].items()))
+
+    report = {"machine": machine_info(), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline first.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != report["machine"]:
+        print("\n⚠️ Baseline was recorded on a different machine, numbers may not be comparable.")
+    regressions = compare(results, baseline, args.tolerance)
+    if not regressions:
+        print(f"\nNo regressions beyond {args.tolerance:.0%}.")
+        return 0
+    print("\nRegressions:")
+    for name, metric, ref, value, change in regressions:
+        print(f"  {name:20s} {metric:28s} {ref} -> {value} ({change:+.1%})")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
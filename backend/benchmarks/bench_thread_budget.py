@@ -0,0 +1,134 @@
+# benchmarks/bench_thread_budget.py
+#
+# Aggregate throughput of N conversion jobs running at once in one worker
+# (as BackgroundTasks do), with the thread budget on and off. Off is the old
+# behaviour: OpenCV's pool and each FFmpeg decoder size themselves to the
+# whole machine, so N jobs oversubscribe the CPU N times, and ORT's threads
+# spin while they wait. Each mode runs in its own subprocess because the
+# budget is read at import.
+#
+#   cd backend
+#   python benchmarks/bench_thread_budget.py
+#   python benchmarks/bench_thread_budget.py --jobs 1 2 4 8 --frames 120 --size 1280x720
+#   python benchmarks/bench_thread_budget.py --model ../assets/models/lane_net.onnx   # the real model
+#
+# The stub model is cheap, so with it the difference comes from OpenCV and
+# the decoder; the real lane model adds the effect of ORT's non-spinning pool.
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+
+# ─── Child: N jobb samtidigt i en process ─────────────────────────────
+
+def run_child(jobs: int, frames: int, size: str, model: str) -> dict:
+    sys.path.insert(0, BENCH_DIR)
+    from synthetic import write_synthetic_video, write_stub_lane_model
+
+    w, h = (int(v) for v in size.split("x"))
+    with tempfile.TemporaryDirectory(prefix="safedrive-budget-") as workdir:
+        if model:
+            shutil.copy(model, os.path.join(workdir, "lane.onnx"))
+        else:
+            write_stub_lane_model(os.path.join(workdir, "lane.onnx"))
+        sources = [write_synthetic_video(os.path.join(workdir, f"input-{i}.mp4"), w, h, frames, seed=i)
+                   for i in range(jobs)]
+
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        os.environ["MODEL_DIR"] = workdir
+        os.environ["THREAD_BUDGET_DIR"] = os.path.join(workdir, "budget")   # inte värdens riktiga jobb
+        os.environ["FRAME_SKIP_THRESHOLD"] = "0"                           # mät varje frame
+        os.chdir(workdir)
+        os.makedirs("static", exist_ok=True)
+        sys.path.insert(0, BACKEND_DIR)
+        import inference as ml
+        ml.model_registry.load("lane", "bench", "lane.onnx", activate=True)
+
+        # Värm upp sessionen och avkodaren
+        warm = write_synthetic_video(os.path.join(workdir, "warm.mp4"), w, h, 5)
+        with ml.thread_budget.job("warmup") as lease:
+            ml.run_model_on_video(warm, os.path.join(workdir, "warm_out.mp4"), lease=lease)
+
+        results, errors = [], []
+        barrier = threading.Barrier(jobs)
+
+        def job(i):
+            try:
+                barrier.wait()
+                t0 = time.perf_counter()
+                with ml.thread_budget.job(f"bench-{i}") as lease:
+                    stats = ml.run_model_on_video(sources[i], os.path.join(workdir, f"out-{i}.mp4"),
+                                                  progress_key=f"bench-{i}", lease=lease)
+                results.append((stats["frames"], time.perf_counter() - t0))
+            except Exception as e:
+                errors.append(repr(e))
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=job, args=(i,)) for i in range(jobs)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        wall = time.perf_counter() - start
+        if errors:
+            raise RuntimeError(errors[0])
+
+    total_frames = sum(f for f, _ in results)
+    return {
+        "fps": round(total_frames / wall, 2),
+        "job_s_mean": round(sum(s for _, s in results) / len(results), 2),
+        "job_s_max": round(max(s for _, s in results), 2),
+        "threads_per_job": ml.thread_budget.share(jobs) if ml.thread_budget.enabled else None,
+    }
+
+
+# ─── Parent ───────────────────────────────────────────────────────────
+
+def run_mode(enabled: bool, jobs: int, args) -> dict:
+    env = dict(os.environ, THREAD_BUDGET_ENABLED="true" if enabled else "false")
+    if args.cores:
+        env["CPU_THREAD_BUDGET"] = str(args.cores)
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", str(jobs), str(args.frames), args.size,
+           args.model or ""]
+    proc = subprocess.run(cmd, env=env, cwd=BACKEND_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{'on' if enabled else 'off'}/{jobs} failed:\n{proc.stderr[-2000:]}")
+    # Backendens loggar kan hamna på stdout; resultatet är sista raden.
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--frames", type=int, default=90, help="frames per job")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--cores", type=int, help="CPU_THREAD_BUDGET (default: all available)")
+    parser.add_argument("--model", help="ONNX lane model to use instead of the stub")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        jobs, frames, size, model = args.child
+        print(json.dumps(run_child(int(jobs), int(frames), size, model or None)))
+        return
+
+    print(f"{'budget':<7} {'jobs':>5} {'threads/job':>12} {'total fps':>10} {'job s mean':>11} {'job s max':>10}")
+    for jobs in args.jobs:
+        for enabled in (False, True):
+            r = run_mode(enabled, jobs, args)
+            print(f"{'on' if enabled else 'off':<7} {jobs:>5} {str(r['threads_per_job'] or 'all'):>12} "
+                  f"{r['fps']:>10} {r['job_s_mean']:>11} {r['job_s_max']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/synthetic.py
+#
+# Synthetic inputs for the ML pipeline benchmarks: procedurally drawn dashcam
+# video and a tiny stand-in ONNX model with the same (1,201,18,4) output
+# contract as lane_net.onnx, so the benchmarks run offline on any CPU.
+
+import cv2
+import numpy as np
+
+LANE_INPUT_SHAPE = (1, 3, 288, 800)
+LANE_OUTPUT_SHAPE = (1, 201, 18, 4)
+
+
+def draw_road_frame(width: int, height: int, t: int, moving: bool = True) -> np.ndarray:
+    """One dashcam-like frame: sky, road trapezoid and dashed lane markings."""
+    frame = np.empty((height, width, 3), np.uint8)
+    horizon = int(height * 0.4)
+    frame[:horizon] = np.linspace(200, 140, horizon, dtype=np.uint8)[:, None, None]
+    frame[horizon:] = (60, 60, 60)
+
+    road = np.array([[0, height], [width, height],
+                     [int(width * 0.58), horizon], [int(width * 0.42), horizon]], np.int32)
+    cv2.fillPoly(frame, [road], (85, 85, 85))
+
+    # Streckade linjer som rör sig mot kameran när bilen kör
+    offset = (t * 6) % 40 if moving else 0
+    for lane_x in (0.15, 0.5, 0.85):
+        x_bottom = int(width * lane_x)
+        x_top = int(width * (0.42 + 0.16 * lane_x))
+        for y in range(horizon + offset, height, 40):
+            a = (y - horizon) / (height - horizon)
+            a2 = min(1.0, (y + 20 - horizon) / (height - horizon))
+            p1 = (int(x_top + (x_bottom - x_top) * a), y)
+            p2 = (int(x_top + (x_bottom - x_top) * a2), min(height - 1, y + 20))
+            cv2.line(frame, p1, p2, (240, 240, 240), max(2, width // 320))
+    return frame
+
+
+def write_synthetic_video(path: str, width: int, height: int, frames: int,
+                          fps: int = 30, stationary_ratio: float = 0.0, seed: int = 0) -> str:
+    """
+    Write an mp4 with `frames` frames. The last `stationary_ratio` of the video
+    is a parked car (identical frames plus sensor noise), to exercise frame skipping.
+    """
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    moving_frames = int(frames * (1.0 - stationary_ratio))
+    for t in range(frames):
+        moving = t < moving_frames
+        frame = draw_road_frame(width, height, t if moving else moving_frames, moving)
+        noise = rng.integers(-2, 3, frame.shape, dtype=np.int16)
+        writer.write(np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    writer.release()
+    return path
+
+
+def write_stub_lane_model(path: str, seed: int = 0) -> str:
+    """
+    Tiny ONNX graph: input (1,3,288,800) -> 96x160 average pool -> flatten ->
+    dense -> reshape to (1,201,18,4). Input-dependent, deterministic and cheap.
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(seed)
+    pool = (96, 160)
+    pooled = 3 * (LANE_INPUT_SHAPE[2] // pool[0]) * (LANE_INPUT_SHAPE[3] // pool[1])
+    out_size = int(np.prod(LANE_OUTPUT_SHAPE))
+    weight = rng.normal(0, 4.0 / np.sqrt(pooled), (pooled, out_size)).astype(np.float32)
+    bias = rng.normal(0, 1.0, (out_size,)).astype(np.float32)
+
+    nodes = [
+        helper.make_node("AveragePool", ["input"], ["pooled"], kernel_shape=list(pool), strides=list(pool)),
+        helper.make_node("Reshape", ["pooled", "flat_shape"], ["flat"]),
+        helper.make_node("Gemm", ["flat", "weight", "bias"], ["dense"]),
+        helper.make_node("Reshape", ["dense", "out_shape"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "stub_lane_net",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, list(LANE_INPUT_SHAPE))],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, list(LANE_OUTPUT_SHAPE))],
+        initializer=[
+            numpy_helper.from_array(np.array([1, pooled], np.int64), "flat_shape"),
+            numpy_helper.from_array(weight, "weight"),
+            numpy_helper.from_array(bias, "bias"),
+            numpy_helper.from_array(np.array(LANE_OUTPUT_SHAPE, np.int64), "out_shape"),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7  # läsbar av äldre onnxruntime-versioner
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
@@ -0,0 +1,102 @@
+# cache_versions.py
+#
+# DB-stored version counters for process-local caches (quiz answer key,
+# quiz catalog, reward catalog). Writers bump the counter in the same
+# transaction as their change; every worker compares its cached version with
+# one primary-key read and reloads only when it differs. The check and the
+# reload always run on the primary, also when the caller holds a read-replica
+# session: the same cached value is used by write paths (claim_reward,
+# grade_quiz), so it must never be rebuilt from a lagging replica.
+
+import asyncio
+import os
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from db import AsyncSessionLocal, async_engine, async_read_engine
+from models import CacheVersion
+
+CACHE_REVALIDATE_SECONDS = float(os.getenv("CACHE_REVALIDATE_SECONDS", "30"))
+
+
+async def get_version(db: AsyncSession, name: str) -> int:
+    return await db.scalar(select(CacheVersion.version).where(CacheVersion.name == name)) or 0
+
+
+async def bump_version(db: AsyncSession, name: str):
+    """Increment the counter (creating it if needed). The caller commits."""
+    result = await db.execute(
+        update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.add(CacheVersion(name=name, version=1))
+
+
+def bump_version_sync(db: Session, name: str):
+    """Same as bump_version, for scripts using the sync SessionLocal (e.g. seed_quiz.py)."""
+    result = db.execute(
+        update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.add(CacheVersion(name=name, version=1))
+
+
+def _on_replica(db: AsyncSession) -> bool:
+    return async_read_engine is not async_engine and db.bind is async_read_engine
+
+
+class VersionedCache:
+    """
+    Process-local value tied to a cache_versions counter. At most every
+    `revalidate_seconds` one primary-key read checks the counter; the value is
+    rebuilt with `_load()` only when the version changed.
+    """
+
+    name = None
+
+    def __init__(self, revalidate_seconds: float = CACHE_REVALIDATE_SECONDS):
+        self.revalidate_seconds = revalidate_seconds
+        self.version = None
+        self.value = None
+        self._checked_at = 0.0
+        self._invalidations = 0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.version is not None and time.monotonic() - self._checked_at < self.revalidate_seconds
+
+    async def get(self, db: AsyncSession):
+        if self._fresh():
+            return self.value
+        async with self._lock:
+            if self._fresh():
+                return self.value
+            if _on_replica(db):
+                async with AsyncSessionLocal() as primary:
+                    await self._refresh(primary)
+            else:
+                await self._refresh(db)
+            return self.value
+
+    async def _refresh(self, db: AsyncSession):
+        invalidations = self._invalidations
+        version = await get_version(db, self.name)
+        if version != self.version:
+            self.value = await self._load(db, version)
+            self.version = version
+        if invalidations == self._invalidations:
+            self._checked_at = time.monotonic()
+        else:
+            self.version = None   # invaliderad under bygget: kan vara gamla data, kontrollera igen
+
+    async def _load(self, db: AsyncSession, version: int):
+        raise NotImplementedError
+
+    def invalidate(self):
+        """Force a version check on the next lookup in this process."""
+        self._invalidations += 1
+        self._checked_at = 0.0
+        self.version = None
@@ -0,0 +1,120 @@
+# fast_json.py
+#
+# Fast response path for the list endpoints (FAST_JSON_ENABLED, on by
+# default). FastAPI's default path validates the returned ORM objects against
+# response_model, converts the result with jsonable_encoder and then
+# json.dumps it. Here a prebuilt
+# TypeAdapter validates once (from attributes) and pydantic-core writes the
+# JSON bytes directly. Plain dicts (the depth map) go through orjson when it
+# is installed, which also writes numpy arrays without a .tolist() copy.
+# Bodies above JSON_COMPRESS_MIN_BYTES are gzipped if the client accepts it.
+#
+# Benchmark against the default path: python benchmarks/bench_json.py
+
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:   # valfritt beroende; pydantic-vägen behöver det inte
+    orjson = None
+
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "true").lower() in ("1", "true", "yes")
+JSON_COMPRESS_MIN_BYTES = int(os.getenv("JSON_COMPRESS_MIN_BYTES", "1024"))
+JSON_COMPRESS_LEVEL = int(os.getenv("JSON_COMPRESS_LEVEL", "5"))
+# Komprimerade versioner av cachade kroppar (katalogerna), nyckel = ETag
+_GZIP_CACHE_ITEMS = 32
+
+_adapters = {}
+_adapters_lock = threading.Lock()
+_gzip_cache = OrderedDict()
+_gzip_lock = threading.Lock()
+
+
+def list_adapter(schema) -> TypeAdapter:
+    """TypeAdapter(List[schema]), built once per schema."""
+    adapter = _adapters.get(schema)
+    if adapter is None:
+        with _adapters_lock:
+            adapter = _adapters.get(schema)
+            if adapter is None:
+                adapter = _adapters[schema] = TypeAdapter(List[schema])
+    return adapter
+
+
+def dump_list(schema, rows) -> bytes:
+    adapter = list_adapter(schema)
+    # by_alias som FastAPI:s response_model, annars ändras fältnamnen (avatar_url -> avatarUrl)
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True), by_alias=True)
+
+
+def _default(obj):
+    if hasattr(obj, "tolist"):   # numpy-arrayer och -skalärer
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def dump_dict(content) -> bytes:
+    """Plain dict/list payloads (numpy arrays allowed) as JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _accepts_gzip(request: Request) -> bool:
+    accept = request.headers.get("accept-encoding", "") if request is not None else ""
+    return any(part.split(";")[0].strip() in ("gzip", "*") for part in accept.split(","))
+
+
+def json_bytes_response(body: bytes, request: Request = None, status_code: int = 200,
+                        headers: dict = None, cache_key: str = None) -> Response:
+    """JSON bytes as a Response, gzipped when large enough and accepted by the client."""
+    headers = dict(headers or {})
+    if len(body) >= JSON_COMPRESS_MIN_BYTES:
+        headers["Vary"] = "Accept-Encoding"
+        if _accepts_gzip(request):
+            body = _gzip(body, cache_key)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def _gzip(body: bytes, cache_key: str = None) -> bytes:
+    if cache_key is None:
+        return gzip.compress(body, JSON_COMPRESS_LEVEL)
+    with _gzip_lock:
+        compressed = _gzip_cache.get(cache_key)
+        if compressed is not None:
+            _gzip_cache.move_to_end(cache_key)
+            return compressed
+    compressed = gzip.compress(body, JSON_COMPRESS_LEVEL)
+    with _gzip_lock:
+        _gzip_cache[cache_key] = compressed
+        while len(_gzip_cache) > _GZIP_CACHE_ITEMS:
+            _gzip_cache.popitem(last=False)
+    return compressed
+
+
+def list_response(schema, rows, request: Request = None, headers: dict = None):
+    """
+    Fast path for `response_model=List[schema]` endpoints. With
+    FAST_JSON_ENABLED=false the rows are returned unchanged, so FastAPI's
+    default serialization runs (and headers go on the injected Response).
+    """
+    if not FAST_JSON_ENABLED:
+        return rows
+    return json_bytes_response(dump_list(schema, rows), request, headers=headers)
+
+
+def model_response(schema, obj, request: Request = None, headers: dict = None):
+    """Same as list_response, for a single `response_model=schema` object or dict."""
+    if not FAST_JSON_ENABLED:
+        return obj
+    return json_bytes_response(schema.model_validate(obj, from_attributes=True).model_dump_json(by_alias=True).encode("utf-8"),
+                               request, headers=headers)
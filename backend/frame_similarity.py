@@ -0,0 +1,56 @@
+# frame_similarity.py
+#
+# Cheap change detector for dashcam video. Frames that barely differ from the
+# last fully processed frame (red lights, traffic jams) can reuse its lane
+# result instead of running warp + inference + overlay again.
+
+import os
+
+import cv2
+import numpy as np
+
+# Medelabsolutdifferens (0-255) på den nedskalade ROI:n. 0 stänger av skippningen.
+FRAME_SKIP_THRESHOLD = float(os.getenv("FRAME_SKIP_THRESHOLD", "2.0"))
+# Kör full inferens minst var N:e frame även om bilden står still.
+FRAME_SKIP_MAX_CONSECUTIVE = int(os.getenv("FRAME_SKIP_MAX_CONSECUTIVE", "30"))
+
+THUMB_SIZE = (64, 24)  # (W, H), ungefär samma bildförhållande som ROI:n
+
+
+class FrameChangeDetector:
+    """
+    Compares a downsampled grayscale thumbnail of the road ROI against the
+    last frame that was fully processed. Comparing against the reference
+    (not the previous frame) keeps slow drift from accumulating unnoticed.
+    """
+
+    def __init__(self, threshold: float = FRAME_SKIP_THRESHOLD,
+                 max_consecutive: int = FRAME_SKIP_MAX_CONSECUTIVE,
+                 roi_top: float = 0.37, roi_bottom: float = 0.88):
+        self.threshold = threshold
+        self.max_consecutive = max_consecutive
+        self.roi_top = roi_top
+        self.roi_bottom = roi_bottom
+        self.reference = None
+        self.consecutive = 0
+        self.skipped = 0
+        self.last_score = None
+
+    def _thumbnail(self, frame_bgr):
+        h = frame_bgr.shape[0]
+        roi = frame_bgr[int(h * self.roi_top):int(h * self.roi_bottom)]
+        small = cv2.resize(roi, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def should_skip(self, frame_bgr) -> bool:
+        """True if the frame can reuse the previous result. Updates the reference otherwise."""
+        thumb = self._thumbnail(frame_bgr)
+        if self.threshold > 0 and self.reference is not None and self.consecutive < self.max_consecutive:
+            self.last_score = float(np.abs(thumb - self.reference).mean())
+            if self.last_score < self.threshold:
+                self.consecutive += 1
+                self.skipped += 1
+                return True
+        self.reference = thumb
+        self.consecutive = 0
+        return False
@@ -0,0 +1,641 @@
+# inference.py
+#
+# The ML endpoints (lane overlay, depth maps, video conversion, model
+# registry) and everything they import: OpenCV, onnxruntime, scipy, PIL and
+# the ONNX models themselves, loaded on startup. Kept out of main.py so a
+# CRUD-only worker (INFERENCE_MODE=off) starts without any of it. main.py
+# includes `router` when INFERENCE_MODE=inline (the default); inference_app.py
+# serves it on its own for a separate inference process.
+
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+import scipy.special
+from PIL import Image
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from db import get_db
+from fast_json import dump_dict
+from frame_similarity import FrameChangeDetector, FRAME_SKIP_THRESHOLD
+from inference_cache import inference_cache, make_key, CachedResponse
+from inference_ipc import INFERENCE_SOCKET, RemoteRegistry, InferenceServerUnavailable
+from logging_setup import log_event, sampler
+from media import UPLOAD_DIR, probe_duration
+from metrics import StageTimer, FrameTracer, endpoint_stage_seconds, job_stage_seconds, TRACE_SAMPLE_RATE
+from model_registry import model_registry, load_default_models, ModelNotLoaded
+from models import DrivingSession
+from schemas import ModelLoadRequest, ModelCanaryRequest
+from thread_budget import thread_budget
+
+logger = logging.getLogger("safedrive")
+
+if INFERENCE_SOCKET:
+    # Modellerna bor i inference_server.py (en gång per värd); samma API som ModelRegistry
+    model_registry = RemoteRegistry(INFERENCE_SOCKET)
+
+router = APIRouter()
+
+# OpenCV:s trådpool är processglobal: följ andelen per jobb (hela budgeten utan jobb)
+thread_budget.on_rebalance(cv2.setNumThreads)
+
+# Gloabal variable to track conversion status
+conversion_status = {}
+video_progress = {}
+
+DEPTH_SCALE = 2.680260
+DEPTH_BOX_OFFSET = 7     # Y-offset (neråt)
+DEPTH_BOX_OFFSET_X = 7  # X-offset (höger)
+DEPTH_BOX_SIZE = 8 
+
+# —————— ONNX runtime globals ——————
+# Modellerna (lane, depth) laddas i model_registry vid startup
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], np.float32)
+
+
+def to_model_input(pil: Image.Image, size) -> np.ndarray:
+    """
+    Resize (H, W), scale to [0, 1] and ImageNet-normalize into a (1, 3, H, W)
+    float32 array. Same steps as torchvision's Resize/ToTensor/Normalize on a
+    PIL image, without importing torch.
+    """
+    h, w = size
+    x = np.asarray(pil.resize((w, h), Image.BILINEAR), np.float32) / 255.0
+    x = (x - IMAGENET_MEAN) / IMAGENET_STD
+    return np.ascontiguousarray(x.transpose(2, 0, 1)[None])
+
+
+def depth_transform(pil: Image.Image) -> np.ndarray:
+    return to_model_input(pil, (192, 640))  # Anpassa till din models input
+
+# —————— ONNX runtime setup ——————
+row_anchor = np.array([121, 131, 141, 150, 160, 170, 180, 189, 199, 209, 219, 228, 238, 248, 258, 267, 277, 287])   # your culane_row_anchor
+col_sample  = np.linspace(0, 800-1, 200)
+buffers     = [deque(maxlen=5) for _ in range(4)]
+
+
+def infer_transform(pil: Image.Image) -> np.ndarray:
+    return to_model_input(pil, (288, 800))
+
+@router.on_event("startup")
+def load_onnx():
+    if not INFERENCE_SOCKET:
+        load_default_models()
+        return
+    try:
+        logger.info(f"Using inference server at {INFERENCE_SOCKET}: {model_registry.health()['models']}")
+    except InferenceServerUnavailable as e:
+        # Starta ändå; anropen ger 503 tills servern är uppe
+        logger.warning(f"Inference server at {INFERENCE_SOCKET} not reachable yet: {e}")
+
+async def inference_unavailable_handler(request: Request, exc: InferenceServerUnavailable):
+    # Registreras av appen som inkluderar routern (main.py, inference_app.py)
+    return JSONResponse(status_code=503, content={"detail": "Inference server unavailable, try again."},
+                        headers={"Retry-After": "2"})
+
+def acquire_model(name: str):
+    # Anropas via run_in_threadpool: mot inference_server.py kan det bli ett IPC-anrop
+    try:
+        return model_registry.acquire(name)
+    except ModelNotLoaded:
+        raise HTTPException(status_code=500, detail=f"Modellen '{name}' är inte laddad.")
+
+def cached_response(entry: CachedResponse, hit: bool) -> Response:
+    headers = {**entry.headers, "X-Cache": "HIT" if hit else "MISS"}
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+def perspective_warp(img, src_pts, dst_size, crop_bottom=0):
+    """
+    Warps the perspective of img from src_pts (4 points) to a rectangle of size dst_size (W, H).
+    """
+    W, H = dst_size
+    dst_pts = np.float32([
+        [0, H - crop_bottom],      # bottom-left
+        [W, H - crop_bottom],      # bottom-right
+        [W, 0],      # top-right
+        [0, 0],      # top-left
+    ])
+    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+    warped = cv2.warpPerspective(img, M, (W, H))
+    return warped
+
+def open_capture(path: str, threads: int = None) -> cv2.VideoCapture:
+    """VideoCapture whose FFmpeg decoder uses `threads` threads (FFmpeg's own default is one per core)."""
+    if threads is not None and hasattr(cv2, "CAP_PROP_N_THREADS"):   # OpenCV 4.6+
+        return cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_N_THREADS, threads])
+    return cv2.VideoCapture(path)
+
+def run_model_on_video(input_path: str, output_path: str, progress_key: str = None,
+                       skip_threshold: float = None, trace_sample: float = None, lease=None):
+    # lease: thread_budget-andel för jobbet, läses om under jobbets gång (se frame-loopen)
+    decoder_threads = lease.threads if lease else None
+    cap = open_capture(input_path, decoder_threads)
+    resizable_decoder = decoder_threads is not None and hasattr(cv2, "CAP_PROP_N_THREADS")
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open '{input_path}'")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 20
+
+    # Hela videon körs på samma modellversion
+    lane_model = model_registry.acquire("lane")
+
+    # --- Model input/output sizes ---
+    ROI_W = 1640
+    ROI_H = 590                  # Try 480 or higher
+
+    KB = 11
+    NUM_LANES = 4  # or whatever your model expects
+    buffers = [deque(maxlen=KB) for _ in range(NUM_LANES)]
+
+
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    out = cv2.VideoWriter(output_path, fourcc, fps, (ROI_W, ROI_H))
+
+    logger = logging.getLogger("uvicorn")
+    logger.info(f"Starting conversion: {input_path} → {output_path} (lane model {lane_model.version})")
+
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_idx = 0
+    redline_times = []
+    detector = FrameChangeDetector(FRAME_SKIP_THRESHOLD if skip_threshold is None else skip_threshold)
+    last_img, last_red_lines = None, 0
+    job = progress_key or os.path.basename(output_path)
+    timer = StageTimer(job_stage_seconds, job=job)
+    tracer = FrameTracer(output_path.replace('.mp4', '_trace.jsonl'),
+                         TRACE_SAMPLE_RATE if trace_sample is None else trace_sample)
+    while True:
+        tracer.start_frame(timer)
+        timer.reset()
+        ret, frame_bgr = cap.read()
+        if not ret or frame_bgr is None:
+            break
+        frame_idx += 1
+        timer.mark("decode")
+        if lease is not None:
+            # Läser om andelen (andra workers högst var THREAD_BUDGET_REFRESH_SECONDS); en
+            # ändring ger cv2.setNumThreads via on_rebalance
+            threads = lease.threads
+            if resizable_decoder and threads != decoder_threads:
+                # False: backenden låser avkodarens trådar när videon öppnas
+                resizable_decoder = cap.set(cv2.CAP_PROP_N_THREADS, threads)
+                decoder_threads = threads
+
+        skipped = detector.should_skip(frame_bgr) and last_img is not None
+        timer.mark("change_detect")
+        if skipped:
+            # Nästan identisk med senast bearbetade frame: återanvänd lane-resultat och overlay
+            img_bgr = last_img
+            red_lines_this_frame = last_red_lines
+        else:
+            # 1) Apply distortion to the full frame
+            frame_h, frame_w = frame_bgr.shape[:2]
+
+            # 1) Define your source points (adjust as needed)
+            src_pts = np.float32([
+            [frame_w * 0.0, frame_h * 0.88],    # bottom-left
+            [frame_w * 1.0, frame_h * 0.88],    # bottom-right
+            [frame_w * 1.0, frame_h * 0.37],     # top-right
+            [frame_w * 0.0, frame_h * 0.37],     # top-left
+            ])
+
+            # 2) Define output size (same as ROI_W, ROI_H)
+            dst_size = (ROI_W, ROI_H)
+
+            # 3) Apply perspective warp
+            warped = perspective_warp(frame_bgr, src_pts, dst_size, crop_bottom=-40)
+            timer.mark("warp")
+
+            # 4) Use 'warped' instead of 'roi' for further processing
+            roi_resized = warped  # Already the right size
+
+            # --- Visual debugging: save the first ROI frame ---
+            if frame_idx == 1:
+                cv2.imwrite("debug_roi.jpg", roi_resized)
+            # --- end visual debugging ---
+
+            # 4) Preprocess for ONNX/model
+            orig_h, orig_w = roi_resized.shape[:2]
+            pil = Image.fromarray(cv2.cvtColor(roi_resized, cv2.COLOR_BGR2RGB))
+            x = infer_transform(pil)
+            timer.mark("preprocess")
+
+            # 5) Model inference
+            outp = lane_model.run({"input": x})[0]    # shape (1,201,18,4)
+            timer.mark("inference")
+            logits = outp[0][:, ::-1, :]                 # flip Y
+
+            prob = scipy.special.softmax(logits[:-1], axis=0)
+            idx = (np.arange(col_sample.shape[0]) + 1).reshape(-1,1,1)
+            loc = np.sum(prob * idx, axis=0)
+            argm = np.argmax(logits, axis=0)
+            loc[argm == col_sample.shape[0]] = 0
+
+            for lane in range(len(buffers)):
+                buffers[lane].append(loc[:, lane].copy())
+                # Stack buffer and ignore zeros for median
+                arr = np.stack(buffers[lane], axis=0)
+                # Mask zeros
+                arr_masked = np.where(arr == 0, np.nan, arr)
+                loc[:, lane] = np.nanmedian(arr_masked, axis=0)
+                # If all are nan, fallback to original
+                loc[:, lane][np.isnan(loc[:, lane])] = loc[:, lane][np.isnan(loc[:, lane])]
+            timer.mark("postprocess")
+
+            # 6) Draw overlays
+            img_bgr = roi_resized.copy()
+            sx = orig_w / 800.0
+            sy = orig_h / 288.0
+            red_lines_this_frame = 0
+            for lane in range(loc.shape[1]):
+                pts = []
+                for r in range(loc.shape[0]):
+                    xbin = loc[r, lane]
+                    if xbin > 0:
+                        px = int(xbin * (col_sample[1] - col_sample[0]) * sx)
+                        py = int(row_anchor[loc.shape[0]-1-r] * sy)
+                        pts.append((px, py))
+                        cv2.circle(img_bgr, (px,py), 3, (255,0,255), -1)
+                if len(pts) >= 5:  # Need enough points for a good fit
+                    pts_np = np.array(pts)
+                    # Fit a 2nd degree polynomial (quadratic curve): x = f(y)
+                    z = np.polyfit(pts_np[:,1], pts_np[:,0], 2)
+                    f = np.poly1d(z)
+                    y_new = np.linspace(pts_np[:,1].min(), pts_np[:,1].max(), 50)
+                    x_new = f(y_new)
+                    curve_pts = np.array([x_new, y_new], dtype=np.int32).T
+
+                    # Color logic
+                    mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
+                    sx0, sy0 = pts[0]
+                    col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
+
+                    if col == (0,0,255) and sx0 < mid_x:  # left of car and red
+                        red_lines_this_frame += 1
+
+                    cv2.polylines(img_bgr, [curve_pts], False, col, 2)
+                elif len(pts) >= 2:
+                    # Color logic
+                    mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
+                    sx0, sy0 = pts[0]
+                    col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
+
+                    if col == (0,0,255) and sx0 < mid_x:  # left of car and red
+                        red_lines_this_frame += 1
+
+                    for i in range(len(pts)-1):
+                        cv2.line(img_bgr, pts[i], pts[i+1], col, 2)
+
+            last_img, last_red_lines = img_bgr, red_lines_this_frame
+            timer.mark("draw")
+
+        # ... draw lane overlays on img_bgr ...
+        if red_lines_this_frame >= 2:
+            redline_times.append(frame_idx / fps)
+
+        out.write(img_bgr)
+        timer.mark("encode")
+        tracer.end_frame(timer, frame_idx, skipped=skipped)
+
+        if progress_key:
+            video_progress[progress_key] = frame_idx / total_frames
+
+        if frame_idx % 50 == 0:
+            logger.info(f"Processed {frame_idx} frames…")
+
+    if progress_key:
+        video_progress[progress_key] = 1.0  # 100% done
+
+    logger.info(f"Red lines detected in {len(redline_times)} frames")
+    logger.info(f"Skipped {detector.skipped}/{frame_idx} near-duplicate frames")
+    json_path = output_path.replace('.mp4', '_redlines.json')
+    with open(json_path, 'w') as f:
+        json.dump(redline_times, f)
+
+    cap.release()
+    out.release()
+    tracer.close()
+    logger.info(f"Finished conversion of {input_path}")
+    return {"frames": frame_idx, "skipped_frames": detector.skipped}
+
+# ─── 1) NY: POST /convert_video/ ──────────────────────────────────────
+
+
+def run_conversion_and_update_status(inp, outp, out_filename, skip_threshold=None, trace_sample=None):
+    progress_key = out_filename
+    try:
+        with thread_budget.job(out_filename) as lease:
+            stats = run_model_on_video(inp, outp, progress_key=progress_key,
+                                       skip_threshold=skip_threshold, trace_sample=trace_sample, lease=lease)
+        dur = probe_duration(outp)
+        conversion_status[out_filename] = {"status": "done", "duration": dur, **stats}
+        video_progress[progress_key] = 1.0
+    except Exception as e:
+        conversion_status[out_filename] = {"status": "error", "error": str(e)}
+        video_progress[progress_key] = -1
+
+live_buffers = [deque(maxlen=5) for _ in range(4)]
+
+
+@router.post("/docs/lane_overlay/")
+async def lane_overlay(file: UploadFile = File(...)):
+    """
+    Tar emot en bild, kör lane-detection med ONNX-modellen och returnerar bilden med overlay.
+    """
+    # Läs in bilden från klienten
+    content = await file.read()
+    timer = StageTimer(endpoint_stage_seconds, endpoint="lane_overlay")
+    lane_model = await run_in_threadpool(acquire_model, "lane")
+    cache_key = make_key("lane_overlay", lane_model.version, content)
+    cached = inference_cache.get(cache_key)
+    if cached is not None:
+        return cached_response(cached, hit=True)
+    timer.mark("cache_lookup")
+
+    np_img = np.frombuffer(content, np.uint8)
+    frame_bgr = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
+
+    if frame_bgr is None:
+        raise HTTPException(status_code=400, detail="Kunde inte läsa bilden.")
+    timer.mark("decode")
+
+    frame_h, frame_w = frame_bgr.shape[:2]
+
+    src_pts_live = np.float32([
+        [frame_w * 0.0, frame_h * 0.88],    # bottom-left
+        [frame_w * 1.0, frame_h * 0.88],    # bottom-right
+        [frame_w * 1.0, frame_h * 0.37],     # top-right
+        [frame_w * 0.0, frame_h * 0.37],     # top-left
+    ])
+    dst_size_live = (1640, 590)
+    warped = perspective_warp(frame_bgr, src_pts_live, dst_size_live, crop_bottom=0)
+    timer.mark("warp")
+
+    # --- Preprocess för ONNX ---
+    pil = Image.fromarray(cv2.cvtColor(warped, cv2.COLOR_BGR2RGB))
+    x = infer_transform(pil)
+    timer.mark("preprocess")
+
+    # --- Modell-inferens ---
+    # I trådpoolen: ORT-körningen, eller väntan på inference-servern, får inte stoppa event-loopen
+    outp = (await run_in_threadpool(lane_model.run, {"input": x}))[0]    # shape (1,201,18,4)
+    timer.mark("inference")
+    logits = outp[0][:, ::-1, :]                 # flip Y
+
+    prob = scipy.special.softmax(logits[:-1], axis=0)
+    idx = (np.arange(col_sample.shape[0]) + 1).reshape(-1,1,1)
+    loc = np.sum(prob * idx, axis=0)
+    argm = np.argmax(logits, axis=0)
+    loc[argm == col_sample.shape[0]] = 0
+    timer.mark("postprocess")
+
+    # --- Rita overlay på bilden ---
+    img_overlay = warped.copy()
+    orig_h, orig_w = img_overlay.shape[:2]
+    sx = orig_w / 800.0
+    sy = orig_h / 288.0
+    num_red_lines = 0
+    for lane in range(loc.shape[1]):
+            pts = []
+            for r in range(loc.shape[0]):
+                xbin = loc[r, lane]
+                if xbin > 0:
+                    px = int(xbin * (col_sample[1] - col_sample[0]) * sx)
+                    py = int(row_anchor[loc.shape[0]-1-r] * sy)
+                    pts.append((px, py))
+                    cv2.circle(img_overlay, (px,py), 3, (255,0,255), -1)
+            
+            # Buffer/median per lane
+            live_buffers[lane].append(loc[:, lane].copy())
+            arr = np.stack(live_buffers[lane], axis=0)
+            arr_masked = np.where(arr == 0, np.nan, arr)
+            loc[:, lane] = np.nanmedian(arr_masked, axis=0)
+            loc[:, lane][np.isnan(loc[:, lane])] = loc[:, lane][np.isnan(loc[:, lane])]
+            if len(pts) >= 5:  # Need enough points for a good fit
+                pts_np = np.array(pts)
+                # Fit a 2nd degree polynomial (quadratic curve): x = f(y)
+                z = np.polyfit(pts_np[:,1], pts_np[:,0], 2)
+                f = np.poly1d(z)
+                y_new = np.linspace(pts_np[:,1].min(), pts_np[:,1].max(), 50)
+                x_new = f(y_new)
+                curve_pts = np.array([x_new, y_new], dtype=np.int32).T
+
+                # Color logic
+                mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
+                sx0, sy0 = pts[0]
+                col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
+                if col == (0,0,255):
+                    num_red_lines += 1
+                cv2.polylines(img_overlay, [curve_pts], False, col, 2)
+            elif len(pts) >= 2:
+                # Color logic
+                mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
+                sx0, sy0 = pts[0]
+                col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
+                if col == (0,0,255):
+                    num_red_lines += 1
+                for i in range(len(pts)-1):
+                    cv2.line(img_overlay, pts[i], pts[i+1], col, 2)
+    
+    log_event(logger, logging.INFO, "lane.red_lines", "Detected %d red lines in this frame",
+              num_red_lines, red_lines=num_red_lines)
+    timer.mark("draw")
+    # --- Returnera bilden som JPEG ---
+    _, img_encoded = cv2.imencode('.jpg', img_overlay)
+    timer.mark("encode")
+    headers = {"X-Red-Lines": str(num_red_lines), "X-Model-Version": lane_model.version}
+    entry = CachedResponse(img_encoded.tobytes(), "image/jpeg", headers)
+    inference_cache.put(cache_key, entry)
+    return cached_response(entry, hit=False)
+
+@router.post("/docs/convert_video/")
+async def convert_video(
+    session_id: int,
+    background_tasks: BackgroundTasks,
+    skip_threshold: float = Query(None, ge=0.0, description="Frame-skip threshold, 0 disables skipping"),
+    trace_sample: float = Query(None, ge=0.0, le=1.0, description="Fraction of frames to dump to <video>_trace.jsonl"),
+    db: AsyncSession = Depends(get_db),
+):
+    sess = await db.get(DrivingSession, session_id)
+    if not sess:
+        raise HTTPException(404, "Session not found")
+
+    inp  = os.path.join(UPLOAD_DIR, sess.file_path)
+    base, _ = os.path.splitext(sess.file_path)
+    timestamp = int(time.time() * 1000)
+    out_filename = f"marked_{base}_{timestamp}.mp4"
+    outp = os.path.join(UPLOAD_DIR, out_filename)
+
+    # Mark as processing
+    conversion_status[out_filename] = {"status": "processing"}
+    # Start background task
+    background_tasks.add_task(run_conversion_and_update_status, inp, outp, out_filename,
+                              skip_threshold, trace_sample)
+
+    return {"marked_video_path": out_filename, "status": "processing"}
+
+@router.post("/docs/depth_map/")
+async def depth_map(file: UploadFile = File(...)):
+    """
+    Tar emot en bild, kör depth-prediktion med ONNX-modellen och returnerar depth map (meter) som PNG.
+    """
+    content = await file.read()
+    timer = StageTimer(endpoint_stage_seconds, endpoint="depth_map")
+    depth_model = await run_in_threadpool(acquire_model, "depth")
+    cache_key = make_key("depth_map", depth_model.version, content)
+    cached = inference_cache.get(cache_key)
+    if cached is not None:
+        return cached_response(cached, hit=True)
+    timer.mark("cache_lookup")
+
+    np_img = np.frombuffer(content, np.uint8)
+    frame_bgr = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
+
+    if frame_bgr is None:
+        raise HTTPException(status_code=400, detail="Kunde inte läsa bilden.")
+    timer.mark("decode")
+
+    pil = Image.fromarray(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+    x = depth_transform(pil)
+    timer.mark("preprocess")
+
+    disp = (await run_in_threadpool(depth_model.run, {"input": x}))[0]
+    timer.mark("inference")
+    disp = disp.squeeze()
+
+    # Omvandla till depth (meter)
+    depth = DEPTH_SCALE / (disp + 1e-6)
+
+    # Normalisera depth till 0-255 för PNG (valfritt: invertera så att nära är ljusare)
+    depth_norm = (255 * (depth - depth.min()) / (depth.max() - depth.min() + 1e-8)).astype(np.uint8)
+    depth_color = cv2.applyColorMap(depth_norm, cv2.COLORMAP_VIRIDIS)
+    timer.mark("postprocess")
+
+    # ...existing code in depth_map...
+
+    # Rita ut rutan i mitten (20x20 pixlar)
+    h, w = depth.shape
+    x1 = w//2 - DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET_X
+    y1 = h//2 - DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET
+    x2 = w//2 + DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET_X
+    y2 = h//2 + DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET
+    cv2.rectangle(depth_color, (x1, y1), (x2, y2), (0,255,0), 2)
+    timer.mark("draw")
+
+    _, img_encoded = cv2.imencode('.png', depth_color)
+    timer.mark("encode")
+    entry = CachedResponse(img_encoded.tobytes(), "image/png", {"X-Model-Version": depth_model.version})
+    inference_cache.put(cache_key, entry)
+    return cached_response(entry, hit=False)
+
+@router.post("/docs/depth_map_raw/")
+async def depth_map_raw(file: UploadFile = File(...)):
+    content = await file.read()
+    timer = StageTimer(endpoint_stage_seconds, endpoint="depth_map_raw")
+    depth_model = await run_in_threadpool(acquire_model, "depth")
+    cache_key = make_key("depth_map_raw", depth_model.version, content)
+    cached = inference_cache.get(cache_key)
+    if cached is not None:
+        return cached_response(cached, hit=True)
+    timer.mark("cache_lookup")
+
+    np_img = np.frombuffer(content, np.uint8)
+    frame_bgr = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
+    if frame_bgr is None:
+        raise HTTPException(status_code=400, detail="Kunde inte läsa bilden.")
+    timer.mark("decode")
+
+    pil = Image.fromarray(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+    x = depth_transform(pil)
+    timer.mark("preprocess")
+
+    disp = (await run_in_threadpool(depth_model.run, {"input": x}))[0]
+    timer.mark("inference")
+    disp = disp.squeeze()
+    depth = DEPTH_SCALE / (disp + 1e-6)  # meter
+    timer.mark("postprocess")
+
+    if sampler.keep("depth.stats"):   # min/max/mean kostar tre pass över kartan, bara när det loggas
+        log_event(logger, logging.INFO, "depth.stats", "Depth map stats", sampled=True,
+                  disp_min=float(disp.min()), disp_max=float(disp.max()), disp_mean=float(disp.mean()),
+                  depth_min=float(depth.min()), depth_max=float(depth.max()), depth_mean=float(depth.mean()))
+
+    # Serialisera en gång så att cachen kan returnera samma bytes direkt
+    body = dump_dict({"depth": depth})
+    timer.mark("encode")
+    entry = CachedResponse(body, "application/json", {"X-Model-Version": depth_model.version})
+    inference_cache.put(cache_key, entry)
+    return cached_response(entry, hit=False)
+
+
+@router.get("/docs/inference/health")
+def inference_health():
+    """Models this process can serve: the shared server's health, or the local registry."""
+    if INFERENCE_SOCKET:
+        return model_registry.health()
+    return {"status": "ok", "pid": os.getpid(),
+            "models": {name: model_registry.active_version(name) for name in model_registry.stats()},
+            "thread_budget": thread_budget.stats()}
+
+@router.get("/docs/inference_cache/stats")
+def get_inference_cache_stats():
+    return inference_cache.stats()
+
+# ─── Modellregister: ladda, promota och canary-routa versioner ─────────
+@router.get("/docs/models")
+def list_models():
+    return model_registry.stats()
+
+@router.post("/docs/models/{name}/versions", status_code=status.HTTP_201_CREATED)
+def load_model_version(name: str, payload: ModelLoadRequest):
+    try:
+        mv = model_registry.load(name, payload.version, payload.path, activate=payload.activate)
+    except FileNotFoundError:
+        raise HTTPException(404, "Model file not found")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"name": name, "version": mv.version, "active": model_registry.active_version(name)}
+
+@router.post("/docs/models/{name}/promote")
+def promote_model_version(name: str, version: str):
+    try:
+        model_registry.promote(name, version)
+    except ModelNotLoaded:
+        raise HTTPException(404, "Model version not loaded")
+    return {"name": name, "active": version}
+
+@router.post("/docs/models/{name}/canary")
+def set_model_canary(name: str, payload: ModelCanaryRequest):
+    try:
+        model_registry.set_candidate(name, payload.version, payload.percent)
+    except ModelNotLoaded:
+        raise HTTPException(404, "Model version not loaded")
+    return {"name": name, "candidate": payload.version, "percent": payload.percent}
+
+@router.delete("/docs/models/{name}/versions/{version}", status_code=204)
+def unload_model_version(name: str, version: str):
+    try:
+        model_registry.unload(name, version)
+    except ModelNotLoaded:
+        raise HTTPException(404, "Model version not loaded")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return Response(status_code=204)
+
+@router.get("/docs/conversion_progress/")
+def get_conversion_progress(marked_video_path: str):
+    progress = video_progress.get(marked_video_path)
+    if progress is None:
+        return {"progress": 0.0}
+    return {"progress": progress}
+
+@router.get("/docs/conversion_status/")
+def get_conversion_status(marked_video_path: str):
+    return conversion_status.get(marked_video_path, {"status": "not_found"})
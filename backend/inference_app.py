@@ -0,0 +1,49 @@
+# inference_app.py
+#
+# The ML endpoints as their own app, for running inference in a separate
+# process from CRUD-only API workers (INFERENCE_MODE=off):
+#   cd backend
+#   INFERENCE_MODE=off uvicorn main:app --workers 4 --port 8000
+#   uvicorn inference_app:app --port 8001
+# and route /docs/lane_overlay/, /docs/depth_map*, /docs/convert_video/,
+# /docs/conversion_*, /docs/models* and /docs/inference_cache/* to port 8001
+# in the reverse proxy. Both processes read the same .env.
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from inference import router, inference_unavailable_handler, InferenceServerUnavailable
+from logging_setup import setup_logging, shutdown_logging
+from metrics import metrics
+
+setup_logging()
+
+app = FastAPI()
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.include_router(router)
+app.add_exception_handler(InferenceServerUnavailable, inference_unavailable_handler)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_logging()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
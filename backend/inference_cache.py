@@ -0,0 +1,181 @@
+# inference_cache.py
+#
+# Content-addressed cache for the single-image ML endpoints. Identical uploads
+# (paused camera, client retries) return the stored response without running
+# the model again. Keys include the model version, so promoting a new model
+# never serves stale results.
+
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from metrics import metrics
+
+INFERENCE_CACHE_MAX_ITEMS = int(os.getenv("INFERENCE_CACHE_MAX_ITEMS", "256"))
+INFERENCE_CACHE_MAX_MB = float(os.getenv("INFERENCE_CACHE_MAX_MB", "64"))
+# Disk-nivån är valfri: sätt INFERENCE_CACHE_DIR för att aktivera den.
+INFERENCE_CACHE_DIR = os.getenv("INFERENCE_CACHE_DIR")
+INFERENCE_CACHE_DISK_MB = float(os.getenv("INFERENCE_CACHE_DISK_MB", "512"))
+
+
+def make_key(endpoint: str, model_version: str, content: bytes) -> str:
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    return f"{endpoint}-{model_version}-{digest}"
+
+
+class CachedResponse:
+    __slots__ = ("body", "media_type", "headers")
+
+    def __init__(self, body: bytes, media_type: str, headers: dict = None):
+        self.body = body
+        self.media_type = media_type
+        self.headers = headers or {}
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+class _DiskTier:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # key -> size, äldst först (återställs från mtime vid start)
+        self.index = OrderedDict()
+        self.total = 0
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".bin"):
+                path = os.path.join(directory, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key: str):
+        if key not in self.index:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                body, media_type, headers = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            self._remove(key)
+            return None
+        self.index.move_to_end(key)
+        return CachedResponse(body, media_type, headers)
+
+    def put(self, key: str, entry: CachedResponse):
+        if entry.size > self.max_bytes:
+            return
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((entry.body, entry.media_type, entry.headers), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        size = os.path.getsize(self._path(key))
+        if key in self.index:
+            self.total -= self.index.pop(key)
+        self.index[key] = size
+        self.total += size
+        while self.total > self.max_bytes and self.index:
+            self._remove(next(iter(self.index)))
+
+    def _remove(self, key: str):
+        self.total -= self.index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class InferenceCache:
+    def __init__(self, max_items: int = INFERENCE_CACHE_MAX_ITEMS,
+                 max_bytes: int = int(INFERENCE_CACHE_MAX_MB * 1024 * 1024),
+                 disk_dir: str = INFERENCE_CACHE_DIR,
+                 disk_max_bytes: int = int(INFERENCE_CACHE_DISK_MB * 1024 * 1024)):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = _DiskTier(disk_dir, disk_max_bytes) if disk_dir else None
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return entry
+            if self._disk is not None:
+                entry = self._disk.get(key)
+                if entry is not None:
+                    self.hits_disk += 1
+                    self._put_memory(key, entry)
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._put_memory(key, entry)
+            if self._disk is not None:
+                try:
+                    self._disk.put(key, entry)
+                except OSError:
+                    pass  # disk-nivån är best effort
+
+    def _put_memory(self, key: str, entry: CachedResponse):
+        if entry.size > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.size
+        self._memory[key] = entry
+        self._memory_bytes += entry.size
+        while len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk.index) if self._disk else 0,
+                "disk_bytes": self._disk.total if self._disk else 0,
+            }
+
+
+inference_cache = InferenceCache()
+
+
+def _collect_cache_metrics():
+    st = inference_cache.stats()
+    return [
+        ("safedrive_inference_cache_lookups_total", "counter", "Inference cache lookups by result.",
+         [({"result": "hit_memory"}, st["hits_memory"]),
+          ({"result": "hit_disk"}, st["hits_disk"]),
+          ({"result": "miss"}, st["misses"])]),
+        ("safedrive_inference_cache_hit_ratio", "gauge", "Share of lookups served from the cache.",
+         [({}, st["hit_ratio"])]),
+        ("safedrive_inference_cache_bytes", "gauge", "Bytes held per cache tier.",
+         [({"tier": "memory"}, st["memory_bytes"]), ({"tier": "disk"}, st["disk_bytes"])]),
+    ]
+
+
+metrics.register_collector(_collect_cache_metrics)
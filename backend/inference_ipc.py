@@ -0,0 +1,375 @@
+# inference_ipc.py
+#
+# Client side of the shared inference server (inference_server.py). With
+# INFERENCE_SOCKET set, every API worker on the host sends its model calls to
+# one server process over a Unix socket instead of loading its own ONNX
+# sessions, so model memory and ORT threads are paid once per host.
+#
+# Tensors never go through the socket. Each worker owns a small pool of
+# multiprocessing.shared_memory slots; an input is written into a slot, the
+# server runs the model on a numpy view of that same memory and writes the
+# outputs back into the slot. The socket only carries small JSON headers:
+#
+#   frame  = 4-byte big-endian length + UTF-8 JSON
+#   run    = {"id", "op": "run", "model", "version", "slot", "inputs": [{name, shape, dtype, offset}]}
+#   reply  = {"id", "ok": true, "outputs": [{shape, dtype, offset}]}
+#          | {"id", "ok": false, "error": "<exception class>", "detail": "..."}
+#
+# One connection per worker process carries any number of concurrent
+# requests; replies are matched by id, so they may come back in any order.
+
+import itertools
+import json
+import os
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from metrics import metrics
+from model_registry import ModelNotLoaded
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET")   # satt = använd inference_server.py
+DEFAULT_SOCKET = "/tmp/safedrive-inference.sock"
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+# Samtidiga anrop per worker; en slot rymmer indata och utdata för ett anrop
+INFERENCE_SHM_SLOTS = int(os.getenv("INFERENCE_SHM_SLOTS", "4"))
+INFERENCE_SHM_SLOT_MB = float(os.getenv("INFERENCE_SHM_SLOT_MB", "8"))
+# Hur länge en worker väljer version (inkl. canary) lokalt innan den frågar servern igen
+INFERENCE_ROUTING_TTL_SECONDS = float(os.getenv("INFERENCE_ROUTING_TTL_SECONDS", "1.0"))
+
+_HEADER = struct.Struct(">I")
+_ALIGN = 64
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+remote_inference_seconds = metrics.histogram(
+    "safedrive_remote_inference_seconds",
+    "Model call through the inference server, as seen by the API worker (incl. slot wait).",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+class InferenceServerUnavailable(RuntimeError):
+    pass
+
+
+# Fel som servern skickar tillbaka och som klienten kastar vidare med samma typ
+_ERRORS = {
+    "ModelNotLoaded": ModelNotLoaded,
+    "FileNotFoundError": FileNotFoundError,
+    "ValueError": ValueError,
+    "InferenceServerUnavailable": InferenceServerUnavailable,
+}
+
+
+# ─── Protokoll (delas med inference_server.py) ─────────────────────────
+
+def encode_message(message: dict) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+def decode_length(header: bytes) -> int:
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"message of {length} bytes")
+    return length
+
+
+def align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Open a segment someone else owns, without this process's resource tracker unlinking it at exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)   # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def array_view(shm: shared_memory.SharedMemory, shape, dtype, offset: int) -> np.ndarray:
+    """ndarray backed by the segment (no copy). Bounds-checked against the segment size."""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    if offset < 0 or offset + nbytes > shm.size:
+        raise ValueError(f"{nbytes} bytes at offset {offset} do not fit in a {shm.size}-byte slot")
+    return np.ndarray(tuple(shape), dtype, buffer=shm.buf, offset=offset)
+
+
+# ─── Klient ───────────────────────────────────────────────────────────
+
+class _Pending:
+    __slots__ = ("event", "reply")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.reply = None
+
+
+class InferenceClient:
+    """One multiplexed connection per process, usable from any thread."""
+
+    def __init__(self, path: str, slots: int = INFERENCE_SHM_SLOTS, slot_mb: float = INFERENCE_SHM_SLOT_MB,
+                 timeout: float = INFERENCE_TIMEOUT):
+        self.path = path
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.slot_count = slots
+        self.timeout = timeout
+        self._pid = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sock = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._slots = None
+        self._all_slots = []
+
+    # ─── Anslutning ───────────────────────────────────────────────────
+
+    def _check_fork(self):
+        # Anropas med _lock hållet. Ny process (fork): ärv varken socket, väntande anrop eller slots
+        if self._pid != os.getpid():
+            self._sock, self._pending, self._slots, self._all_slots = None, {}, None, []
+            self._pid = os.getpid()
+
+    def _connect(self):
+        with self._lock:
+            self._check_fork()
+            if self._sock is not None:
+                return self._sock
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError as e:
+                sock.close()
+                raise InferenceServerUnavailable(f"{self.path}: {e}")
+            self._sock = sock
+            threading.Thread(target=self._reader, args=(sock,), name="inference-ipc-reader", daemon=True).start()
+            return sock
+
+    def _reader(self, sock: socket.socket):
+        error = "connection closed"
+        try:
+            while True:
+                length = decode_length(self._recv_exact(sock, _HEADER.size))
+                reply = json.loads(self._recv_exact(sock, length))
+                pending = self._pending.pop(reply.get("id"), None)
+                if pending is not None:
+                    pending.reply = reply
+                    pending.event.set()
+        except (OSError, ValueError) as e:
+            error = str(e) or error
+        finally:
+            with self._lock:
+                if self._sock is sock:
+                    self._sock = None
+                    failed, self._pending = self._pending, {}
+                else:
+                    failed = {}
+            sock.close()
+            for pending in failed.values():
+                pending.reply = {"ok": False, "error": "InferenceServerUnavailable", "detail": error}
+                pending.event.set()
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise OSError("connection closed by inference server")
+            buf += chunk
+        return bytes(buf)
+
+    def call(self, message: dict, timeout: float = None) -> dict:
+        """Send one request and wait for its reply. Raises the server-side error type on failure."""
+        sock = self._connect()
+        request_id = next(self._ids)
+        pending = _Pending()
+        with self._lock:
+            # Läsartråden byter ut _pending under samma lås när anslutningen dör:
+            # antingen ser den här anropet och avbryter det, eller så ser vi att socketen är borta
+            if self._sock is not sock:
+                raise InferenceServerUnavailable("connection to inference server lost")
+            self._pending[request_id] = pending
+        try:
+            with self._send_lock:
+                sock.sendall(encode_message({**message, "id": request_id}))
+        except OSError as e:
+            self._pending.pop(request_id, None)
+            raise InferenceServerUnavailable(str(e))
+        if not pending.event.wait(timeout or self.timeout):
+            self._pending.pop(request_id, None)
+            raise InferenceServerUnavailable(f"no reply to {message.get('op')} within {timeout or self.timeout}s")
+        reply = pending.reply
+        if not reply.get("ok"):
+            raise _ERRORS.get(reply.get("error"), RuntimeError)(reply.get("detail"))
+        return reply
+
+    # ─── Shared memory ────────────────────────────────────────────────
+
+    def _acquire_slot(self):
+        with self._lock:
+            self._check_fork()
+            if self._slots is None:
+                self._slots = queue.Queue()
+                self._all_slots = []
+                for _ in range(self.slot_count):
+                    self._slots.put(self._new_slot())
+            slots = self._slots
+        try:
+            return slots.get(timeout=self.timeout), slots
+        except queue.Empty:
+            raise InferenceServerUnavailable("no free shared-memory slot")
+
+    def _new_slot(self) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes,
+                                         name=f"sdinf-{os.getpid()}-{os.urandom(4).hex()}")
+        self._all_slots.append(shm)
+        return shm
+
+    def _retire_slot(self, shm: shared_memory.SharedMemory) -> shared_memory.SharedMemory:
+        """
+        Replace a slot the server may still write into (the call timed out or
+        the connection dropped). Closing and unlinking only drop this process's
+        mapping and the name; the server's mapping stays valid until it lets
+        go, and no new request uses it.
+        """
+        with self._lock:
+            if shm in self._all_slots:
+                self._all_slots.remove(shm)
+            replacement = self._new_slot()
+        try:
+            shm.close()
+        except BufferError:
+            pass   # en vy lever kvar; mappningen släpps när den samlas in
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        return replacement
+
+    def run(self, model: str, version: str, inputs: dict, output_names=None) -> list:
+        """Run `version` of `model` on the server. Inputs are numpy arrays; returns output arrays."""
+        t0 = time.perf_counter()
+        shm, slots = self._acquire_slot()
+        reuse = shm
+        try:
+            specs, offset = [], 0
+            for name, value in inputs.items():
+                value = np.asarray(value)
+                view = array_view(shm, value.shape, value.dtype, offset)
+                np.copyto(view, value)   # den enda kopian; servern läser samma minne
+                specs.append({"name": name, "shape": list(value.shape), "dtype": value.dtype.str, "offset": offset})
+                offset = align(offset + value.nbytes)
+                del view
+            reply = self.call({"op": "run", "model": model, "version": version, "slot": shm.name,
+                               "inputs": specs, "outputs": output_names})
+            return [array_view(shm, o["shape"], o["dtype"], o["offset"]).copy() for o in reply["outputs"]]
+        except InferenceServerUnavailable:
+            reuse = self._retire_slot(shm)
+            raise
+        finally:
+            slots.put(reuse)
+            remote_inference_seconds.labels(model=model, version=version).observe(time.perf_counter() - t0)
+
+    def health(self, timeout: float = 2.0) -> dict:
+        reply = self.call({"op": "health"}, timeout=timeout)
+        return {k: v for k, v in reply.items() if k not in ("id", "ok")}
+
+    def close(self):
+        with self._lock:
+            sock, self._sock = self._sock, None
+            slots, self._all_slots, self._slots = self._all_slots, [], None
+        if sock is not None:
+            sock.close()
+        for shm in slots:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RemoteModelVersion:
+    """Stands in for model_registry.ModelVersion: `.name`, `.version` and `.run(inputs)`."""
+
+    def __init__(self, registry: "RemoteRegistry", name: str, version: str):
+        self.registry = registry
+        self.name = name
+        self.version = version
+
+    def run(self, inputs: dict, output_names=None):
+        try:
+            return self.registry.client.run(self.name, self.version, inputs, output_names)
+        except ModelNotLoaded:
+            self.registry.forget_routing(self.name)   # urladdad på servern; nästa acquire frågar igen
+            raise
+
+
+class RemoteRegistry:
+    """The ModelRegistry API used by inference.py, served by inference_server.py.
+
+    acquire() picks the version locally from the server's routing, fetched at
+    most every `routing_ttl` seconds, so a request costs one round trip (run).
+    """
+
+    def __init__(self, path: str, client: InferenceClient = None,
+                 routing_ttl: float = INFERENCE_ROUTING_TTL_SECONDS):
+        self.client = client or InferenceClient(path)
+        self.routing_ttl = routing_ttl
+        self._routing = {}   # name -> (hämtad, active, candidate, candidate_percent)
+
+    def acquire(self, name: str) -> RemoteModelVersion:
+        # Samma val som ModelRegistry.acquire, på serverns routing
+        now = time.monotonic()
+        routing = self._routing.get(name)
+        if routing is None or now - routing[0] >= self.routing_ttl:
+            reply = self.client.call({"op": "routing", "model": name})
+            routing = (now, reply["active"], reply["candidate"], reply["candidate_percent"])
+            self._routing[name] = routing
+        _, active, candidate, percent = routing
+        if candidate is not None and random.random() * 100 < percent:
+            return RemoteModelVersion(self, name, candidate)
+        return RemoteModelVersion(self, name, active)
+
+    def forget_routing(self, name: str = None):
+        if name is None:
+            self._routing.clear()
+        else:
+            self._routing.pop(name, None)
+
+    def load(self, name: str, version: str, path: str, activate: bool = False) -> RemoteModelVersion:
+        self.client.call({"op": "load", "model": name, "version": version, "path": path, "activate": activate},
+                         timeout=max(self.client.timeout, 120))
+        self.forget_routing(name)
+        return RemoteModelVersion(self, name, version)
+
+    def promote(self, name: str, version: str):
+        self.client.call({"op": "promote", "model": name, "version": version})
+        self.forget_routing(name)
+
+    def set_candidate(self, name: str, version: str = None, percent: float = 0.0):
+        self.client.call({"op": "set_candidate", "model": name, "version": version, "percent": percent})
+        self.forget_routing(name)
+
+    def unload(self, name: str, version: str):
+        self.client.call({"op": "unload", "model": name, "version": version})
+        self.forget_routing(name)
+
+    def active_version(self, name: str) -> str:
+        return self.client.call({"op": "active_version", "model": name})["version"]
+
+    def stats(self) -> dict:
+        return self.client.call({"op": "stats"})["stats"]
+
+    def health(self) -> dict:
+        return self.client.health()
@@ -0,0 +1,233 @@
+# inference_server.py
+#
+# One inference process per host. Loads the ONNX models once and serves every
+# API worker (INFERENCE_SOCKET=<path> in their environment) over a Unix
+# socket; inputs and outputs go through the workers' shared-memory slots, see
+# inference_ipc.py for the protocol.
+#
+#   cd backend
+#   python inference_server.py                                  # /tmp/safedrive-inference.sock
+#   INFERENCE_SOCKET=/run/safedrive/inference.sock python inference_server.py --threads 4
+#   INFERENCE_SOCKET=/tmp/safedrive-inference.sock uvicorn main:app --workers 4
+#
+# Requests from all connections are multiplexed onto --threads model threads
+# (ORT releases the GIL in session.run). `python inference_server.py --check`
+# asks a running server for its health and exits 0/1, for container probes.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference_ipc import (INFERENCE_SOCKET, DEFAULT_SOCKET, InferenceClient, align, array_view,
+                           attach_shared_memory, decode_length, encode_message)
+from model_registry import model_registry, load_default_models
+from thread_budget import thread_budget
+
+logger = logging.getLogger("safedrive")
+
+INFERENCE_SERVER_THREADS = int(os.getenv("INFERENCE_SERVER_THREADS", "2"))
+
+
+class InferenceServer:
+    def __init__(self, registry=model_registry, threads: int = INFERENCE_SERVER_THREADS):
+        self.registry = registry
+        self.threads = threads
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="inference")
+        self.started_at = time.time()
+        self.connections = 0
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+
+    # ─── Modellanrop (körs i trådpoolen) ──────────────────────────────
+
+    def _run(self, shm, message: dict) -> dict:
+        mv = self.registry.get(message["model"], message["version"])
+        inputs = {spec["name"]: array_view(shm, spec["shape"], spec["dtype"], spec["offset"])
+                  for spec in message["inputs"]}
+        try:
+            outputs = mv.run(inputs, message.get("outputs"))
+        finally:
+            del inputs   # inga kvarvarande vyer, annars kan segmentet inte stängas
+        # Indata är förbrukad: utdata skrivs från början av samma slot
+        specs, offset = [], 0
+        for value in outputs:
+            value = np.ascontiguousarray(value)
+            view = array_view(shm, value.shape, value.dtype, offset)
+            np.copyto(view, value)
+            del view
+            specs.append({"shape": list(value.shape), "dtype": value.dtype.str, "offset": offset})
+            offset = align(offset + value.nbytes)
+        return {"outputs": specs}
+
+    def _registry_op(self, message: dict) -> dict:
+        op, name = message["op"], message.get("model")
+        if op == "routing":
+            return self.registry.routing(name)
+        if op == "acquire":
+            return {"version": self.registry.acquire(name).version}
+        if op == "active_version":
+            return {"version": self.registry.active_version(name)}
+        if op == "load":
+            self.registry.load(name, message["version"], message["path"], activate=message.get("activate", False))
+            return {}
+        if op == "promote":
+            self.registry.promote(name, message["version"])
+            return {}
+        if op == "set_candidate":
+            self.registry.set_candidate(name, message.get("version"), message.get("percent", 0.0))
+            return {}
+        if op == "unload":
+            self.registry.unload(name, message["version"])
+            return {}
+        if op == "stats":
+            return {"stats": self.registry.stats()}
+        raise ValueError(f"unknown op {op!r}")
+
+    def health(self) -> dict:
+        models = {}
+        for name in self.registry.stats():
+            models[name] = self.registry.active_version(name)
+        return {
+            "status": "ok" if models else "no_models",
+            "pid": os.getpid(),
+            "models": models,
+            "threads": self.threads,
+            # Samma värde som registry.load gav sessionerna; de --threads anropen delar dem
+            "session_threads": thread_budget.session_threads(),
+            "connections": self.connections,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+        }
+
+    # ─── Anslutningar ─────────────────────────────────────────────────
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        attached = {}            # slot-namn -> SharedMemory, för den här klientens livstid
+        tasks = set()
+        write_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+
+        async def reply(message: dict):
+            async with write_lock:
+                writer.write(encode_message(message))
+                await writer.drain()
+
+        async def process(message: dict):
+            request_id = message.get("id")
+            self.inflight += 1
+            self.requests += 1
+            try:
+                op = message.get("op")
+                if op == "run":
+                    shm = attached.get(message["slot"])
+                    if shm is None:
+                        shm = attached[message["slot"]] = attach_shared_memory(message["slot"])
+                    result = await loop.run_in_executor(self._pool, self._run, shm, message)
+                elif op == "health":
+                    result = self.health()
+                elif op == "load":
+                    result = await loop.run_in_executor(None, self._registry_op, message)   # långsam, inte på modelltrådarna
+                else:
+                    result = self._registry_op(message)
+                await reply({"id": request_id, "ok": True, **result})
+            except Exception as e:
+                self.errors += 1
+                if not isinstance(e, (LookupError, ValueError, FileNotFoundError)):
+                    logger.exception(f"Inference request {message.get('op')} failed")
+                try:
+                    await reply({"id": request_id, "ok": False, "error": type(e).__name__, "detail": str(e)})
+                except (ConnectionError, OSError):
+                    pass
+            finally:
+                self.inflight -= 1
+
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                message = json.loads(await reader.readexactly(decode_length(header)))
+                task = asyncio.create_task(process(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            # Pågående anrop använder klientens segment: vänta in dem innan de stängs
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            for shm in attached.values():
+                shm.close()
+            writer.close()
+            self.connections -= 1
+
+    async def serve(self, path: str):
+        if os.path.exists(path):
+            if _is_listening(path):
+                raise SystemExit(f"Another inference server is already listening on {path}")
+            os.unlink(path)   # kvar efter en krasch
+        server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        os.chmod(path, 0o660)
+        logger.info(f"Inference server listening on {path} with {self.threads} threads, "
+                    f"models {self.health()['models']}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def _is_listening(path: str) -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=INFERENCE_SOCKET or DEFAULT_SOCKET)
+    parser.add_argument("--threads", type=int, default=INFERENCE_SERVER_THREADS)
+    parser.add_argument("--check", action="store_true", help="health-check a running server and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        client = InferenceClient(args.socket)
+        try:
+            health = client.health()
+        except Exception as e:
+            print(f"unhealthy: {e}")
+            sys.exit(1)
+        print(json.dumps(health))
+        sys.exit(0 if health.get("status") == "ok" else 1)
+
+    from logging_setup import setup_logging, shutdown_logging
+    setup_logging()
+    try:
+        thread_budget.processes = 1   # workers med INFERENCE_SOCKET laddar inga egna sessioner
+        load_default_models()
+        asyncio.run(InferenceServer(threads=args.threads).serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# logging_setup.py
+#
+# Non-blocking, structured logging. Every logger (the app's, uvicorn's access
+# and error logs, SQLAlchemy's echo) ends at one QueueHandler on the root
+# logger; a background QueueListener thread formats the records as JSON lines
+# and writes them to stdout. A request thread only pays for building the
+# record and a put_nowait, never for formatting or a blocked stdout pipe.
+#
+# High-frequency events are sampled before they are queued:
+#   LOG_SAMPLE_RATES="lane.red_lines=0.01,depth.stats=0.01,uvicorn.access=0.1"
+# The key is the record's `event` (see log_event) or else the logger name;
+# a logger name also matches its children ("sqlalchemy.engine" covers
+# "sqlalchemy.engine.Engine"). Kept records carry their sample_rate so
+# counts can be scaled back up. If the queue is full, records are dropped and
+# counted instead of blocking the caller.
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+from metrics import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")        # json | text
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "lane.red_lines=0.01,depth.stats=0.01")
+LOG_SAMPLE_DEFAULT = float(os.getenv("LOG_SAMPLE_DEFAULT", "1.0"))
+
+# Loggare som konfigurerar egna handlers (uvicorn via dictConfig, SQLAlchemy vid echo=True)
+_OWN_HANDLER_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access", "sqlalchemy.engine.Engine", "sqlalchemy.pool")
+
+# Standardattribut på LogRecord; allt annat kom från extra= och hamnar i JSON-raden
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sampled"}
+
+
+def parse_rates(spec: str) -> dict:
+    """'a=0.1,b.c=1' -> {'a': 0.1, 'b.c': 1.0}"""
+    rates = {}
+    for part in spec.split(","):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            rates[key.strip()] = min(1.0, max(0.0, float(value)))
+    return rates
+
+
+class LogSampler:
+    """Per-event sampling rates. Counters are best-effort (unlocked) and only feed /metrics."""
+
+    def __init__(self, rates: dict, default: float = LOG_SAMPLE_DEFAULT):
+        self.rates = dict(rates)
+        self.default = default
+        self._resolved = {}
+        self.kept = {}
+        self.sampled_out = {}
+
+    def rate(self, key: str) -> float:
+        rate = self._resolved.get(key)
+        if rate is None:
+            name = key
+            while name not in self.rates and "." in name:
+                name = name.rsplit(".", 1)[0]
+            rate = self._resolved[key] = self.rates.get(name, self.default)
+        return rate
+
+    def keep(self, key: str) -> bool:
+        rate = self.rate(key)
+        if rate >= 1.0 or (rate > 0.0 and random.random() < rate):
+            self.kept[key] = self.kept.get(key, 0) + 1
+            return True
+        self.sampled_out[key] = self.sampled_out.get(key, 0) + 1
+        return False
+
+
+sampler = LogSampler(parse_rates(LOG_SAMPLE_RATES))
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False):
+            return True   # log_event har redan samplat
+        key = getattr(record, "event", None) or record.name
+        if not sampler.keep(key):
+            return False
+        rate = sampler.rate(key)
+        if rate < 1.0:
+            record.sample_rate = rate
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full, and defers formatting."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Bara %-interpoleringen görs här; JSON-formateringen sker i lyssnartråden.
+        # exc_info följer med som objekt (samma process, ingen pickling).
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_state = {"handler": None, "listener": None}
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None):
+    """
+    Route all logging through the queue. Idempotent; call once at import of
+    the app (after uvicorn has applied its own logging config).
+    """
+    with _setup_lock:
+        if _state["listener"] is not None:
+            return _state["handler"]
+        q = queue.Queue(LOG_QUEUE_MAX)
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json"
+                            else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handler = NonBlockingQueueHandler(q)
+        handler.addFilter(SamplingFilter())
+        listener = logging.handlers.QueueListener(q, output, respect_handler_level=False)
+
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        for name in _OWN_HANDLER_LOGGERS:
+            logger = logging.getLogger(name)
+            for existing in logger.handlers[:]:
+                logger.removeHandler(existing)
+            logger.propagate = True
+
+        listener.start()
+        _state.update(handler=handler, listener=listener)
+        return handler
+
+
+def shutdown_logging():
+    """Flush what is queued and stop the listener thread (on app shutdown)."""
+    with _setup_lock:
+        listener = _state["listener"]
+        if listener is not None:
+            listener.stop()
+            _state["listener"] = None
+
+
+def log_event(logger: logging.Logger, level: int, event: str, msg: str, *args, sampled: bool = False, **fields):
+    """
+    Log a structured event: `fields` become JSON keys. Sampled here, before
+    the record is built; pass sampled=True if the caller already checked
+    sampler.keep(event) (to skip computing expensive fields).
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if not sampled and not sampler.keep(event):
+        return
+    rate = sampler.rate(event)
+    if rate < 1.0:
+        fields["sample_rate"] = rate
+    logger.log(level, msg, *args, extra={"event": event, "sampled": True, **fields}, stacklevel=2)
+
+
+def _collect_logging_metrics():
+    handler = _state["handler"]
+    return [
+        ("safedrive_log_sampled_out_total", "counter", "Log records skipped by sampling, per event.",
+         [({"event": key}, n) for key, n in list(sampler.sampled_out.items())]),
+        ("safedrive_log_dropped_total", "counter", "Log records dropped because the log queue was full.",
+         [({}, handler.dropped if handler else 0)]),
+        ("safedrive_log_queue", "gauge", "Log records waiting for the writer thread.",
+         [({}, handler.queue.qsize() if handler else 0)]),
+    ]
+
+
+metrics.register_collector(_collect_logging_metrics)
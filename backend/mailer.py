@@ -0,0 +1,238 @@
+# mailer.py
+#
+# Outbound mail with persistent SMTP connections. Messages go into an
+# in-memory queue; MAIL_POOL_SIZE sender tasks each keep one logged-in SMTP
+# connection open and send queued messages over it in batches. Failed sends
+# are retried with exponential backoff. A burst of password resets is then a
+# burst of messages on already-open connections, not a burst of TLS handshakes.
+#
+# Try it against a local stand-in server: python scripts/mail_burst.py
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+
+import aiosmtplib
+
+from metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "2"))
+MAIL_BATCH = int(os.getenv("MAIL_BATCH", "20"))
+MAIL_QUEUE_MAX = int(os.getenv("MAIL_QUEUE_MAX", "1000"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "5"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "2"))
+# Stäng anslutningen efter så här lång tystnad (de flesta servrar kopplar ner efter ~5 min)
+MAIL_IDLE_SECONDS = float(os.getenv("MAIL_IDLE_SECONDS", "60"))
+
+mail_delivery_seconds = metrics.histogram(
+    "safedrive_mail_delivery_seconds",
+    "Time from enqueue to accepted by the SMTP server.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+class MailQueueFull(RuntimeError):
+    pass
+
+
+@dataclass
+class MailSettings:
+    server: str
+    port: int = 587
+    username: str = None
+    password: str = None
+    sender: str = None
+    starttls: bool = True
+    ssl_tls: bool = False
+    timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "MailSettings":
+        # Samma variabler som tidigare gick till fastapi-mail
+        return cls(
+            server=os.getenv("MAIL_SERVER"),
+            port=int(os.getenv("MAIL_PORT", 587)),
+            username=os.getenv("MAIL_USERNAME"),
+            password=os.getenv("MAIL_PASSWORD"),
+            sender=os.getenv("MAIL_FROM"),
+            starttls=os.getenv("MAIL_STARTTLS", "True") == "True",
+            ssl_tls=os.getenv("MAIL_SSL_TLS", "False") == "True",
+        )
+
+
+@dataclass
+class OutboundMail:
+    to: str
+    subject: str
+    body: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class Mailer:
+    def __init__(self, settings: MailSettings, pool_size: int = MAIL_POOL_SIZE, batch: int = MAIL_BATCH,
+                 queue_max: int = MAIL_QUEUE_MAX, max_retries: int = MAIL_MAX_RETRIES):
+        self.settings = settings
+        self.pool_size = pool_size
+        self.batch = batch
+        self.queue_max = queue_max
+        self.max_retries = max_retries
+        self._queue = None
+        self._tasks = []
+        self._retrying = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.connections = 0
+
+    # ─── Publikt API ──────────────────────────────────────────────────
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._tasks = [asyncio.create_task(self._sender(i)) for i in range(self.pool_size)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Give queued mail `timeout` seconds to go out, then close the connections."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Mailer stopped with {self._queue.qsize()} messages still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, to: str, subject: str, body: str):
+        """Queue a plain-text message. Raises MailQueueFull if the queue is at MAIL_QUEUE_MAX."""
+        if self._queue is None:
+            self.start()
+        try:
+            self._queue.put_nowait(OutboundMail(to, subject, body))
+        except asyncio.QueueFull:
+            raise MailQueueFull(to)
+
+    async def join(self):
+        """Wait until everything queued so far (including pending retries) is sent or given up."""
+        while True:
+            await self._queue.join()
+            if not self._retrying:
+                return
+            await asyncio.sleep(0.05)
+
+    # ─── Sändare ──────────────────────────────────────────────────────
+
+    def _build(self, mail: OutboundMail) -> EmailMessage:
+        msg = EmailMessage()
+        msg["From"] = self.settings.sender
+        msg["To"] = mail.to
+        msg["Subject"] = mail.subject
+        msg.set_content(mail.body)
+        return msg
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        s = self.settings
+        smtp = aiosmtplib.SMTP(hostname=s.server, port=s.port, use_tls=s.ssl_tls,
+                               start_tls=s.starttls and not s.ssl_tls, timeout=s.timeout)
+        await smtp.connect()
+        if s.username:
+            await smtp.login(s.username, s.password)
+        self.connections += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp):
+        if smtp is None:
+            return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _sender(self, index: int):
+        smtp = None
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), MAIL_IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    await self._close(smtp)
+                    smtp = None
+                    continue
+                batch = [first]
+                while len(batch) < self.batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                for mail in batch:
+                    try:
+                        if smtp is None or not smtp.is_connected:
+                            smtp = await self._connect()
+                        await smtp.send_message(self._build(mail))
+                        self.sent += 1
+                        mail_delivery_seconds.labels().observe(time.monotonic() - mail.enqueued_at)
+                    except aiosmtplib.SMTPRecipientsRefused:
+                        self.failed += 1   # permanent, ingen idé att försöka igen
+                        logger.warning(f"Mail to {mail.to} refused by the server")
+                    except (aiosmtplib.SMTPException, OSError) as e:
+                        await self._close(smtp)
+                        smtp = None
+                        self._retry(mail, e)
+                    finally:
+                        self._queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    def _retry(self, mail: OutboundMail, error: Exception):
+        mail.attempts += 1
+        if mail.attempts > self.max_retries:
+            self.failed += 1
+            logger.error(f"Giving up on mail to {mail.to} after {mail.attempts} attempts: {error}")
+            return
+        self.retried += 1
+        self._retrying += 1
+        delay = MAIL_RETRY_BASE_SECONDS * 2 ** (mail.attempts - 1)
+        asyncio.get_running_loop().call_later(delay, self._requeue, mail)
+
+    def _requeue(self, mail: OutboundMail):
+        self._retrying -= 1
+        try:
+            self._queue.put_nowait(mail)
+        except asyncio.QueueFull:
+            self.failed += 1
+            logger.error(f"Dropping retry of mail to {mail.to}: queue full")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "retrying": self._retrying,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "connections": self.connections,
+        }
+
+
+mailer = Mailer(MailSettings.from_env())
+
+
+def _collect_mail_metrics():
+    st = mailer.stats()
+    return [
+        ("safedrive_mail_queue", "gauge", "Messages waiting to be sent, by state.",
+         [({"state": "queued"}, st["queued"]), ({"state": "retrying"}, st["retrying"])]),
+        ("safedrive_mail_messages_total", "counter", "Outbound messages by result.",
+         [({"result": "sent"}, st["sent"]), ({"result": "failed"}, st["failed"]),
+          ({"result": "retried"}, st["retried"])]),
+        ("safedrive_mail_connections_total", "counter", "SMTP connections opened (each one a TLS handshake).",
+         [({}, st["connections"])]),
+    ]
+
+
+metrics.register_collector(_collect_mail_metrics)
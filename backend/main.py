@@ -1,77 +1,71 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, status, UploadFile, File, Query, Response, BackgroundTasks, APIRouter
+from fastapi import FastAPI, Depends, HTTPException, Request, status, UploadFile, File, Query, Response, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 from fastapi.exception_handlers import request_validation_exception_handler
 from typing import List
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 load_dotenv()
 import logging
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, PlainTextResponse
 import io
 import json
 from schemas import (UserCreate, UserResponse, LoginRequest, CarCreate,
                     CarResponse, CarBase, CarUpdate, UserUpdate, QuizQuestionOut,
                     QuizOptionOut, QuizSubmitRequest, QuizSubmitResponse, RewardResponse,
                     UserRewardResponse, UserRewardCreate, DrivingSessionBase,
-                    DrivingSessionCreate, DrivingSessionResponse, PhotoUploadResponse)
+                    DrivingSessionCreate, DrivingSessionResponse, PhotoUploadResponse,
+                    ProfileSummaryResponse,
+                    SyncResponse)
 
 from models import (User, Car, QuizQuestion, QuizOption, 
-                    Reward, UserReward, DrivingSession, PhotoUpload)
+                    UserReward, DrivingSession, PhotoUpload)
 
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi.responses import FileResponse
-from repository import create_user, get_user, get_user_cars, create_car, grade_quiz
-from db import init_db, SessionLocal
-import os, cv2, numpy as np, scipy.special
+from repository import create_user, get_user, get_user_by_email, get_user_cars, create_car, grade_quiz, get_profile_summary
+from db import init_db_async, get_db, get_read_db, AsyncSessionLocal
+from points import apply_points, get_balance, UserNotFound, InsufficientPoints
+from quiz_cache import quiz_answer_key, quiz_catalog, invalidate_quiz, etag_matches
+from pagination import paginate, MAX_PAGE_LIMIT, NEXT_CURSOR_HEADER
+from sync import get_sync_version, get_changes, sync_etag
+from auth_cache import auth_cache, invalidate_user, UserSnapshot
+from maintenance import start_in_process, stop_in_process
+from mailer import mailer, MailQueueFull
+from reward_cache import reward_catalog, invalidate_rewards
+from redemption import attach_redeem_tokens, create_redeem_token, verify_redeem_token, redeem, render_redeem_page, render_message, REDEEMED_PAGE
+from passwords import password_hasher, PasswordServiceBusy, PASSWORD_HASH_TARGET_MS
+from fast_json import list_response, model_response, json_bytes_response
+from media import UPLOAD_DIR, probe_duration
+import os
 import time
 from pathlib import Path
-from collections import deque
-from PIL import Image
-import torchvision.transforms as T
-import onnxruntime as ort
-from collections import deque
-import subprocess
 from pydantic import BaseModel
 from auth import create_access_token, verify_access_token
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 import random
 import string
+import asyncio
 from datetime import datetime, timedelta
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from pydantic import EmailStr
+from metrics import metrics
+from logging_setup import setup_logging, shutdown_logging, log_event
 
+# Efter alla importer: uvicorn har konfigurerat sina loggare och SQLAlchemy sin echo-handler
+setup_logging()
+logger = logging.getLogger("safedrive")
 
+# inline: ML-endpoints och modeller i samma process (standard)
+# off:    CRUD-only worker; ML-anropen går till en separat process (inference_app.py)
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "inline").lower()
 
-# Gloabal variable to track conversion status
-conversion_status = {}
-video_progress = {}
 app = FastAPI()
 
-lane_router = APIRouter()
-
-DEPTH_SCALE = 2.680260
-DEPTH_BOX_OFFSET = 7     # Y-offset (neråt)
-DEPTH_BOX_OFFSET_X = 7  # X-offset (höger)
-DEPTH_BOX_SIZE = 8 
-
-conf = ConnectionConfig(
-    MAIL_USERNAME = os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD = os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM = os.getenv("MAIL_FROM"),
-    MAIL_PORT = int(os.getenv("MAIL_PORT", 587)),
-    MAIL_SERVER = os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "True") == "True",
-    MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "False") == "True",
-    USE_CREDENTIALS = True,
-)
-
-UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 UPLOAD_PHOTO_DIR = os.path.join(UPLOAD_DIR, "photos")
 os.makedirs(UPLOAD_PHOTO_DIR, exist_ok=True)
 
@@ -89,99 +83,90 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "X-Sync-Cursor"],
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# —————— ONNX runtime globals ——————
-DEPTH_SESSION: ort.InferenceSession = None  # Will be set in startup event
-depth_transform = T.Compose([
-    T.Resize((192, 640)),  # Anpassa till din models input
-    T.ToTensor(),
-    T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
-
-# —————— ONNX runtime setup ——————
-SESSION: ort.InferenceSession = None  # Will be set in startup event
-row_anchor = np.array([121, 131, 141, 150, 160, 170, 180, 189, 199, 209, 219, 228, 238, 248, 258, 267, 277, 287])   # your culane_row_anchor
-col_sample  = np.linspace(0, 800-1, 200)
-buffers     = [deque(maxlen=5) for _ in range(4)]
-infer_transform = T.Compose([
-    T.Resize((288,800)),
-    T.ToTensor(),
-    T.Normalize(mean=[0.485,0.456,0.406], std=[0.229,0.224,0.225]),
-])
-
-def probe_duration(path: str) -> float:
-    """Return video duration in seconds using ffprobe."""
-    out = subprocess.check_output([
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        path
-    ])
-    return float(out)
-
-@app.on_event("startup")
-def load_onnx():
-    global SESSION, DEPTH_SESSION
-    SESSION = ort.InferenceSession("../assets/models/lane_net.onnx", providers=["CPUExecutionProvider"])
-    DEPTH_SESSION = ort.InferenceSession("../assets/models/monodepth2_kitti.onnx", providers=["CPUExecutionProvider"])
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/docs/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = verify_access_token(token)
+async def _load_user_for_auth(user_id: int):
+    # Primären, inte repliken: ett snapshot får inte cachas från en eftersläpande replika
+    async with AsyncSessionLocal() as db:
+        return await get_user(db, user_id)
+
+async def get_current_identity(token: str = Depends(oauth2_scheme)) -> UserSnapshot:
+    """Who is calling, from cached token claims and a cached user snapshot (usually no DB query)."""
+    payload = auth_cache.get_claims(token, verify_access_token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
-    user = db.query(User).filter(User.id == payload.get("user_id")).first()
+    snapshot = await auth_cache.get_user(payload.get("user_id"), _load_user_for_auth)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return snapshot
+
+async def get_current_user(identity: UserSnapshot = Depends(get_current_identity), db: AsyncSession = Depends(get_db)):
+    """The full User row, for endpoints that need more than identity."""
+    user = await get_user(db, identity.id)
     if not user:
+        await invalidate_user(identity.id)
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+@app.exception_handler(PasswordServiceBusy)
+async def password_service_busy_handler(request: Request, exc: PasswordServiceBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again."}, headers={"Retry-After": "1"})
+
+async def rehash_password(user_id: int, old_hash: str, password: str):
+    """Upgrade a hash with an outdated bcrypt cost. Skipped if the password changed in the meantime."""
+    new_hash = await password_hasher.hash(password)
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(User)
+            .where(User.id == user_id, User.hashed_password == old_hash)
+            .values(hashed_password=new_hash)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
 @app.post("/docs/login")
-def login_user(credentials: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == credentials.email).first()
-    if not user or not pwd_context.verify(credentials.password, user.hashed_password):
+async def login_user(credentials: LoginRequest, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_email(db, credentials.email)
+    if not user or not await password_hasher.verify(credentials.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid email or password.")
+    if password_hasher.needs_rehash(user.hashed_password):
+        # efter svaret, så inloggningen inte betalar för en andra hash
+        background_tasks.add_task(rehash_password, user.id, user.hashed_password, credentials.password)
     token = create_access_token({"sub": user.email, "user_id": user.id})
     return {"access_token": token, "token_type": "bearer", "user_id": user.id, "firstname": user.firstname}
 
 @app.get("/docs/protected")
-def protected_route(current_user: User = Depends(get_current_user)):
+def protected_route(current_user: UserSnapshot = Depends(get_current_identity)):
     return {"message": f"Du är inloggad som {current_user.firstname}!"}
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print("⚠️ Validation Error:")
-    print(exc.errors())
+    log_event(logger, logging.WARNING, "request.validation_error", "Validation error on %s %s",
+              request.method, request.url.path, errors=exc.errors())
     return await request_validation_exception_handler(request, exc)
 
 def generate_reset_code(length=6):
     return ''.join(random.choices(string.digits, k=length))
 
-# Hjälpfunktion för att skicka e-post (byt ut mot riktig e-posttjänst i produktion)
-async def send_reset_email(email: str, code: str):
-    message = MessageSchema(
-        subject="SafeDrive - Återställningskod",
-        recipients=[email],
-        body=f"Din återställningskod är: {code}\n\nKoden är giltig i 10 minuter.",
-        subtype="plain"
+# Köar mejlet; mailer.py skickar det över en redan öppen SMTP-anslutning
+def send_reset_email(email: str, code: str):
+    mailer.enqueue(
+        email,
+        "SafeDrive - Återställningskod",
+        f"Din återställningskod är: {code}\n\nKoden är giltig i 10 minuter.",
     )
-    fm = FastMail(conf)
-    await fm.send_message(message)
+
+@app.exception_handler(MailQueueFull)
+async def mail_queue_full_handler(request: Request, exc: MailQueueFull):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again."}, headers={"Retry-After": "5"})
 
 # Endpoint: Initiera lösenordsåterställning
 @app.post("/docs/forgot_password")
-async def forgot_password(email: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def forgot_password(email: str, db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     code = generate_reset_code()
@@ -194,79 +179,82 @@ async def forgot_password(email: str, background_tasks: BackgroundTasks, db: Ses
         used=False
     )
     db.add(reset_code)
-    db.commit()
-    background_tasks.add_task(send_reset_email, email, code)
+    await db.commit()
+    send_reset_email(email, code)
     return {"message": "Verification code sent to your email."}
 
 # Endpoint: Återställ lösenord
 @app.post("/docs/reset_password")
-def reset_password(email: str, code: str, new_password: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def reset_password(email: str, code: str, new_password: str, db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     from models import PasswordResetCode
-    reset_code = db.query(PasswordResetCode).filter(
+    reset_code = (await db.execute(select(PasswordResetCode).where(
         and_(
             PasswordResetCode.user_id == user.id,
             PasswordResetCode.code == code,
             PasswordResetCode.expires_at > datetime.utcnow(),
             PasswordResetCode.used == False
         )
-    ).first()
+    ))).scalars().first()
     if not reset_code:
         raise HTTPException(status_code=400, detail="Invalid or expired code")
-    # Uppdatera lösenord
-    user.hashed_password = pwd_context.hash(new_password)
-    db.commit()
-    # Markera koden som använd
+    # Uppdatera lösenord och markera koden som använd i samma commit
+    user.hashed_password = await password_hasher.hash(new_password)
     reset_code.used = True
-    db.commit()
+    await db.commit()
+    await invalidate_user(user.id)
     return {"message": "Password reset successful."}
 
 @app.post("/docs/register", response_model=UserResponse)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user.email).first()
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = await get_user_by_email(db, user.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered.")
-    new_user = create_user(db, user)
+    new_user = await create_user(db, user)
     return new_user
 
 @app.get("/docs/users/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = get_user(db, user_id)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    user = await get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @app.put("/docs/users/{user_id}", response_model=UserResponse)
-def update_user(
+async def update_user(
     user_id: int,
     user_in: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await get_user(db, user_id)
     if not db_user:
         raise HTTPException(404, "User not found")
     for field, value in user_in.dict(exclude_unset=True).items():
         setattr(db_user, field, value)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await invalidate_user(user_id)
+    await db.refresh(db_user)
     return db_user
 
 @app.post("/docs/add_points/")
-def add_points(user_id: int, points: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+async def add_points(user_id: int, points: int, db: AsyncSession = Depends(get_db)):
+    try:
+        await apply_points(db, user_id, points, "manual")
+    except UserNotFound:
         raise HTTPException(status_code=404, detail="User not found")
-    user.points += points
-    db.commit()
-    return {"success": True, "total_points": user.points}
+    except InsufficientPoints:
+        raise HTTPException(status_code=400, detail="Not enough points")
+    total = await get_balance(db, user_id)
+    await db.commit()
+    return {"success": True, "total_points": total}
 
 @app.post("/docs/users/{user_id}/avatar", response_model=UserResponse)
 async def upload_avatar(
     user_id: int,
     avatar: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # make sure the folder exists
     avatars_dir = Path("static/avatars")
@@ -281,77 +269,128 @@ async def upload_avatar(
         f.write(await avatar.read())
 
     # update the user record
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await get_user(db, user_id)
     if not db_user:
         raise HTTPException(404, "User not found")
     db_user.avatar_url = f"/static/avatars/{filename}"
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
     return db_user
 
 @app.get("/docs/users/{user_id}/cars", response_model=List[CarResponse])
-def read_cars_for_user(user_id: int, db: Session = Depends(get_db)):
+async def read_cars_for_user(user_id: int, db: AsyncSession = Depends(get_read_db)):
     # optionally ensure the user exists:
-    if not get_user(db, user_id):
+    if not await get_user(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return await get_user_cars(db, user_id)
+
+@app.get("/docs/users/{user_id}/summary", response_model=ProfileSummaryResponse)
+async def read_profile_summary(
+    user_id: int,
+    request: Request,
+    recent_sessions: int = Query(5, ge=0, le=50, description="Number of latest sessions to include"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Profile screen in one request: user, cars, active (unused, unexpired) rewards
+    with reward details, session totals and the latest sessions.
+    """
+    summary = await get_profile_summary(db, user_id, recent_sessions)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    attach_redeem_tokens(summary["active_rewards"])
+    return model_response(ProfileSummaryResponse, summary, request)
+
+@app.get("/docs/users/{user_id}/sync", response_model=SyncResponse)
+async def sync_user_data(
+    user_id: int,
+    request: Request,
+    since: int = Query(None, ge=0, description="Cursor from the previous sync; omit for a full sync"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Cars, sessions, photos and claimed rewards created, updated or deleted since
+    `since`. An unchanged user costs one primary key lookup and a 304.
+    """
+    version = await get_sync_version(db, user_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return get_user_cars(db, user_id)
+    headers = {"ETag": sync_etag(user_id, version), "X-Sync-Cursor": str(version), "Cache-Control": "no-cache"}
+    if (since is not None and since == version) or etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if since is not None and since > version:
+        since = None   # cursorn kommer från en annan databas (t.ex. efter återställning) – börja om
+    changes = await get_changes(db, user_id, since, version)
+    attach_redeem_tokens(changes["user_rewards"])
+    payload = SyncResponse.model_validate({"cursor": version, "full": since is None, **changes}, from_attributes=True)
+    return json_bytes_response(payload.model_dump_json().encode("utf-8"), request, headers=headers)
 
 @app.post(
     "/docs/cars",
     response_model=CarResponse,
     status_code=status.HTTP_201_CREATED
 )
-def add_car(car: CarCreate, db: Session = Depends(get_db)):
+async def add_car(car: CarCreate, db: AsyncSession = Depends(get_db)):
     # verify that the user exists
-    if not get_user(db, car.user_id):
+    if not await get_user(db, car.user_id):
         raise HTTPException(status_code=404, detail="User not found")
     # create and return the new Car
-    return create_car(db, car)
+    return await create_car(db, car)
 
 @app.put("/docs/cars/{car_id}", response_model=CarResponse)
-def update_car(
+async def update_car(
     car_id: int,
     car_in: CarUpdate,          # or CarBase if you don't want user_id here
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # query the ORM model
-    db_car = db.query(Car).filter(Car.id == car_id).first()
+    db_car = await db.get(Car, car_id)
     if not db_car:
         raise HTTPException(status_code=404, detail="Car not found")
 
     # update fields
     for field, value in car_in.dict().items():
         setattr(db_car, field, value)
-    db.commit()
-    db.refresh(db_car)
+    await db.commit()
+    await db.refresh(db_car)
     return db_car
 
 @app.delete("/docs/cars/{car_id}", status_code=204)
-def delete_car(car_id: int, db: Session = Depends(get_db)):
-    db_car = db.query(Car).get(car_id)
+async def delete_car(car_id: int, db: AsyncSession = Depends(get_db)):
+    # Ladda användare som valt bilen så att ORM:en kan nolla current_car_id utan lazy load
+    db_car = await db.get(Car, car_id, options=[selectinload(Car.users_who_selected_this_car)])
     if not db_car:
         raise HTTPException(404, "Car not found")
-    db.delete(db_car)
-    db.commit()
+    await db.delete(db_car)
+    await db.commit()
 
 @app.get("/docs/rewards", response_model=List[RewardResponse])
-def list_rewards(db: Session = Depends(get_db)):
-    return db.query(Reward).all()
+async def list_rewards(request: Request, db: AsyncSession = Depends(get_read_db)):
+    # Aktiva belöningar, serialiserade en gång per version; klienter med rätt ETag får 304
+    catalog = await reward_catalog.get(db)
+    headers = {"ETag": catalog.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), catalog.etag):
+        return Response(status_code=304, headers=headers)
+    return json_bytes_response(catalog.body, request, headers=headers, cache_key=catalog.etag)
 
 @app.post("/docs/user_rewards", response_model=UserRewardResponse)
-def claim_reward(payload: UserRewardCreate, db: Session = Depends(get_db)):
-    user = db.query(User).get(payload.user_id)
-    reward = db.query(Reward).get(payload.reward_id)
-    if not user or not reward:
+async def claim_reward(payload: UserRewardCreate, db: AsyncSession = Depends(get_db)):
+    # Kostnaden kommer från katalogcachen; utgångna belöningar finns inte där
+    reward = (await reward_catalog.get(db)).active.get(payload.reward_id)
+    if not reward:
+        raise HTTPException(404, "User or Reward not found")
+    # Villkorlig UPDATE: drar poängen bara om saldot räcker, utan race mot andra requests
+    try:
+        entry = await apply_points(db, payload.user_id, -reward.cost_points, "reward_claim")
+    except UserNotFound:
         raise HTTPException(404, "User or Reward not found")
-    if user.points < reward.cost_points:
+    except InsufficientPoints:
         raise HTTPException(400, "Not enough points")
-    user.points -= reward.cost_points
     claimed_at = datetime.utcnow()
     expires_at = claimed_at + timedelta(days=365)
     ur = UserReward(
-        user_id=user.id,
+        user_id=payload.user_id,
         reward_id=reward.id,
         claimed_at=claimed_at,
         expires_at=expires_at,
@@ -359,601 +398,140 @@ def claim_reward(payload: UserRewardCreate, db: Session = Depends(get_db)):
         redeemed_at=None  # Initially not redeemed
     )
     db.add(ur)
-    db.commit()
-    db.refresh(ur)
-    return ur
+    try:
+        await db.flush()
+    except IntegrityError:
+        # belöningen togs bort efter att cachen senast laddades
+        await db.rollback()
+        raise HTTPException(404, "User or Reward not found")
+    entry.ref_id = ur.id
+    await db.commit()
+    return UserRewardResponse(
+        id=ur.id, user_id=ur.user_id, reward_id=ur.reward_id, claimed_at=ur.claimed_at,
+        expires_at=ur.expires_at, used=ur.used, redeemed_at=ur.redeemed_at, updated_at=ur.updated_at,
+        reward=reward,  # från cachen, ingen extra läsning
+        redeem_token=create_redeem_token(ur.id, ur.user_id, ur.reward_id, ur.expires_at, ur.claimed_at),
+    )
 
 @app.get("/docs/users/{user_id}/rewards", response_model=List[UserRewardResponse])
-def list_user_rewards(
+async def list_user_rewards(
     user_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_LIMIT, description="Page size (newest first)"),
+    cursor: str = Query(None, description=f"Value of the previous page's {NEXT_CURSOR_HEADER} header"),
+    db: AsyncSession = Depends(get_read_db),
 ):
     # optional: verify user exists
-    if not db.query(User).filter(User.id == user_id).first():
+    if not await get_user(db, user_id):
         raise HTTPException(status_code=404, detail="User not found")
-    return (
-        db.query(UserReward)
-          .filter(UserReward.user_id == user_id)
-          .all()
+    rows, next_cursor = await paginate(
+        db,
+        select(UserReward)
+          .where(UserReward.user_id == user_id)
+          .options(selectinload(UserReward.reward)),
+        UserReward.claimed_at, UserReward.id, limit, cursor,
+        unpaged_order=(UserReward.id,),   # utan limit: samma ordning som före pagineringen
     )
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    response.headers.update(headers)   # används när FAST_JSON_ENABLED=false
+    return list_response(UserRewardResponse, attach_redeem_tokens(rows), request, headers)
+
 @app.get("/docs/redeem", response_class=HTMLResponse)
-def redeem_page(user_reward_id: int, user_id: int, reward_id: int, db: Session = Depends(get_db)):
-    ur = db.query(UserReward).get(user_reward_id)
+async def redeem_page(
+    token: str = None,
+    user_reward_id: int = None, user_id: int = None, reward_id: int = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Page behind the reward QR code. With a signed `token` it renders from the
+    token claims and the cached reward catalog (no DB read). The id-based links
+    from older app builds still work, with one lookup.
+    """
+    if token:
+        claims = verify_redeem_token(token)
+        if not claims:
+            return render_message("Ogiltig eller utgången reward!")
+        reward = (await reward_catalog.get(db)).get(claims["rid"])
+        if reward is None:
+            return render_message("Ogiltig eller redan använd reward!")
+        valid_until = datetime.utcfromtimestamp(claims["exp"])
+        return render_redeem_page(reward, valid_until, f"/docs/redeem?token={token}")
+
+    if user_reward_id is None:
+        return render_message("Ogiltig eller redan använd reward!")
+    ur = await db.get(UserReward, user_reward_id)
     if not ur or ur.user_id != user_id or ur.reward_id != reward_id:
-        return "<h1 style='font-size:2.5rem;text-align:center;'>Ogiltig eller redan använd reward!</h1>"
-    reward = db.query(Reward).get(reward_id)
+        return render_message("Ogiltig eller redan använd reward!")
     if ur.used:
-        return "<h1 style='font-size:2.5rem;text-align:center;'>Denna reward är redan använd!</h1>"
-    return f"""
-    <html>
-    <head>
-    <title>Redeem Reward</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        body {{
-            font-family: sans-serif;
-            background: #f7f7f7;
-            color: #222;
-            font-size: 2.2rem;
-        }}
-        .container {{
-            max-width: 900px;
-            margin: 80px auto;
-            background: #fff;
-            border-radius: 24px;
-            padding: 64px 24px 48px 24px;
-            box-shadow: 0 8px 32px #0003;
-        }}
-        h1 {{
-            color: #8DA46D;
-            font-size: 3.2rem;
-            margin-bottom: 2.5rem;
-            text-align: center;
-        }}
-        p {{
-            margin-bottom: 2.2rem;
-            font-size: 2rem;
-            text-align: center;
-        }}
-        .btn {{
-            display: inline-block;
-            padding: 32px 64px;
-            margin: 32px 24px 0 0;
-            border: none;
-            border-radius: 16px;
-            font-size: 2.2rem;
-            font-weight: bold;
-            cursor: pointer;
-            transition: background 0.2s, transform 0.1s;
-            box-shadow: 0 2px 8px #0002;
-        }}
-        .btn:active {{
-            transform: scale(0.97);
-        }}
-        .redeem {{
-            background: #8DA46D;
-            color: #fff;
-        }}
-        .redeem:hover {{
-            background: #6d8a54;
-        }}
-        .cancel {{
-            background: #ccc;
-            color: #222;
-        }}
-        .cancel:hover {{
-            background: #aaa;
-        }}
-        @media (max-width: 600px) {{
-            .container {{
-                padding: 32px 4vw 24px 4vw;
-            }}
-            h1 {{
-                font-size: 2.2rem;
-            }}
-            .btn {{
-                font-size: 1.5rem;
-                padding: 20px 10vw;
-            }}
-            p {{
-                font-size: 1.2rem;
-            }}
-        }}
-    </style>
-    </head>
-    <body>
-    <div class="container">
-        <h1>{reward.title}</h1>
-        <p><b>Beskrivning:</b> {reward.description or "Ingen beskrivning"}</p>
-        <p><b>Plats:</b> {reward.location or "Valfri partner"}</p>
-        <p><b>Giltig till:</b> {ur.expires_at.strftime('%Y-%m-%d') if ur.expires_at else "Okänt"}</p>
-        <form method="post" action="/docs/redeem/{user_reward_id}" style="text-align:center;">
-            <button class="btn redeem" type="submit">🎉 Redeem Reward!</button>
-            <button class="btn cancel" type="button" onclick="window.location.href='safedriveapp://profile'">Avbryt</button>
-        </form>
-    </div>
-    </body>
-    </html>
-    """
+        return render_message("Denna reward är redan använd!")
+    reward = (await reward_catalog.get(db)).get(reward_id)
+    if reward is None:
+        return render_message("Ogiltig eller redan använd reward!")
+    return render_redeem_page(reward, ur.expires_at, f"/docs/redeem/{user_reward_id}")
+
+@app.post("/docs/redeem", response_class=HTMLResponse)
+async def redeem_with_token(token: str, db: AsyncSession = Depends(get_db)):
+    claims = verify_redeem_token(token)
+    if not claims or not await redeem(db, claims["ur"], claims["uid"]):
+        return render_message("Reward already used or not found!")
+    return REDEEMED_PAGE
 
 @app.post("/docs/redeem/{user_reward_id}", response_class=HTMLResponse)
-def redeem_action(user_reward_id: int, db: Session = Depends(get_db)):
-    ur = db.query(UserReward).get(user_reward_id)
-    if not ur or ur.used:
-        return "<h1 style='font-size:2.5rem;text-align:center;'>Reward already used or not found!</h1>"
-    ur.used = True
-    ur.redeemed_at = datetime.utcnow()
-    db.commit()
-    return """
-    <html>
-    <head>
-      <title>Reward Redeemed</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1.0">
-      <style>
-        body {
-          font-family: sans-serif;
-          background: #f7f7f7;
-          color: #222;
-          font-size: 2.2rem;
-        }
-        .container {
-          max-width: 900px;
-          margin: 80px auto;
-          background: #fff;
-          border-radius: 24px;
-          padding: 64px 24px 48px 24px;
-          box-shadow: 0 8px 32px #0003;
-          text-align: center;
-        }
-        h1 {
-          color: #8DA46D;
-          font-size: 3.2rem;
-          margin-bottom: 2.5rem;
-        }
-        p {
-          margin-bottom: 2.2rem;
-          font-size: 2rem;
-        }
-        .btn {
-          display: inline-block;
-          padding: 32px 64px;
-          margin: 32px 24px 0 0;
-          border: none;
-          border-radius: 16px;
-          font-size: 2.2rem;
-          font-weight: bold;
-          cursor: pointer;
-          transition: background 0.2s, transform 0.1s;
-          box-shadow: 0 2px 8px #0002;
-        }
-        .btn:active {
-          transform: scale(0.97);
-        }
-        .cancel {
-          background: #ccc;
-          color: #222;
-        }
-        .cancel:hover {
-          background: #aaa;
-        }
-        @media (max-width: 600px) {
-          .container {
-            padding: 32px 4vw 24px 4vw;
-          }
-          h1 {
-            font-size: 2.2rem;
-          }
-          .btn {
-            font-size: 1.5rem;
-            padding: 20px 10vw;
-          }
-          p {
-            font-size: 1.2rem;
-          }
-        }
-      </style>
-    </head>
-    <body>
-      <div class="container">
-        <h1>Reward redeemed!</h1>
-        <p>Rewarden är nu använd.</p>
-        <button class="btn cancel" type="button" onclick="window.location.href='safedriveapp://profile'">Tillbaka till appen</button>
-      </div>
-    </body>
-    </html>
-    """
+async def redeem_action(user_reward_id: int, db: AsyncSession = Depends(get_db)):
+    if not await redeem(db, user_reward_id):
+        return render_message("Reward already used or not found!")
+    return REDEEMED_PAGE
+
+@app.post("/docs/rewards/invalidate", status_code=204)
+async def invalidate_reward_cache(
+    db: AsyncSession = Depends(get_db),
+    current_user: UserSnapshot = Depends(get_current_identity),
+):
+    """Call after editing rewards directly in the DB; all workers reload on their next check."""
+    await invalidate_rewards(db)   # committar versionen, sedan den här processens kopia
+    return Response(status_code=204)
 
 @app.get("/docs/quiz", response_model=List[QuizQuestionOut])
-def get_all_quiz_questions(db: Session = Depends(get_db)):
-    questions = db.query(QuizQuestion).all()
-    return questions
+async def get_all_quiz_questions(request: Request, db: AsyncSession = Depends(get_read_db)):
+    # Katalogen serialiseras en gång per version; klienter med rätt ETag får 304
+    catalog = await quiz_catalog.get(db)
+    headers = {"ETag": catalog.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), catalog.etag):
+        return Response(status_code=304, headers=headers)
+    return json_bytes_response(catalog.body, request, headers=headers, cache_key=catalog.etag)
 
 @app.post("/docs/quiz/submit", response_model=QuizSubmitResponse)
-def submit_quiz(
+async def submit_quiz(
     payload: QuizSubmitRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # ensure user exists
-    if not get_user(db, payload.user_id):
+    # grade_quiz verifierar användaren i samma skrivning (ingen separat läsning)
+    try:
+        result = await grade_quiz(db, payload.user_id, [a.dict() for a in payload.answers])
+    except (UserNotFound, IntegrityError):
+        await db.rollback()
         raise HTTPException(404, "User not found")
-    result = grade_quiz(db, payload.user_id, [a.dict() for a in payload.answers])
     return result
 
-def perspective_warp(img, src_pts, dst_size, crop_bottom=0):
-    """
-    Warps the perspective of img from src_pts (4 points) to a rectangle of size dst_size (W, H).
-    """
-    W, H = dst_size
-    dst_pts = np.float32([
-        [0, H - crop_bottom],      # bottom-left
-        [W, H - crop_bottom],      # bottom-right
-        [W, 0],      # top-right
-        [0, 0],      # top-left
-    ])
-    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-    warped = cv2.warpPerspective(img, M, (W, H))
-    return warped
-
-def run_model_on_video(input_path: str, output_path: str, progress_key: str = None):
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open '{input_path}'")
-
-    fps = cap.get(cv2.CAP_PROP_FPS) or 20
-
-    # --- Model input/output sizes ---
-    ROI_W = 1640
-    ROI_H = 590                  # Try 480 or higher
-
-    KB = 11
-    NUM_LANES = 4  # or whatever your model expects
-    buffers = [deque(maxlen=KB) for _ in range(NUM_LANES)]
-
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (ROI_W, ROI_H))
-
-    logger = logging.getLogger("uvicorn")
-    logger.info(f"Starting conversion: {input_path} → {output_path}")
-
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_idx = 0
-    redline_times = []
-    while True:
-        ret, frame_bgr = cap.read()
-        if not ret or frame_bgr is None:
-            break
-        frame_idx += 1
-
-        # 1) Apply distortion to the full frame
-        frame_h, frame_w = frame_bgr.shape[:2]
-
-        # 1) Define your source points (adjust as needed)
-        src_pts = np.float32([
-        [frame_w * 0.0, frame_h * 0.88],    # bottom-left
-        [frame_w * 1.0, frame_h * 0.88],    # bottom-right
-        [frame_w * 1.0, frame_h * 0.37],     # top-right
-        [frame_w * 0.0, frame_h * 0.37],     # top-left
-        ])
-
-        # 2) Define output size (same as ROI_W, ROI_H)
-        dst_size = (ROI_W, ROI_H)
-
-        # 3) Apply perspective warp
-        warped = perspective_warp(frame_bgr, src_pts, dst_size, crop_bottom=-40)
-
-        # 4) Use 'warped' instead of 'roi' for further processing
-        roi_resized = warped  # Already the right size
-
-        # --- Visual debugging: save the first ROI frame ---
-        if frame_idx == 1:
-            cv2.imwrite("debug_roi.jpg", roi_resized)
-        # --- end visual debugging ---
-
-        # 4) Preprocess for ONNX/model
-        orig_h, orig_w = roi_resized.shape[:2]
-        pil = Image.fromarray(cv2.cvtColor(roi_resized, cv2.COLOR_BGR2RGB))
-        x = infer_transform(pil).unsqueeze(0).numpy()
-
-        # 5) Model inference
-        outp = SESSION.run(None, {"input": x})[0]    # shape (1,201,18,4)
-        logits = outp[0][:, ::-1, :]                 # flip Y
-
-        prob = scipy.special.softmax(logits[:-1], axis=0)
-        idx = (np.arange(col_sample.shape[0]) + 1).reshape(-1,1,1)
-        loc = np.sum(prob * idx, axis=0)
-        argm = np.argmax(logits, axis=0)
-        loc[argm == col_sample.shape[0]] = 0
-
-        for lane in range(len(buffers)):
-            buffers[lane].append(loc[:, lane].copy())
-            # Stack buffer and ignore zeros for median
-            arr = np.stack(buffers[lane], axis=0)
-            # Mask zeros
-            arr_masked = np.where(arr == 0, np.nan, arr)
-            loc[:, lane] = np.nanmedian(arr_masked, axis=0)
-            # If all are nan, fallback to original
-            loc[:, lane][np.isnan(loc[:, lane])] = loc[:, lane][np.isnan(loc[:, lane])]
-
-        # 6) Draw overlays
-        img_bgr = roi_resized.copy()
-        sx = orig_w / 800.0
-        sy = orig_h / 288.0
-        red_lines_this_frame = 0
-        for lane in range(loc.shape[1]):
-            pts = []
-            for r in range(loc.shape[0]):
-                xbin = loc[r, lane]
-                if xbin > 0:
-                    px = int(xbin * (col_sample[1] - col_sample[0]) * sx)
-                    py = int(row_anchor[loc.shape[0]-1-r] * sy)
-                    pts.append((px, py))
-                    cv2.circle(img_bgr, (px,py), 3, (255,0,255), -1)
-            if len(pts) >= 5:  # Need enough points for a good fit
-                pts_np = np.array(pts)
-                # Fit a 2nd degree polynomial (quadratic curve): x = f(y)
-                z = np.polyfit(pts_np[:,1], pts_np[:,0], 2)
-                f = np.poly1d(z)
-                y_new = np.linspace(pts_np[:,1].min(), pts_np[:,1].max(), 50)
-                x_new = f(y_new)
-                curve_pts = np.array([x_new, y_new], dtype=np.int32).T
-
-                # Color logic
-                mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
-                sx0, sy0 = pts[0]
-                col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
-
-                if col == (0,0,255) and sx0 < mid_x:  # left of car and red
-                    red_lines_this_frame += 1
-
-                cv2.polylines(img_bgr, [curve_pts], False, col, 2)
-            elif len(pts) >= 2:
-                # Color logic
-                mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
-                sx0, sy0 = pts[0]
-                col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
-
-                if col == (0,0,255) and sx0 < mid_x:  # left of car and red
-                    red_lines_this_frame += 1
-
-                for i in range(len(pts)-1):
-                    cv2.line(img_bgr, pts[i], pts[i+1], col, 2)
-
-        # ... draw lane overlays on img_bgr ...
-        if red_lines_this_frame >= 2:
-            redline_times.append(frame_idx / fps)
-
-        out.write(img_bgr)
-
-        if progress_key:
-            video_progress[progress_key] = frame_idx / total_frames
-
-        if frame_idx % 50 == 0:
-            logger.info(f"Processed {frame_idx} frames…")
-
-    if progress_key:
-        video_progress[progress_key] = 1.0  # 100% done
-
-    logger.info(f"Red lines detected in {len(redline_times)} frames")
-    json_path = output_path.replace('.mp4', '_redlines.json')
-    with open(json_path, 'w') as f:
-        json.dump(redline_times, f)
-
-    cap.release()
-    out.release()
-    logger.info(f"Finished conversion of {input_path}")
-
-# ─── 1) NY: POST /convert_video/ ──────────────────────────────────────
-
-
-def run_conversion_and_update_status(inp, outp, out_filename):
-    try:
-        progress_key = out_filename
-        run_model_on_video(inp, outp, progress_key=progress_key)
-        dur = probe_duration(outp)
-        conversion_status[out_filename] = {"status": "done", "duration": dur}
-        video_progress[progress_key] = 1.0
-    except Exception as e:
-        conversion_status[out_filename] = {"status": "error", "error": str(e)}
-        video_progress[progress_key] = -1
-
-live_buffers = [deque(maxlen=5) for _ in range(4)]
-
-
-@lane_router.post("/docs/lane_overlay/")
-async def lane_overlay(file: UploadFile = File(...)):
-    """
-    Tar emot en bild, kör lane-detection med ONNX-modellen och returnerar bilden med overlay.
-    """
-    # Läs in bilden från klienten
-    content = await file.read()
-    np_img = np.frombuffer(content, np.uint8)
-    frame_bgr = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-
-    if frame_bgr is None:
-        raise HTTPException(status_code=400, detail="Kunde inte läsa bilden.")
-
-    start = time.perf_counter()
-
-    frame_h, frame_w = frame_bgr.shape[:2]
-
-    src_pts_live = np.float32([
-        [frame_w * 0.0, frame_h * 0.88],    # bottom-left
-        [frame_w * 1.0, frame_h * 0.88],    # bottom-right
-        [frame_w * 1.0, frame_h * 0.37],     # top-right
-        [frame_w * 0.0, frame_h * 0.37],     # top-left
-    ])
-    dst_size_live = (1640, 590)
-    warped = perspective_warp(frame_bgr, src_pts_live, dst_size_live, crop_bottom=0)
-
-    # --- Preprocess för ONNX ---
-    pil = Image.fromarray(cv2.cvtColor(warped, cv2.COLOR_BGR2RGB))
-    x = infer_transform(pil).unsqueeze(0).numpy()
-
-    # --- Modell-inferens ---
-    outp = SESSION.run(None, {"input": x})[0]    # shape (1,201,18,4)
-    if SESSION is None:
-        raise HTTPException(status_code=500, detail="Modellen är inte laddad.")
-    infer_time = (time.perf_counter() - start) * 1000  # ms
-    logging.info(f"Inference time: {infer_time:.2f} ms")
-    logits = outp[0][:, ::-1, :]                 # flip Y
-
-    prob = scipy.special.softmax(logits[:-1], axis=0)
-    idx = (np.arange(col_sample.shape[0]) + 1).reshape(-1,1,1)
-    loc = np.sum(prob * idx, axis=0)
-    argm = np.argmax(logits, axis=0)
-    loc[argm == col_sample.shape[0]] = 0
-
-    # --- Rita overlay på bilden ---
-    img_overlay = warped.copy()
-    orig_h, orig_w = img_overlay.shape[:2]
-    sx = orig_w / 800.0
-    sy = orig_h / 288.0
-    num_red_lines = 0
-    for lane in range(loc.shape[1]):
-            pts = []
-            for r in range(loc.shape[0]):
-                xbin = loc[r, lane]
-                if xbin > 0:
-                    px = int(xbin * (col_sample[1] - col_sample[0]) * sx)
-                    py = int(row_anchor[loc.shape[0]-1-r] * sy)
-                    pts.append((px, py))
-                    cv2.circle(img_overlay, (px,py), 3, (255,0,255), -1)
-            
-            # Buffer/median per lane
-            live_buffers[lane].append(loc[:, lane].copy())
-            arr = np.stack(live_buffers[lane], axis=0)
-            arr_masked = np.where(arr == 0, np.nan, arr)
-            loc[:, lane] = np.nanmedian(arr_masked, axis=0)
-            loc[:, lane][np.isnan(loc[:, lane])] = loc[:, lane][np.isnan(loc[:, lane])]
-            if len(pts) >= 5:  # Need enough points for a good fit
-                pts_np = np.array(pts)
-                # Fit a 2nd degree polynomial (quadratic curve): x = f(y)
-                z = np.polyfit(pts_np[:,1], pts_np[:,0], 2)
-                f = np.poly1d(z)
-                y_new = np.linspace(pts_np[:,1].min(), pts_np[:,1].max(), 50)
-                x_new = f(y_new)
-                curve_pts = np.array([x_new, y_new], dtype=np.int32).T
-
-                # Color logic
-                mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
-                sx0, sy0 = pts[0]
-                col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
-                if col == (0,0,255):
-                    num_red_lines += 1
-                cv2.polylines(img_overlay, [curve_pts], False, col, 2)
-            elif len(pts) >= 2:
-                # Color logic
-                mid_x, limit_y = int(orig_w * 0.48), int(orig_h * 0.4)
-                sx0, sy0 = pts[0]
-                col = (0,255,0) if (sx0 >= mid_x and sy0 >= limit_y) else (0,0,255)
-                if col == (0,0,255):
-                    num_red_lines += 1
-                for i in range(len(pts)-1):
-                    cv2.line(img_overlay, pts[i], pts[i+1], col, 2)
-    
-    print(f"Detected {num_red_lines} red lines in this frame.")
-    # --- Returnera bilden som JPEG ---
-    _, img_encoded = cv2.imencode('.jpg', img_overlay)
-    headers = {"X-Red-Lines": str(num_red_lines)}
-    return Response(content=img_encoded.tobytes(), media_type="image/jpeg", headers=headers)
-
-# Registrera routern i din app
-app.include_router(lane_router)
-
-@app.post("/docs/convert_video/")
-def convert_video(session_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    sess = db.query(DrivingSession).get(session_id)
-    if not sess:
-        raise HTTPException(404, "Session not found")
-
-    inp  = os.path.join(UPLOAD_DIR, sess.file_path)
-    base, _ = os.path.splitext(sess.file_path)
-    timestamp = int(time.time() * 1000)
-    out_filename = f"marked_{base}_{timestamp}.mp4"
-    outp = os.path.join(UPLOAD_DIR, out_filename)
-
-    # Mark as processing
-    conversion_status[out_filename] = {"status": "processing"}
-    # Start background task
-    background_tasks.add_task(run_conversion_and_update_status, inp, outp, out_filename)
-
-    return {"marked_video_path": out_filename, "status": "processing"}
-
-@app.post("/docs/depth_map/")
-async def depth_map(file: UploadFile = File(...)):
-    """
-    Tar emot en bild, kör depth-prediktion med ONNX-modellen och returnerar depth map (meter) som PNG.
-    """
-    content = await file.read()
-    np_img = np.frombuffer(content, np.uint8)
-    frame_bgr = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-
-    if frame_bgr is None:
-        raise HTTPException(status_code=400, detail="Kunde inte läsa bilden.")
-
-    pil = Image.fromarray(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
-    x = depth_transform(pil).unsqueeze(0).numpy()
-
-    if DEPTH_SESSION is None:
-        raise HTTPException(status_code=500, detail="Depth-modellen är inte laddad.")
-    disp = DEPTH_SESSION.run(None, {"input": x})[0]
-    disp = disp.squeeze()
-
-    # Omvandla till depth (meter)
-    depth = DEPTH_SCALE / (disp + 1e-6)
-
-    # Normalisera depth till 0-255 för PNG (valfritt: invertera så att nära är ljusare)
-    depth_norm = (255 * (depth - depth.min()) / (depth.max() - depth.min() + 1e-8)).astype(np.uint8)
-    depth_color = cv2.applyColorMap(depth_norm, cv2.COLORMAP_VIRIDIS)
-
-    # ...existing code in depth_map...
-
-    # Rita ut rutan i mitten (20x20 pixlar)
-    h, w = depth.shape
-    x1 = w//2 - DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET_X
-    y1 = h//2 - DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET
-    x2 = w//2 + DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET_X
-    y2 = h//2 + DEPTH_BOX_SIZE//2 + DEPTH_BOX_OFFSET
-    cv2.rectangle(depth_color, (x1, y1), (x2, y2), (0,255,0), 2)
-
-    _, img_encoded = cv2.imencode('.png', depth_color)
-    return Response(content=img_encoded.tobytes(), media_type="image/png")
-
-@app.post("/docs/depth_map_raw/")
-async def depth_map_raw(file: UploadFile = File(...)):
-    content = await file.read()
-    np_img = np.frombuffer(content, np.uint8)
-    frame_bgr = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-    if frame_bgr is None:
-        raise HTTPException(status_code=400, detail="Kunde inte läsa bilden.")
-
-    pil = Image.fromarray(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
-    x = depth_transform(pil).unsqueeze(0).numpy()
-
-    if DEPTH_SESSION is None:
-        raise HTTPException(status_code=500, detail="Depth-modellen är inte laddad.")
-    disp = DEPTH_SESSION.run(None, {"input": x})[0]
-    disp = disp.squeeze()
-    depth = DEPTH_SCALE / (disp + 1e-6)  # meter
-    depth_list = depth.tolist()
-
-    print("disp min:", disp.min(), "max:", disp.max(), "mean:", disp.mean())
-    print("depth min:", depth.min(), "max:", depth.max(), "mean:", depth.mean())
-
-    return {"depth": depth_list}
-
+@app.post("/docs/quiz/invalidate", status_code=204)
+async def invalidate_quiz_cache(
+    db: AsyncSession = Depends(get_db),
+    current_user: UserSnapshot = Depends(get_current_identity),
+):
+    """Call after editing quiz questions directly in the DB; all workers reload on their next check."""
+    await invalidate_quiz(db)   # committar versionen, sedan den här processens kopia
+    return Response(status_code=204)
 
-@app.get("/docs/conversion_progress/")
-def get_conversion_progress(marked_video_path: str):
-    progress = video_progress.get(marked_video_path)
-    if progress is None:
-        return {"progress": 0.0}
-    return {"progress": progress}
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-@app.get("/docs/conversion_status/")
-def get_conversion_status(marked_video_path: str):
-    return conversion_status.get(marked_video_path, {"status": "not_found"})
+if INFERENCE_MODE == "inline":
+    # OpenCV, onnxruntime, scipy och modellerna laddas bara här
+    from inference import router as inference_router, inference_unavailable_handler, InferenceServerUnavailable
+    app.include_router(inference_router)
+    app.add_exception_handler(InferenceServerUnavailable, inference_unavailable_handler)
 
 @app.post(
     "/docs/driving_sessions/",
@@ -963,11 +541,11 @@ def get_conversion_status(marked_video_path: str):
 async def create_drive_record(
     user_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
   
     # 1) Validate that the user actually exists
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -1001,15 +579,12 @@ async def create_drive_record(
         # created_at defaults to NOW()
         # points_awarded defaults to 0
     )
-    db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
-
-    fullpath = os.path.join(UPLOAD_DIR, new_record.file_path)
-    dur = probe_duration(fullpath)
+    # ffprobe körs innan insert så att raden skrivs i en enda commit
+    dur = await run_in_threadpool(probe_duration, dest_path)
     new_record.duration = dur
-    db.commit()
-    db.refresh(new_record)
+    db.add(new_record)
+    await db.commit()
+    await db.refresh(new_record)
 
     return new_record
 
@@ -1020,29 +595,40 @@ async def create_drive_record(
     response_model=List[DrivingSessionResponse],
     status_code=200,
 )
-def list_drive_records(
+async def list_drive_records(
+    request: Request,
+    response: Response,
     user_id: int = Query(..., description="ID of the user"),
-    db: Session = Depends(get_db),
+    limit: int = Query(None, ge=1, le=MAX_PAGE_LIMIT, description="Page size (newest first)"),
+    cursor: str = Query(None, description=f"Value of the previous page's {NEXT_CURSOR_HEADER} header"),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
-    Return all driving sessions for a given user.
+    Return the driving sessions for a given user, newest first.
+    With `limit` the result is one page; the next page's cursor is returned in
+    the X-Next-Cursor header (absent on the last page).
     """
     # 1) verify user exists
-    if not db.query(User).filter(User.id == user_id).first():
+    if not await get_user(db, user_id):
         raise HTTPException(404, "User not found")
 
     # 2) query sessions
-    sessions = (
-        db.query(DrivingSession)
-          .filter(DrivingSession.user_id == user_id)
-          .order_by(DrivingSession.start_time.desc())
-          .all()
+    rows, next_cursor = await paginate(
+        db,
+        select(DrivingSession).where(DrivingSession.user_id == user_id),
+        DrivingSession.start_time, DrivingSession.id, limit, cursor,
     )
-    return sessions
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    response.headers.update(headers)   # används när FAST_JSON_ENABLED=false
+    return list_response(DrivingSessionResponse, rows, request, headers)
 
 @app.delete("/docs/driving_sessions/{session_id}", status_code=204)
-def delete_driving_session(session_id: int, db: Session = Depends(get_db)):
-    session = db.query(DrivingSession).filter(DrivingSession.id == session_id).first()
+async def delete_driving_session(session_id: int, db: AsyncSession = Depends(get_db)):
+    # events/feedbacks raderas via ORM-cascade och måste laddas i förväg i async-läge
+    session = await db.get(
+        DrivingSession, session_id,
+        options=[selectinload(DrivingSession.events), selectinload(DrivingSession.feedbacks)],
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     # Remove video file from disk
@@ -1054,8 +640,8 @@ def delete_driving_session(session_id: int, db: Session = Depends(get_db)):
             os.remove(marked_path)
     except OSError:
         pass
-    db.delete(session)
-    db.commit()
+    await db.delete(session)
+    await db.commit()
     return Response(status_code=204)
 
 @app.post(
@@ -1066,14 +652,14 @@ def delete_driving_session(session_id: int, db: Session = Depends(get_db)):
 async def upload_photo_for_user(
     user_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Ta emot en bild (jpg, jpeg eller png) för en användare, spara den i uploads/photos/,
     och skapa en rad i photo_uploads-tabellen.
     """
     # 1) Kontrollera att användaren finns
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -1105,8 +691,8 @@ async def upload_photo_for_user(
         file_path=dest_path
     )
     db.add(new_photo)
-    db.commit()
-    db.refresh(new_photo)
+    await db.commit()
+    await db.refresh(new_photo)
 
     # 6) Returnera den nyskapade raden
     return new_photo
@@ -1117,23 +703,36 @@ async def upload_photo_for_user(
     response_model=List[PhotoUploadResponse],
     status_code=status.HTTP_200_OK
 )
-def list_photos_for_user(
+async def list_photos_for_user(
+    request: Request,
+    response: Response,
     user_id: int = Query(..., description="ID of the user"),
-    db: Session = Depends(get_db)
+    limit: int = Query(None, ge=1, le=MAX_PAGE_LIMIT, description="Page size (newest first)"),
+    cursor: str = Query(None, description=f"Value of the previous page's {NEXT_CURSOR_HEADER} header"),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Returnerar en lista med alla PhotoUpload-poster för en given user_id.
+    Returnerar PhotoUpload-poster för en given user_id. Utan `limit` hela
+    listan i uppladdningsordning som tidigare; med `limit` en sida, nyaste
+    först, och nästa sidas cursor i X-Next-Cursor.
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    photos = db.query(PhotoUpload).filter(PhotoUpload.user_id == user_id).all()
-    return photos
+    rows, next_cursor = await paginate(
+        db,
+        select(PhotoUpload).where(PhotoUpload.user_id == user_id),
+        PhotoUpload.created_at, PhotoUpload.id, limit, cursor,
+        unpaged_order=(PhotoUpload.id,),
+    )
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    response.headers.update(headers)   # används när FAST_JSON_ENABLED=false
+    return list_response(PhotoUploadResponse, rows, request, headers)
 
 @app.delete("/docs/photo_upload/{photo_id}", status_code=204)
-def delete_photo(photo_id: int, db: Session = Depends(get_db)):
-    photo = db.query(PhotoUpload).filter(PhotoUpload.id == photo_id).first()
+async def delete_photo(photo_id: int, db: AsyncSession = Depends(get_db)):
+    photo = await db.get(PhotoUpload, photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     # Ta bort filen från disk
@@ -1142,14 +741,31 @@ def delete_photo(photo_id: int, db: Session = Depends(get_db)):
     except OSError:
         pass
     # Ta bort posten i databasen
-    db.delete(photo)
-    db.commit()
+    await db.delete(photo)
+    await db.commit()
     return Response(status_code=204)
 
 
 @app.on_event("startup")
-def startup_event():
-    init_db()
+async def startup_event():
+    await init_db_async()
+    rounds = await password_hasher.calibrate()
+    logger.info("bcrypt cost %d (target %.0f ms)", rounds, PASSWORD_HASH_TARGET_MS)
+    # Bygg facit-cachen direkt så att första quiz-inlämningen inte betalar för det
+    async with AsyncSessionLocal() as db:
+        await quiz_answer_key.get(db)
+        await quiz_catalog.get(db)
+        await reward_catalog.get(db)
+    # Rensning/komprimering i bakgrunden (eller som egen process: python maintenance.py)
+    start_in_process(AsyncSessionLocal)
+    mailer.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_in_process()
+    await mailer.stop()
+    password_hasher.shutdown()
+    shutdown_logging()   # sist, så att nedstängningens loggrader hinner skrivas
 
 @app.get("/")
 def root():
@@ -0,0 +1,280 @@
+# maintenance.py
+#
+# Background maintenance jobs (purging expired reset codes and rewards,
+# compacting the points ledger) and the scheduler that runs them.
+#
+# Every job works in small index-driven batches with a commit after each one,
+# so no lock is held for long, and stops after MAINTENANCE_MAX_JOB_SECONDS.
+# With several API workers, each job is run by whichever process holds its
+# lease in scheduler_leases. The others skip it until the lease expires.
+#
+# Runs in-process on API startup (MAINTENANCE_IN_PROCESS=true, default), or
+# as a separate worker:
+#   cd backend
+#   python maintenance.py            # loop forever
+#   python maintenance.py --once     # run every job once and exit
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from metrics import metrics
+from models import PasswordResetCode, UserReward, SchedulerLease
+from points import compact_ledger, LEDGER_COMPACTION_INTERVAL_HOURS
+import sync  # noqa: F401  registrerar tombstone-hooken även när vi körs som egen process
+
+logger = logging.getLogger("uvicorn")
+
+MAINTENANCE_IN_PROCESS = os.getenv("MAINTENANCE_IN_PROCESS", "true").lower() in ("1", "true", "yes")
+MAINTENANCE_TICK_SECONDS = float(os.getenv("MAINTENANCE_TICK_SECONDS", "60"))
+MAINTENANCE_BATCH = int(os.getenv("MAINTENANCE_BATCH", "500"))
+# Paus mellan batcher så att andra transaktioner kommer åt tabellen
+MAINTENANCE_BATCH_PAUSE = float(os.getenv("MAINTENANCE_BATCH_PAUSE", "0.05"))
+MAINTENANCE_MAX_JOB_SECONDS = float(os.getenv("MAINTENANCE_MAX_JOB_SECONDS", "30"))
+
+RESET_CODE_RETENTION_HOURS = float(os.getenv("RESET_CODE_RETENTION_HOURS", "24"))
+RESET_CODE_PURGE_INTERVAL_MINUTES = float(os.getenv("RESET_CODE_PURGE_INTERVAL_MINUTES", "15"))
+# Oanvända belöningar tas bort så här länge efter att de gått ut
+USER_REWARD_RETENTION_DAYS = int(os.getenv("USER_REWARD_RETENTION_DAYS", "30"))
+USER_REWARD_EXPIRY_INTERVAL_HOURS = float(os.getenv("USER_REWARD_EXPIRY_INTERVAL_HOURS", "6"))
+
+maintenance_job_seconds = metrics.histogram(
+    "safedrive_maintenance_job_seconds",
+    "Duration of one maintenance job run.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+# ─── Jobb: (db, deadline) -> antal behandlade rader ────────────────────
+
+async def purge_reset_codes(db: AsyncSession, deadline: float) -> int:
+    """Delete reset codes that expired more than RESET_CODE_RETENTION_HOURS ago, oldest first."""
+    cutoff = datetime.utcnow() - timedelta(hours=RESET_CODE_RETENTION_HOURS)
+    removed = 0
+    while time.monotonic() < deadline:
+        ids = (await db.execute(
+            select(PasswordResetCode.id)
+            .where(PasswordResetCode.expires_at < cutoff)
+            .order_by(PasswordResetCode.expires_at)
+            .limit(MAINTENANCE_BATCH)
+        )).scalars().all()
+        if not ids:
+            break
+        await db.execute(
+            delete(PasswordResetCode).where(PasswordResetCode.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        removed += len(ids)
+        await asyncio.sleep(MAINTENANCE_BATCH_PAUSE)
+    return removed
+
+
+async def expire_user_rewards(db: AsyncSession, deadline: float) -> int:
+    """
+    Delete unused rewards that expired more than USER_REWARD_RETENTION_DAYS ago.
+    Deleted through the ORM so sync.py records tombstones for the app.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=USER_REWARD_RETENTION_DAYS)
+    removed = 0
+    while time.monotonic() < deadline:
+        rows = (await db.execute(
+            select(UserReward)
+            .where(UserReward.expires_at < cutoff, UserReward.used == False)  # noqa: E712
+            .order_by(UserReward.expires_at)
+            .limit(MAINTENANCE_BATCH)
+        )).scalars().all()
+        if not rows:
+            break
+        for row in rows:
+            await db.delete(row)
+        await db.commit()
+        removed += len(rows)
+        await asyncio.sleep(MAINTENANCE_BATCH_PAUSE)
+    return removed
+
+
+async def compact_points_ledger(db: AsyncSession, deadline: float) -> int:
+    # compact_ledger batchar och committar per användare, och slutar mellan användare vid deadline
+    return await compact_ledger(db, deadline=deadline)
+
+
+# ─── Schemaläggare ────────────────────────────────────────────────────
+
+class Job:
+    def __init__(self, name: str, func, interval_seconds: float):
+        self.name = name
+        self.func = func
+        self.interval = interval_seconds
+        self.next_run = 0.0
+        self.runs = 0
+        self.rows_total = 0
+        self.last_rows = None
+        self.last_seconds = None
+        self.failures = 0
+
+
+class MaintenanceScheduler:
+    def __init__(self, session_factory, owner: str = None):
+        self.session_factory = session_factory
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs = []
+        self._task = None
+
+    def add(self, name: str, func, interval_seconds: float) -> Job:
+        job = Job(name, func, interval_seconds)
+        self.jobs.append(job)
+        return job
+
+    async def acquire_lease(self, db: AsyncSession, name: str, seconds: float) -> bool:
+        """Take or renew the job's lease. False if another live process holds it."""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=seconds)
+        result = await db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name,
+                   or_(SchedulerLease.expires_at < now, SchedulerLease.owner == self.owner))
+            .values(owner=self.owner, expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            if await db.scalar(select(SchedulerLease.name).where(SchedulerLease.name == name)) is not None:
+                await db.rollback()
+                return False
+            db.add(SchedulerLease(name=name, owner=self.owner, expires_at=expires_at))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()   # en annan process skapade leasen samtidigt
+            return False
+        return True
+
+    async def run_job(self, job: Job, force: bool = False):
+        """Run one job if this process gets its lease. Returns rows processed, or None if skipped."""
+        async with self.session_factory() as db:
+            try:
+                # Leasen gäller ett helt intervall: bara ägaren kör jobbet under den tiden
+                if not await self.acquire_lease(db, job.name, job.interval) and not force:
+                    return None
+                t0 = time.monotonic()
+                rows = await job.func(db, t0 + MAINTENANCE_MAX_JOB_SECONDS)
+            except Exception:
+                await db.rollback()
+                job.failures += 1
+                logger.exception(f"Maintenance job {job.name} failed")
+                return None
+        seconds = time.monotonic() - t0
+        job.runs += 1
+        job.rows_total += rows
+        job.last_rows = rows
+        job.last_seconds = seconds
+        maintenance_job_seconds.labels(job=job.name).observe(seconds)
+        logger.info(f"Maintenance job {job.name}: {rows} rows in {seconds:.2f}s")
+        return rows
+
+    async def run_once(self, force: bool = False) -> dict:
+        return {job.name: await self.run_job(job, force) for job in self.jobs}
+
+    async def run_forever(self, tick: float = MAINTENANCE_TICK_SECONDS):
+        while True:
+            now = time.monotonic()
+            for job in self.jobs:
+                if now >= job.next_run:
+                    job.next_run = now + job.interval
+                    try:
+                        await self.run_job(job)
+                    except Exception:
+                        # t.ex. när rollback efter ett DB-fel också misslyckas; nästa tick försöker igen
+                        job.failures += 1
+                        logger.exception(f"Maintenance tick for {job.name} failed")
+            await asyncio.sleep(tick)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> dict:
+        return {job.name: {"runs": job.runs, "rows_total": job.rows_total, "last_rows": job.last_rows,
+                           "last_seconds": job.last_seconds, "failures": job.failures}
+                for job in self.jobs}
+
+
+def build_scheduler(session_factory) -> MaintenanceScheduler:
+    scheduler = MaintenanceScheduler(session_factory)
+    scheduler.add("purge_reset_codes", purge_reset_codes, RESET_CODE_PURGE_INTERVAL_MINUTES * 60)
+    scheduler.add("expire_user_rewards", expire_user_rewards, USER_REWARD_EXPIRY_INTERVAL_HOURS * 3600)
+    scheduler.add("compact_points_ledger", compact_points_ledger, LEDGER_COMPACTION_INTERVAL_HOURS * 3600)
+    return scheduler
+
+
+_schedulers = []
+
+
+def _collect_maintenance_metrics():
+    samples = [(job.name, job) for scheduler in _schedulers for job in scheduler.jobs]
+    return [
+        ("safedrive_maintenance_rows_total", "counter", "Rows purged/processed per maintenance job.",
+         [({"job": name}, job.rows_total) for name, job in samples]),
+        ("safedrive_maintenance_failures_total", "counter", "Failed maintenance job runs.",
+         [({"job": name}, job.failures) for name, job in samples]),
+    ]
+
+
+metrics.register_collector(_collect_maintenance_metrics)
+
+
+def start_in_process(session_factory):
+    """Started from the API's startup event. Returns the scheduler, or None if disabled."""
+    if not MAINTENANCE_IN_PROCESS:
+        return None
+    scheduler = build_scheduler(session_factory)
+    _schedulers.append(scheduler)
+    scheduler.start()
+    return scheduler
+
+
+async def stop_in_process():
+    """Called from the API's shutdown event."""
+    for scheduler in _schedulers:
+        await scheduler.stop()
+
+
+async def _main():
+    from db import AsyncSessionLocal, init_db_async
+    from logging_setup import setup_logging, shutdown_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="run every job once (ignoring leases) and exit")
+    args = parser.parse_args()
+
+    setup_logging()
+    await init_db_async()
+    scheduler = build_scheduler(AsyncSessionLocal)
+    _schedulers.append(scheduler)
+    try:
+        if args.once:
+            for name, rows in (await scheduler.run_once(force=True)).items():
+                print(f"{name}: {rows} rows")
+        else:
+            await scheduler.run_forever()
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
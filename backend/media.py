@@ -0,0 +1,21 @@
+# media.py
+#
+# Upload directory and ffprobe helper, shared by the CRUD endpoints in main.py
+# and the ML endpoints in inference.py without pulling either into the other.
+
+import os
+import subprocess
+
+UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+
+def probe_duration(path: str) -> float:
+    """Return video duration in seconds using ffprobe."""
+    out = subprocess.check_output([
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ])
+    return float(out)
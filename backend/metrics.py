@@ -0,0 +1,220 @@
+# metrics.py
+#
+# Lightweight in-process metrics for the ML pipeline: fixed-bucket histograms,
+# a per-stage timer for the hot paths and Prometheus text exposition for /metrics.
+
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Sekunder, från sub-millisekund (draw/encode) upp till långsam inferens
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Hur många konverteringsjobb som behåller egna histogram i /metrics
+METRICS_MAX_JOBS = int(os.getenv("METRICS_MAX_JOBS", "20"))
+# Andel frames som skrivs till trace-filen när inget annat anges (0 = av)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+
+class Histogram:
+    """Fixed-bucket histogram, safe to share between threads."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # sista = +Inf
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the q-quantile (Inf above the last bucket)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return float(self.buckets[i]) if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self, scale: float = 1.0) -> dict:
+        """Summary for JSON endpoints; `scale` converts units (e.g. 1000 for s -> ms)."""
+        with self._lock:
+            return {
+                "count": self.count,
+                "mean": round(self.total / self.count * scale, 3) if self.count else 0.0,
+                "p50": self.quantile(0.5) * scale,
+                "p95": self.quantile(0.95) * scale,
+                "p99": self.quantile(0.99) * scale,
+            }
+
+    def prometheus_lines(self, name: str, labels: dict) -> list:
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.total
+        lines = []
+        cumulative = 0
+        for bound, c in zip(self.buckets + ("+Inf",), counts):
+            cumulative += c
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+        return lines
+
+
+class HistogramFamily:
+    def __init__(self, name: str, help_text: str, buckets=STAGE_BUCKETS, max_series: int = None):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.max_series = max_series
+        self._series = OrderedDict()   # tuple(sorted(labels)) -> Histogram
+        self._lock = threading.Lock()
+
+    def labels(self, **labels) -> Histogram:
+        key = tuple(sorted(labels.items()))
+        hist = self._series.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._series.get(key)
+                if hist is None:
+                    hist = self._series[key] = Histogram(self.buckets)
+                    if self.max_series and len(self._series) > self.max_series:
+                        self._series.popitem(last=False)
+        return hist
+
+    def remove(self, **labels):
+        with self._lock:
+            self._series.pop(tuple(sorted(labels.items())), None)
+
+    def series(self):
+        with self._lock:
+            return list(self._series.items())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, hist in self.series():
+            lines.extend(hist.prometheus_lines(self.name, dict(key)))
+        return lines
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families = []
+        self._collectors = []
+
+    def histogram(self, name: str, help_text: str, buckets=STAGE_BUCKETS, max_series: int = None) -> HistogramFamily:
+        family = HistogramFamily(name, help_text, buckets, max_series)
+        self._families.append(family)
+        return family
+
+    def register_collector(self, collector):
+        """`collector()` returns (name, type, help, [(labels, value), ...]) tuples at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+endpoint_stage_seconds = metrics.histogram(
+    "safedrive_endpoint_stage_seconds",
+    "Time spent per ML pipeline stage, per endpoint.",
+)
+job_stage_seconds = metrics.histogram(
+    "safedrive_job_stage_seconds",
+    "Time spent per ML pipeline stage, per video conversion job (most recent jobs only).",
+    max_series=METRICS_MAX_JOBS * 8,
+)
+
+
+class StageTimer:
+    """
+    Low-overhead stage timer: one perf_counter() per mark.
+
+        timer = StageTimer(endpoint_stage_seconds, endpoint="lane_overlay")
+        ...decode...
+        timer.mark("decode")
+
+    Each mark records the time since the previous mark (or start/reset).
+    """
+
+    __slots__ = ("family", "labels", "_hists", "_last", "frame")
+
+    def __init__(self, family: HistogramFamily, **labels):
+        self.family = family
+        self.labels = labels
+        self._hists = {}
+        self._last = time.perf_counter()
+        self.frame = None   # {stage: seconds} för trace, annars None
+
+    def reset(self):
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        hist = self._hists.get(stage)
+        if hist is None:
+            hist = self._hists[stage] = self.family.labels(stage=stage, **self.labels)
+        hist.observe(elapsed)
+        if self.frame is not None:
+            self.frame[stage] = elapsed
+        return elapsed
+
+
+class FrameTracer:
+    """Writes sampled per-frame stage timings as JSON lines, for profiling one slow video."""
+
+    def __init__(self, path: str, sample_rate: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._file = open(path, "w") if sample_rate > 0 else None
+
+    def start_frame(self, timer: StageTimer):
+        timer.frame = {} if self._file and random.random() < self.sample_rate else None
+
+    def end_frame(self, timer: StageTimer, frame_idx: int, **extra):
+        if timer.frame is None:
+            return
+        record = {"frame": frame_idx, **{f"{k}_ms": round(v * 1000, 3) for k, v in timer.frame.items()}, **extra}
+        self._file.write(json.dumps(record) + "\n")
+        timer.frame = None
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
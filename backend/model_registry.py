@@ -0,0 +1,233 @@
+# model_registry.py
+#
+# Versioned ONNX models with atomic promotion and canary routing.
+# Each request picks a ModelVersion once and keeps the reference for its
+# whole lifetime, so swapping the active version never breaks in-flight work.
+
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from metrics import metrics
+from thread_budget import thread_budget
+
+MODEL_DIR = os.path.abspath(os.getenv("MODEL_DIR", "../assets/models"))
+
+# Standardmodeller som laddas vid uppstart: name -> (version, filename)
+DEFAULT_MODELS = {
+    "lane": (os.getenv("LANE_MODEL_VERSION", "v1"), os.getenv("LANE_MODEL_FILE", "lane_net.onnx")),
+    "depth": (os.getenv("DEPTH_MODEL_VERSION", "v1"), os.getenv("DEPTH_MODEL_FILE", "monodepth2_kitti.onnx")),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+model_inference_seconds = metrics.histogram(
+    "safedrive_model_inference_seconds",
+    "ONNX session.run latency per model version.",
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class ModelNotLoaded(LookupError):
+    pass
+
+
+def session_options(threads: int = None):
+    """ORT options sized to `threads` intra-op threads; None = ORT's defaults (one thread per core)."""
+    import onnxruntime as ort
+
+    if threads is None:
+        return None
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = threads
+    opts.inter_op_num_threads = 1
+    # Spinnande trådar bränner CPU som andra jobb behöver
+    opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return opts
+
+
+class ModelVersion:
+    def __init__(self, name: str, version: str, path: str, session: "ort.InferenceSession",
+                 threads: int = None):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.session = session
+        # Fast vid laddning. Samtidiga run() delar sessionens intra-op-pool, så
+        # alla jobb i processen får tillsammans högst så här många ORT-trådar
+        self.threads = threads
+        self.loaded_at = datetime.utcnow()
+        self.latency = model_inference_seconds.labels(model=name, version=version)
+
+    def run(self, inputs: dict, output_names=None):
+        start = time.perf_counter()
+        try:
+            return self.session.run(output_names, inputs)
+        finally:
+            self.latency.observe(time.perf_counter() - start)
+
+
+# Vilken version som serverar: byts ut som en helhet, aldrig fält för fält
+_Routing = namedtuple("_Routing", "active candidate candidate_percent")
+
+
+class _ModelSlot:
+    def __init__(self):
+        self.versions = {}        # version -> ModelVersion
+        # Skrivs bara under registrets lås; läsare tar en referens till tupeln
+        # och får då alltid en hel vy (aldrig ny active med gammal canary)
+        self.routing = _Routing(None, None, 0.0)
+
+    @property
+    def active(self):
+        return self.routing.active
+
+    @property
+    def candidate(self):
+        return self.routing.candidate
+
+
+class ModelRegistry:
+    def __init__(self, model_dir: str = MODEL_DIR, providers=None):
+        self.model_dir = model_dir
+        self.providers = providers or ["CPUExecutionProvider"]
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def resolve_path(self, path: str) -> str:
+        full = os.path.abspath(os.path.join(self.model_dir, path))
+        if os.path.commonpath([full, self.model_dir]) != self.model_dir:
+            raise ValueError("Model path must be inside MODEL_DIR")
+        if not os.path.isfile(full):
+            raise FileNotFoundError(full)
+        return full
+
+    def load(self, name: str, version: str, path: str, activate: bool = False) -> ModelVersion:
+        """Load a model version. The (slow) session creation happens outside the lock."""
+        import onnxruntime as ort   # här och inte överst: API-workers mot inference_server.py laddar det aldrig
+
+        full = self.resolve_path(path)
+        threads = thread_budget.session_threads()
+        session = ort.InferenceSession(full, sess_options=session_options(threads), providers=self.providers)
+        mv = ModelVersion(name, version, full, session, threads=threads)
+        with self._lock:
+            slot = self._slots.setdefault(name, _ModelSlot())
+            old = slot.versions.get(version)
+            if old is not None and old in (slot.active, slot.candidate):
+                raise ValueError(f"Version {version!r} of {name!r} is in use, unload it first")
+            model_inference_seconds.remove(model=name, version=version)
+            mv.latency = model_inference_seconds.labels(model=name, version=version)
+            slot.versions[version] = mv
+            if activate or slot.active is None:
+                slot.routing = slot.routing._replace(active=mv)
+        return mv
+
+    def promote(self, name: str, version: str):
+        with self._lock:
+            slot = self._get_slot(name)
+            mv = self._get_version(slot, name, version)
+            if slot.candidate is mv:
+                slot.routing = _Routing(mv, None, 0.0)
+            else:
+                slot.routing = slot.routing._replace(active=mv)
+
+    def set_candidate(self, name: str, version: str = None, percent: float = 0.0):
+        """Route `percent` (0-100) of requests to `version`. version=None clears the canary."""
+        if not 0.0 <= percent <= 100.0:
+            raise ValueError("percent must be between 0 and 100")
+        with self._lock:
+            slot = self._get_slot(name)
+            if version is None:
+                slot.routing = slot.routing._replace(candidate=None, candidate_percent=0.0)
+                return
+            slot.routing = slot.routing._replace(candidate=self._get_version(slot, name, version),
+                                                 candidate_percent=percent)
+
+    def unload(self, name: str, version: str):
+        # Pågående requests håller egna referenser, så sessionen lever tills de är klara.
+        with self._lock:
+            slot = self._get_slot(name)
+            mv = self._get_version(slot, name, version)
+            if mv is slot.active:
+                raise ValueError("Cannot unload the active version")
+            if mv is slot.candidate:
+                slot.routing = slot.routing._replace(candidate=None, candidate_percent=0.0)
+            del slot.versions[version]
+        model_inference_seconds.remove(model=name, version=version)
+
+    def acquire(self, name: str) -> ModelVersion:
+        """Pick the version to serve one request (or one whole video) with."""
+        slot = self._slots.get(name)
+        if slot is None:
+            raise ModelNotLoaded(name)
+        # En läsning av tupeln: promote/set_candidate byter hela, så vyn är alltid konsistent
+        active, candidate, percent = slot.routing
+        if active is None:
+            raise ModelNotLoaded(name)
+        if candidate is not None and random.random() * 100 < percent:
+            return candidate
+        return active
+
+    def routing(self, name: str) -> dict:
+        """Versions acquire() picks between, for clients that choose locally (inference_ipc.RemoteRegistry)."""
+        active, candidate, percent = self._get_slot(name).routing
+        if active is None:
+            raise ModelNotLoaded(name)
+        return {"active": active.version, "candidate": candidate.version if candidate else None,
+                "candidate_percent": percent}
+
+    def get(self, name: str, version: str) -> ModelVersion:
+        """A specific loaded version (inference_server.py runs the version the client acquired)."""
+        return self._get_version(self._get_slot(name), name, version)
+
+    def active_version(self, name: str) -> str:
+        slot = self._slots.get(name)
+        active = slot.routing.active if slot is not None else None
+        if active is None:
+            raise ModelNotLoaded(name)
+        return active.version
+
+    def stats(self) -> dict:
+        with self._lock:
+            slots = {name: (*slot.routing, list(slot.versions.values()))
+                     for name, slot in self._slots.items()}
+        out = {}
+        for name, (active, candidate, percent, versions) in slots.items():
+            out[name] = {
+                "active": active.version if active else None,
+                "candidate": candidate.version if candidate else None,
+                "candidate_percent": percent,
+                "versions": {
+                    mv.version: {
+                        "path": os.path.relpath(mv.path, self.model_dir),
+                        "loaded_at": mv.loaded_at.isoformat(),
+                        "session_threads": mv.threads,
+                        "latency_ms": mv.latency.snapshot(scale=1000),
+                    }
+                    for mv in versions
+                },
+            }
+        return out
+
+    def _get_slot(self, name: str) -> _ModelSlot:
+        slot = self._slots.get(name)
+        if slot is None:
+            raise ModelNotLoaded(name)
+        return slot
+
+    def _get_version(self, slot: _ModelSlot, name: str, version: str) -> ModelVersion:
+        mv = slot.versions.get(version)
+        if mv is None:
+            raise ModelNotLoaded(f"{name}:{version}")
+        return mv
+
+
+model_registry = ModelRegistry()
+
+
+def load_default_models(registry: ModelRegistry = model_registry):
+    for name, (version, filename) in DEFAULT_MODELS.items():
+        registry.load(name, version, filename, activate=True)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Float, Index
 from sqlalchemy.orm import relationship
 from db import Base
 
@@ -17,6 +17,7 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     avatar_url   = Column(String(255), nullable=True)
     current_car_id = Column(Integer, ForeignKey("cars.id"), nullable=True)
+    sync_version = Column(Integer, nullable=False, default=0, server_default="0")  # se sync.py
 
     current_car = relationship("Car", foreign_keys=[current_car_id], back_populates="users_who_selected_this_car")
     cars = relationship("Car", foreign_keys="Car.user_id", back_populates="creator", cascade="all, delete-orphan")
@@ -37,10 +38,17 @@ class Car(Base):
     model    = Column(String(50), nullable=True)
     color    = Column(String(50), nullable=True)
     year     = Column(Integer, nullable=True)
+    updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     creator    = relationship("User", foreign_keys=[user_id], back_populates="cars")
     users_who_selected_this_car = relationship("User", foreign_keys="User.current_car_id", back_populates="current_car")
 
+    __table_args__ = (
+        Index("ix_cars_user", "user_id"),
+        Index("ix_cars_user_sync", "user_id", "sync_version"),
+    )
+
 class Achievement(Base):
     __tablename__ = "achievements"
 
@@ -82,6 +90,10 @@ class QuizOption(Base):
 
     question    = relationship("QuizQuestion", back_populates="options")
 
+    __table_args__ = (
+        Index("ix_quiz_options_question", "question_id"),
+    )
+
 class UserQuizResult(Base):
     __tablename__ = "user_quiz_results"
 
@@ -94,6 +106,10 @@ class UserQuizResult(Base):
 
     user = relationship("User", back_populates="quiz_results")
 
+    __table_args__ = (
+        Index("ix_user_quiz_results_user_taken", "user_id", "taken_at"),
+    )
+
 # ---------------- SafeDrive Additions ----------------
 
 class DrivingSession(Base):
@@ -106,11 +122,19 @@ class DrivingSession(Base):
     end_time     = Column(DateTime, nullable=True)
     total_points = Column(Integer, default=0)
     duration    = Column(Float, nullable=False, default=0.0)
+    updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     user   = relationship("User", back_populates="driving_sessions")
     events = relationship("PointEvent", back_populates="session", cascade="all, delete-orphan")
     feedbacks = relationship("FeedbackReport", back_populates="session", cascade="all, delete-orphan")
 
+    # keyset-paginering: WHERE user_id = ? ORDER BY start_time DESC, id DESC
+    __table_args__ = (
+        Index("ix_driving_sessions_user_start", "user_id", "start_time", "id"),
+        Index("ix_driving_sessions_user_sync", "user_id", "sync_version"),
+    )
+
 class PointEvent(Base):
     __tablename__ = "point_events"
 
@@ -122,6 +146,10 @@ class PointEvent(Base):
 
     session = relationship("DrivingSession", back_populates="events")
 
+    __table_args__ = (
+        Index("ix_point_events_session", "session_id"),
+    )
+
 class Reward(Base):
     __tablename__ = "rewards"
 
@@ -145,10 +173,18 @@ class UserReward(Base):
     used        = Column(Boolean, default=False)           # <-- TRUE/FALSE om använd
     redeemed_at = Column(DateTime, nullable=True)          # <-- När rewarden användes
     expires_at  = Column(DateTime, nullable=True)
+    updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     user   = relationship("User", back_populates="rewards")
     reward = relationship("Reward", back_populates="user_rewards")
 
+    __table_args__ = (
+        Index("ix_user_rewards_user_claimed", "user_id", "claimed_at", "id"),
+        Index("ix_user_rewards_user_sync", "user_id", "sync_version"),
+        Index("ix_user_rewards_expires", "expires_at"),
+    )
+
 class FeedbackReport(Base):
     __tablename__ = "feedback_reports"
 
@@ -159,6 +195,10 @@ class FeedbackReport(Base):
 
     session = relationship("DrivingSession", back_populates="feedbacks")
 
+    __table_args__ = (
+        Index("ix_feedback_reports_session", "session_id"),
+    )
+
 
 class PhotoUpload(Base):
     __tablename__ = "photo_uploads"
@@ -167,10 +207,17 @@ class PhotoUpload(Base):
     user_id    = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     file_path  = Column(String(255), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relation till User
     user = relationship("User", back_populates="photo_uploads")
 
+    __table_args__ = (
+        Index("ix_photo_uploads_user_created", "user_id", "created_at", "id"),
+        Index("ix_photo_uploads_user_sync", "user_id", "sync_version"),
+    )
+
 class PasswordResetCode(Base):
     __tablename__ = "password_reset_codes"
     id          = Column(Integer, primary_key=True, index=True)
@@ -179,4 +226,56 @@ class PasswordResetCode(Base):
     expires_at  = Column(DateTime, nullable=False)
     used        = Column(Boolean, default=False)
 
-    user = relationship("User", back_populates="password_reset_codes")
\ No newline at end of file
+    user = relationship("User", back_populates="password_reset_codes")
+
+    # reset_password: WHERE user_id = ? AND code = ? AND expires_at > now
+    __table_args__ = (
+        Index("ix_password_reset_codes_user_code", "user_id", "code", "expires_at", mysql_length={"code": 32}),
+        Index("ix_password_reset_codes_expires", "expires_at"),   # rensningsjobbet
+    )
+
+class PointsLedgerEntry(Base):
+    """Append-only record of every change to users.points (old rows are folded by compaction)."""
+    __tablename__ = "points_ledger"
+
+    id         = Column(Integer, primary_key=True, index=True)
+    user_id    = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    delta      = Column(Integer, nullable=False)
+    reason     = Column(String(30), nullable=False)   # 'quiz', 'reward_claim', 'manual', 'compacted'
+    ref_id     = Column(Integer, nullable=True)       # t.ex. user_quiz_results.id / user_rewards.id
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_points_ledger_user_created", "user_id", "created_at"),
+    )
+
+class CacheVersion(Base):
+    """Version counters for process-local caches. Bumped on every change so other workers can revalidate cheaply."""
+    __tablename__ = "cache_versions"
+
+    name       = Column(String(50), primary_key=True)   # t.ex. 'quiz', 'rewards'
+    version    = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SyncTombstone(Base):
+    """A deleted synced row, so delta sync can tell clients to drop it."""
+    __tablename__ = "sync_tombstones"
+
+    id           = Column(Integer, primary_key=True, index=True)
+    user_id      = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    entity       = Column(String(20), nullable=False)   # 'cars', 'sessions', 'photos', 'user_rewards'
+    entity_id    = Column(Integer, nullable=False)
+    sync_version = Column(Integer, nullable=False)
+    deleted_at   = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_sync_tombstones_user_sync", "user_id", "sync_version"),
+    )
+
+class SchedulerLease(Base):
+    """Which process runs a maintenance job right now (see maintenance.py)."""
+    __tablename__ = "scheduler_leases"
+
+    name       = Column(String(50), primary_key=True)
+    owner      = Column(String(100), nullable=False)   # host:pid
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,82 @@
+# pagination.py
+#
+# Keyset (cursor) pagination for per-user history lists. Pages are ordered by
+# (timestamp DESC, id DESC) and the cursor is the last row's (timestamp, id),
+# so every page is an index range scan on (user_id, timestamp, id) no matter
+# how deep into the history it is. Rows without a timestamp come last (MySQL
+# and SQLite sort NULL lowest) and are paged by id alone.
+#
+# A request without limit or cursor (the app before pagination) gets the
+# whole list in the endpoint's old order, see paginate(unpaged_order=...).
+
+import base64
+import json
+import os
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+MAX_PAGE_LIMIT = 200
+# 0 = ingen gräns när klienten inte skickar limit (äldre appversioner förväntar sig hela listan)
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "0"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    raw = json.dumps([ts.isoformat() if ts else None, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return (datetime.fromisoformat(ts) if ts else None), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(stmt, ts_col, id_col, limit: int = None, cursor: str = None):
+    """Add keyset ordering, the cursor filter and limit+1 (to detect a next page) to `stmt`."""
+    stmt = stmt.order_by(ts_col.desc(), id_col.desc())
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        if ts is None:
+            # Bland raderna utan tidsstämpel: bara id avgör
+            stmt = stmt.where(ts_col.is_(None), id_col < row_id)
+        else:
+            # Utskrivet som OR i stället för radkonstruktor: MySQL gör range scan på indexet då.
+            # Raderna utan tidsstämpel hämtar paginate() separat.
+            stmt = stmt.where(or_(ts_col < ts, and_(ts_col == ts, id_col < row_id)))
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+
+async def paginate(db: AsyncSession, stmt, ts_col, id_col, limit: int = None, cursor: str = None,
+                   unpaged_order=None):
+    """
+    Apply keyset ordering/filtering to `stmt` (already filtered on user).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    `unpaged_order` (ORDER BY clauses) keeps an endpoint's pre-pagination
+    order for requests without limit or cursor; None = newest first.
+    """
+    limit = limit or LIST_DEFAULT_LIMIT or None
+    if not limit and not cursor and unpaged_order is not None:
+        return (await db.execute(stmt.order_by(*unpaged_order))).scalars().all(), None
+    rows = (await db.execute(keyset_query(stmt, ts_col, id_col, limit, cursor))).scalars().all()
+    if cursor and decode_cursor(cursor)[0] is not None and (not limit or len(rows) <= limit):
+        # Efter de daterade raderna kommer de utan tidsstämpel. En egen fråga,
+        # så att cursorfrågan ovan förblir en range scan på indexet.
+        rest = stmt.where(ts_col.is_(None)).order_by(id_col.desc())
+        if limit:
+            rest = rest.limit(limit + 1 - len(rows))
+        rows = list(rows) + list((await db.execute(rest)).scalars().all())
+    if not limit or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, ts_col.key), getattr(last, id_col.key))
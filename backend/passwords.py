@@ -0,0 +1,165 @@
+# passwords.py
+#
+# bcrypt hashing/verification in a dedicated process pool. A bcrypt call burns
+# ~250 ms of CPU; run inline or in the shared threadpool, a burst of logins
+# starves every other endpoint. Here the pool has its own bounded queue (full
+# queue -> PasswordServiceBusy -> 503), its own latency histogram, and a cost
+# calibrated at startup to PASSWORD_HASH_TARGET_MS on this hardware.
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from metrics import metrics
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Antal anrop som får vänta utöver de som körs; fler ger 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+# Sätt för att hoppa över kalibreringen och använda en fast kostnad
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "0")) or None
+PASSWORD_MIN_ROUNDS = int(os.getenv("PASSWORD_MIN_ROUNDS", "10"))
+PASSWORD_MAX_ROUNDS = 15
+DEFAULT_ROUNDS = 12   # passlib:s standard, vad befintliga hashar använder
+
+password_hash_seconds = metrics.histogram(
+    "safedrive_password_hash_seconds",
+    "bcrypt latency including queue wait, per operation.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+class PasswordServiceBusy(RuntimeError):
+    pass
+
+
+# ─── Körs i poolens processer (måste vara toppnivåfunktioner) ─────────
+
+def _encode(password: str) -> bytes:
+    # bcrypt använder bara de första 72 byten (passlib kortade av på samma sätt)
+    return password.encode("utf-8")[:72]
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode("ascii")
+
+
+def _verify(password: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(_encode(password), hashed.encode("ascii"))
+    except ValueError:
+        return False   # trasig eller okänd hash
+
+
+def _time_hash(rounds: int) -> float:
+    t0 = time.perf_counter()
+    _hash("calibration-password", rounds)
+    return time.perf_counter() - t0
+
+
+def hash_cost(hashed: str):
+    """Cost factor of a $2a$/$2b$/$2y$ hash, or None if it is not bcrypt."""
+    parts = hashed.split("$") if hashed else []
+    if len(parts) < 4 or parts[1] not in ("2a", "2b", "2y"):
+        return None
+    try:
+        return int(parts[2])
+    except ValueError:
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+                 rounds: int = PASSWORD_BCRYPT_ROUNDS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds or DEFAULT_ROUNDS
+        self.calibrated = rounds is not None
+        self._pool = None
+        self._pending = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._pool is None:
+            # spawn: att forka en process med onnxruntime-/uvicorn-trådar är inte säkert
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _submit(self, op: str, fn, *args):
+        # _pending ändras bara från event loopen, så ingen lås behövs
+        if self._pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordServiceBusy(op)
+        self.start()
+        self._pending += 1
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self._pending -= 1
+            password_hash_seconds.labels(op=op).observe(time.perf_counter() - t0)
+
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash", _hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._submit("verify", _verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True for bcrypt hashes with a lower cost than the current one (never downgrades)."""
+        cost = hash_cost(hashed)
+        return cost is not None and cost < self.rounds
+
+    async def calibrate(self, target_ms: float = PASSWORD_HASH_TARGET_MS) -> int:
+        """
+        Pick the highest cost whose hash time stays within target_ms on this
+        machine. Each extra round doubles the time, so one measurement at the
+        minimum cost is enough. No-op when PASSWORD_BCRYPT_ROUNDS is set.
+        """
+        if self.calibrated:
+            return self.rounds
+        self.start()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._pool, _time_hash, 4)   # starta processen innan mätningen
+        seconds = min([await loop.run_in_executor(self._pool, _time_hash, PASSWORD_MIN_ROUNDS)
+                       for _ in range(3)])
+        rounds = PASSWORD_MIN_ROUNDS
+        while rounds < PASSWORD_MAX_ROUNDS and seconds * 2 * 1000 <= target_ms:
+            rounds += 1
+            seconds *= 2
+        self.rounds = rounds
+        self.calibrated = True
+        return rounds
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "pending": self._pending,
+            "rejected": self.rejected,
+        }
+
+
+password_hasher = PasswordHasher()
+
+
+def _collect_password_metrics():
+    st = password_hasher.stats()
+    return [
+        ("safedrive_password_hash_rounds", "gauge", "bcrypt cost used for new hashes.", [({}, st["rounds"])]),
+        ("safedrive_password_hash_pending", "gauge", "Hash/verify calls running or queued.", [({}, st["pending"])]),
+        ("safedrive_password_hash_rejected_total", "counter", "Calls rejected because the queue was full.",
+         [({}, st["rejected"])]),
+    ]
+
+
+metrics.register_collector(_collect_password_metrics)
@@ -0,0 +1,106 @@
+# points.py
+#
+# All changes to users.points go through apply_points(): one conditional
+# UPDATE (no read-modify-write in Python, so concurrent requests cannot lose
+# updates) plus an append-only ledger row in the same transaction.
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User, PointsLedgerEntry
+
+# Ledger-rader äldre än så här slås ihop till en rad per användare (jobb i maintenance.py)
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "90"))
+LEDGER_COMPACTION_INTERVAL_HOURS = float(os.getenv("LEDGER_COMPACTION_INTERVAL_HOURS", "24"))
+LEDGER_COMPACTION_BATCH = int(os.getenv("LEDGER_COMPACTION_BATCH", "500"))
+
+
+class UserNotFound(LookupError):
+    pass
+
+
+class InsufficientPoints(ValueError):
+    pass
+
+
+async def apply_points(db: AsyncSession, user_id: int, delta: int, reason: str,
+                       ref_id: int = None) -> PointsLedgerEntry:
+    """
+    Atomically add `delta` (may be negative) to the user's balance and record it
+    in the ledger. Debits only succeed if the balance covers them. The caller
+    commits, so the balance change is atomic with the caller's other writes.
+    """
+    balance = func.coalesce(User.points, 0)
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(points=balance + delta)
+        .execution_options(synchronize_session=False)
+    )
+    if delta < 0:
+        stmt = stmt.where(balance >= -delta)
+    result = await db.execute(stmt)
+    if result.rowcount == 0:
+        # Bara felvägen kostar en extra läsning
+        exists = await db.scalar(select(User.id).where(User.id == user_id))
+        if exists is None:
+            raise UserNotFound(user_id)
+        raise InsufficientPoints(user_id)
+
+    entry = PointsLedgerEntry(user_id=user_id, delta=delta, reason=reason, ref_id=ref_id)
+    db.add(entry)
+    return entry
+
+
+async def get_balance(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(select(func.coalesce(User.points, 0)).where(User.id == user_id))
+
+
+async def compact_ledger(db: AsyncSession, older_than: timedelta = timedelta(days=LEDGER_RETENTION_DAYS),
+                         batch_users: int = LEDGER_COMPACTION_BATCH, deadline: float = None) -> int:
+    """
+    Fold each user's ledger rows older than the cutoff into a single 'compacted'
+    row with the same total. Per-user sums are preserved exactly. Returns the
+    number of rows removed. With a `deadline` (time.monotonic()) it stops
+    between users once that passes; the next run continues where it left off.
+    """
+    cutoff = datetime.utcnow() - older_than
+    removed = 0
+    last_user_id = 0
+    while True:
+        user_ids = (await db.execute(
+            select(PointsLedgerEntry.user_id)
+            .where(PointsLedgerEntry.created_at < cutoff, PointsLedgerEntry.user_id > last_user_id)
+            .group_by(PointsLedgerEntry.user_id)
+            .having(func.count() > 1)
+            .order_by(PointsLedgerEntry.user_id)
+            .limit(batch_users)
+        )).scalars().all()
+        if not user_ids:
+            return removed
+        for user_id in user_ids:
+            if deadline is not None and time.monotonic() >= deadline:
+                return removed
+            # Lås användarraden så att två workers inte komprimerar samma rader samtidigt
+            await db.execute(select(User.id).where(User.id == user_id).with_for_update())
+            total, count, max_id = (await db.execute(
+                select(func.sum(PointsLedgerEntry.delta), func.count(), func.max(PointsLedgerEntry.id))
+                .where(PointsLedgerEntry.user_id == user_id, PointsLedgerEntry.created_at < cutoff)
+            )).one()
+            if count > 1:
+                await db.execute(
+                    delete(PointsLedgerEntry)
+                    .where(PointsLedgerEntry.user_id == user_id,
+                           PointsLedgerEntry.created_at < cutoff,
+                           PointsLedgerEntry.id <= max_id)
+                    .execution_options(synchronize_session=False)
+                )
+                db.add(PointsLedgerEntry(user_id=user_id, delta=total, reason="compacted", created_at=cutoff))
+                removed += count - 1
+            await db.commit()
+        last_user_id = user_ids[-1]
+
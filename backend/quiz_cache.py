@@ -0,0 +1,82 @@
+# quiz_cache.py
+#
+# Process-wide quiz caches, both tied to the 'quiz' cache version:
+#  - the answer key for grading (question_id -> ids of the correct options),
+#  - the serialized quiz catalog for GET /docs/quiz, with an ETag.
+# Built at startup and revalidated at most every QUIZ_CACHE_REVALIDATE_SECONDS,
+# so a typical submission or catalog request needs no reads at all.
+
+import hashlib
+import os
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from cache_versions import VersionedCache, bump_version
+from models import QuizQuestion, QuizOption
+from schemas import QuizQuestionOut
+
+QUIZ_CACHE_NAME = "quiz"
+QUIZ_CACHE_REVALIDATE_SECONDS = float(os.getenv("QUIZ_CACHE_REVALIDATE_SECONDS", "30"))
+
+_catalog_adapter = TypeAdapter(List[QuizQuestionOut])
+
+
+class QuizAnswerKey(VersionedCache):
+    name = QUIZ_CACHE_NAME
+
+    async def _load(self, db: AsyncSession, version: int) -> dict:
+        # En query: alla alternativ vars text matchar frågans rätta svar (det kan finnas flera)
+        rows = await db.execute(
+            select(QuizOption.question_id, QuizOption.id)
+            .join(QuizQuestion, QuizQuestion.id == QuizOption.question_id)
+            .where(QuizOption.text == QuizQuestion.correct)
+        )
+        key = {}
+        for question_id, option_id in rows:
+            key.setdefault(question_id, set()).add(option_id)
+        return {question_id: frozenset(ids) for question_id, ids in key.items()}
+
+
+class CatalogEntry:
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes, etag: str):
+        self.body = body
+        self.etag = etag
+
+
+class QuizCatalog(VersionedCache):
+    name = QUIZ_CACHE_NAME
+
+    async def _load(self, db: AsyncSession, version: int) -> CatalogEntry:
+        # Alternativen laddas i samma omgång (selectinload), inte en query per fråga
+        questions = (await db.execute(
+            select(QuizQuestion).options(selectinload(QuizQuestion.options)).order_by(QuizQuestion.id)
+        )).scalars().all()
+        body = _catalog_adapter.dump_json(_catalog_adapter.validate_python(questions, from_attributes=True))
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        return CatalogEntry(body, f'"quiz-{version}-{digest}"')
+
+
+quiz_answer_key = QuizAnswerKey(QUIZ_CACHE_REVALIDATE_SECONDS)
+quiz_catalog = QuizCatalog(QUIZ_CACHE_REVALIDATE_SECONDS)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+async def invalidate_quiz(db: AsyncSession):
+    """Call after changing questions or options, instead of committing: the version bump commits with them."""
+    await bump_version(db, QUIZ_CACHE_NAME)
+    await db.commit()
+    # Först efter commit: en ombyggnad före den skulle läsa gamla data under den gamla versionen
+    quiz_answer_key.invalidate()
+    quiz_catalog.invalidate()
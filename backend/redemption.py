@@ -0,0 +1,152 @@
+# redemption.py
+#
+# Signed, expiring redemption tokens for reward QR codes. The token carries
+# the user reward id, user id, reward id and expiry, so the redeem page renders
+# from the token plus the cached reward catalog without reading the DB. Only
+# the final redeem is a write: one conditional UPDATE ... WHERE used = false.
+
+import html
+import os
+from datetime import datetime, timedelta
+from string import Template
+
+from jose import jwt, JWTError
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth import SECRET_KEY, ALGORITHM
+from models import UserReward
+from sync import bump_sync_version
+
+# Egen nyckel om satt, så att inloggningstoken och QR-token inte kan förväxlas
+REDEEM_SECRET_KEY = os.getenv("REDEEM_SECRET_KEY", SECRET_KEY + ":redeem")
+# Giltighet för belöningar utan eget utgångsdatum
+REDEEM_TOKEN_TTL_DAYS = int(os.getenv("REDEEM_TOKEN_TTL_DAYS", "365"))
+
+
+def create_redeem_token(user_reward_id: int, user_id: int, reward_id: int,
+                        expires_at: datetime = None, claimed_at: datetime = None) -> str:
+    # Inget iat: samma belöning ger alltid samma token (stabila ETags/QR-koder)
+    exp = expires_at or (claimed_at or datetime.utcnow()) + timedelta(days=REDEEM_TOKEN_TTL_DAYS)
+    claims = {"typ": "redeem", "ur": user_reward_id, "uid": user_id, "rid": reward_id, "exp": exp}
+    return jwt.encode(claims, REDEEM_SECRET_KEY, algorithm=ALGORITHM)
+
+
+def attach_redeem_tokens(user_rewards):
+    """Set `redeem_token` on UserReward rows before they become UserRewardResponse (None once used)."""
+    for ur in user_rewards:
+        ur.redeem_token = None if ur.used else create_redeem_token(
+            ur.id, ur.user_id, ur.reward_id, ur.expires_at, ur.claimed_at)
+    return user_rewards
+
+
+def verify_redeem_token(token: str):
+    """Claims of a valid, unexpired redeem token, else None."""
+    try:
+        claims = jwt.decode(token, REDEEM_SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return claims if claims.get("typ") == "redeem" else None
+
+
+async def redeem(db: AsyncSession, user_reward_id: int, user_id: int = None) -> bool:
+    """
+    Mark the reward used if it is still unused and unexpired. True if this call
+    redeemed it, False if it was already used, expired or does not exist.
+    """
+    now = datetime.utcnow()
+    stmt = (
+        update(UserReward)
+        .where(UserReward.id == user_reward_id,
+               UserReward.used == False,  # noqa: E712
+               or_(UserReward.expires_at.is_(None), UserReward.expires_at > now))
+        .values(used=True, redeemed_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if user_id is not None:
+        stmt = stmt.where(UserReward.user_id == user_id)
+    if (await db.execute(stmt)).rowcount == 0:
+        await db.rollback()
+        return False
+    if user_id is None:
+        # gamla QR-länkar utan token
+        user_id = await db.scalar(select(UserReward.user_id).where(UserReward.id == user_reward_id))
+    # Bulk-UPDATE går förbi sync-hooken, så stämpla raden för delta sync här
+    version = await db.run_sync(bump_sync_version, user_id)
+    await db.execute(
+        update(UserReward).where(UserReward.id == user_reward_id).values(sync_version=version)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return True
+
+
+# ─── HTML ─────────────────────────────────────────────────────────────
+# Skalet byggs en gång vid import; per request fylls bara de escapade fälten i.
+
+_PAGE_STYLE = """
+    body { font-family: sans-serif; background: #f7f7f7; color: #222; font-size: 2.2rem; }
+    .container { max-width: 900px; margin: 80px auto; background: #fff; border-radius: 24px;
+                 padding: 64px 24px 48px 24px; box-shadow: 0 8px 32px #0003; text-align: center; }
+    h1 { color: #8DA46D; font-size: 3.2rem; margin-bottom: 2.5rem; }
+    p { margin-bottom: 2.2rem; font-size: 2rem; }
+    .btn { display: inline-block; padding: 32px 64px; margin: 32px 24px 0 0; border: none; border-radius: 16px;
+           font-size: 2.2rem; font-weight: bold; cursor: pointer; transition: background 0.2s, transform 0.1s;
+           box-shadow: 0 2px 8px #0002; }
+    .btn:active { transform: scale(0.97); }
+    .redeem { background: #8DA46D; color: #fff; }
+    .redeem:hover { background: #6d8a54; }
+    .cancel { background: #ccc; color: #222; }
+    .cancel:hover { background: #aaa; }
+    @media (max-width: 600px) {
+        .container { padding: 32px 4vw 24px 4vw; }
+        h1 { font-size: 2.2rem; }
+        .btn { font-size: 1.5rem; padding: 20px 10vw; }
+        p { font-size: 1.2rem; }
+    }
+"""
+
+
+def _shell(title: str, body: str) -> Template:
+    return Template(
+        "<html><head><title>" + title + "</title>"
+        '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
+        "<style>" + _PAGE_STYLE.replace("$", "$$") + "</style></head>"
+        '<body><div class="container">' + body + "</div></body></html>"
+    )
+
+
+_BACK_BUTTON = ('<button class="btn cancel" type="button" '
+                "onclick=\"window.location.href='safedriveapp://profile'\">$back</button>")
+
+REDEEM_PAGE = _shell("Redeem Reward", (
+    "<h1>$title</h1>"
+    "<p><b>Beskrivning:</b> $description</p>"
+    "<p><b>Plats:</b> $location</p>"
+    "<p><b>Giltig till:</b> $valid_until</p>"
+    '<form method="post" action="$action">'
+    '<button class="btn redeem" type="submit">🎉 Redeem Reward!</button>'
+    + _BACK_BUTTON.replace("$back", "Avbryt") +
+    "</form>"
+))
+
+REDEEMED_PAGE = _shell("Reward Redeemed", (
+    "<h1>Reward redeemed!</h1><p>Rewarden är nu använd.</p>"
+    + _BACK_BUTTON.replace("$back", "Tillbaka till appen")
+)).substitute()
+
+MESSAGE_PAGE = _shell("Reward", "<h1>$message</h1>" + _BACK_BUTTON.replace("$back", "Tillbaka till appen"))
+
+
+def render_redeem_page(reward, valid_until: datetime, action: str) -> str:
+    return REDEEM_PAGE.substitute(
+        title=html.escape(reward.title),
+        description=html.escape(reward.description or "Ingen beskrivning"),
+        location=html.escape(reward.location or "Valfri partner"),
+        valid_until=valid_until.strftime("%Y-%m-%d") if valid_until else "Okänt",
+        action=html.escape(action, quote=True),
+    )
+
+
+def render_message(message: str) -> str:
+    return MESSAGE_PAGE.substitute(message=html.escape(message))
@@ -1,45 +1,51 @@
-from sqlalchemy.orm import Session
-from models import User, Car, Achievement, UserAchievement, UserReward, QuizQuestion, QuizOption, UserQuizResult
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Car, Achievement, UserAchievement, UserReward, QuizQuestion, QuizOption, UserQuizResult, DrivingSession
 from datetime import datetime
 from models import User as UserModel
 from schemas import CarCreate, UserUpdate
-from passlib.context import CryptContext
 from typing import List
+from points import apply_points, UserNotFound
+from quiz_cache import quiz_answer_key
+from passwords import password_hasher
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-def create_user(db: Session, user_data):
+async def create_user(db: AsyncSession, user_data):
+    # bcrypt är CPU-tungt, kör det i lösenordspoolen
+    hashed = await password_hasher.hash(user_data.password)
     user = User(
         firstname=user_data.firstname,
         lastname=user_data.lastname,
         gender=user_data.gender,
         age=user_data.age,
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=hashed,
         points=0
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
-def get_user(db: Session, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(User, user_id)
 
-def update_user(db: Session, db_user: User, upd: UserUpdate) -> User:
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+async def update_user(db: AsyncSession, db_user: User, upd: UserUpdate) -> User:
     for field, value in upd.dict(exclude_unset=True).items():
         setattr(db_user, field, value)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_user_cars(db: Session, user_id: int):
-    return db.query(Car).filter(Car.user_id == user_id).all()
+async def get_user_cars(db: AsyncSession, user_id: int):
+    result = await db.execute(select(Car).where(Car.user_id == user_id))
+    return result.scalars().all()
 
-def create_car(db: Session, car: CarCreate):
+async def create_car(db: AsyncSession, car: CarCreate):
     db_car = Car(
         user_id = car.user_id,
         name    = car.name,
@@ -49,31 +55,88 @@ def create_car(db: Session, car: CarCreate):
         year    = car.year,
     )
     db.add(db_car)
-    db.commit()
-    db.refresh(db_car)
+    await db.commit()
+    await db.refresh(db_car)
     return db_car
 
-def grade_quiz(db: Session, user_id: int, answers: List[dict]) -> UserQuizResult:
+async def get_profile_summary(db: AsyncSession, user_id: int, recent_sessions: int = 5):
+    """
+    Everything the profile screen shows, in a fixed number of queries no matter
+    how much history the user has: user + cars (selectinload), active rewards
+    joined with their reward, one aggregate over sessions and the newest sessions.
+    Returns None if the user does not exist.
+    """
+    user = (await db.execute(
+        select(User).where(User.id == user_id).options(selectinload(User.cars))
+    )).scalars().first()
+    if user is None:
+        return None
+
+    now = datetime.utcnow()
+    active_rewards = (await db.execute(
+        select(UserReward)
+        .where(UserReward.user_id == user_id,
+               UserReward.used == False,  # noqa: E712
+               or_(UserReward.expires_at.is_(None), UserReward.expires_at > now))
+        .options(joinedload(UserReward.reward))
+        .order_by(UserReward.claimed_at.desc(), UserReward.id.desc())
+    )).scalars().all()
+
+    session_count, total_points, total_duration, last_session_at = (await db.execute(
+        select(func.count(DrivingSession.id),
+               func.coalesce(func.sum(DrivingSession.total_points), 0),
+               func.coalesce(func.sum(DrivingSession.duration), 0.0),
+               func.max(DrivingSession.start_time))
+        .where(DrivingSession.user_id == user_id)
+    )).one()
+
+    recent = []
+    if recent_sessions and session_count:
+        recent = (await db.execute(
+            select(DrivingSession)
+            .where(DrivingSession.user_id == user_id)
+            .order_by(DrivingSession.start_time.desc(), DrivingSession.id.desc())
+            .limit(recent_sessions)
+        )).scalars().all()
+
+    return {
+        "user": user,
+        "cars": user.cars,
+        "active_rewards": active_rewards,
+        "session_stats": {
+            "session_count": session_count,
+            "total_points": total_points,
+            "total_duration": total_duration,
+            "last_session_at": last_session_at,
+        },
+        "recent_sessions": recent,
+    }
+
+async def grade_quiz(db: AsyncSession, user_id: int, answers: List[dict]) -> UserQuizResult:
     """
     answers: list of dicts {'question_id': .., 'selected_option_id': ..}
+
+    Grades against the cached answer key (no per-answer queries) and writes the
+    result and the points change in one transaction. Raises UserNotFound or
+    IntegrityError if the user does not exist.
     """
-    # load questions in batch
-    q_ids = [a["question_id"] for a in answers]
-    questions = db.query(QuizQuestion).filter(QuizQuestion.id.in_(q_ids)).all()
-    # map question_id → correct text
-    correct_map = {q.id: q.correct for q in questions}
-
-    correct_count = 0
-    for a in answers:
-        # find the option text
-        opt = db.query(QuizOption).get(a["selected_option_id"])
-        if opt and correct_map.get(a["question_id"]) == opt.text:
-            correct_count += 1
+    correct_key = await quiz_answer_key.get(db)
+    correct_count = sum(
+        1 for a in answers if a["selected_option_id"] in correct_key.get(a["question_id"], ())
+    )
 
     total = len(answers)
     # e.g. 10 points per correct answer
     points_awarded = correct_count * 10
 
+    # update user points first (atomic UPDATE + ledger row), it also verifies the user
+    entry = None
+    if points_awarded:
+        entry = await apply_points(db, user_id, points_awarded, "quiz")
+    elif await db.scalar(select(User.id).where(User.id == user_id)) is None:
+        # Inga poäng = ingen UPDATE som hittar användaren; SQLite kontrollerar inte FK:n
+        raise UserNotFound(user_id)
+
     # save result
     result = UserQuizResult(
         user_id=user_id,
@@ -83,9 +146,8 @@ def grade_quiz(db: Session, user_id: int, answers: List[dict]) -> UserQuizResult
         points_awarded=points_awarded
     )
     db.add(result)
-    # also update user points
-    user = db.query(User).get(user_id)
-    user.points = (user.points or 0) + points_awarded
-    db.commit()
-    db.refresh(result)
-    return result
\ No newline at end of file
+    await db.flush()
+    if entry is not None:
+        entry.ref_id = result.id
+    await db.commit()
+    return result
@@ -0,0 +1,71 @@
+# reward_cache.py
+#
+# Process-wide reward catalog, tied to the 'rewards' cache version:
+#  - every reward by id (the redeem page, already-claimed rewards),
+#  - the active (unexpired) rewards by id, for the cost lookup in claim_reward,
+#  - GET /docs/rewards serialized once, with an ETag.
+# Expired rewards drop out of the active set at their expires_at without a DB
+# read: the entry is rebuilt in-process when the next expiry passes.
+
+import hashlib
+import os
+from datetime import datetime
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache_versions import VersionedCache, bump_version
+from models import Reward
+from schemas import RewardResponse
+
+REWARDS_CACHE_NAME = "rewards"
+REWARDS_CACHE_REVALIDATE_SECONDS = float(os.getenv("REWARDS_CACHE_REVALIDATE_SECONDS", "30"))
+
+_rewards_adapter = TypeAdapter(List[RewardResponse])
+
+
+class RewardCatalogEntry:
+    __slots__ = ("by_id", "active", "body", "etag", "next_expiry")
+
+    def __init__(self, by_id: dict, version: int, now: datetime):
+        self.by_id = by_id
+        self.active = {rid: r for rid, r in by_id.items() if r.expires_at is None or r.expires_at > now}
+        self.body = _rewards_adapter.dump_json(list(self.active.values()))
+        digest = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self.etag = f'"rewards-{version}-{digest}"'
+        upcoming = [r.expires_at for r in self.active.values() if r.expires_at is not None]
+        self.next_expiry = min(upcoming) if upcoming else None
+
+    def get(self, reward_id: int):
+        """Any reward, expired or not (for rendering already-claimed rewards)."""
+        return self.by_id.get(reward_id)
+
+
+class RewardCatalog(VersionedCache):
+    name = REWARDS_CACHE_NAME
+
+    async def _load(self, db: AsyncSession, version: int) -> RewardCatalogEntry:
+        rewards = (await db.execute(select(Reward).order_by(Reward.id))).scalars().all()
+        by_id = {r.id: RewardResponse.model_validate(r) for r in rewards}
+        return RewardCatalogEntry(by_id, version, datetime.utcnow())
+
+    async def get(self, db: AsyncSession) -> RewardCatalogEntry:
+        entry = await super().get(db)
+        now = datetime.utcnow()
+        if entry.next_expiry is not None and now >= entry.next_expiry:
+            # en belöning har gått ut sedan bygget: bygg om från minnet
+            entry = self.value = RewardCatalogEntry(entry.by_id, self.version, now)
+        return entry
+
+
+reward_catalog = RewardCatalog(REWARDS_CACHE_REVALIDATE_SECONDS)
+
+
+async def invalidate_rewards(db: AsyncSession):
+    """Call after changing rewards, instead of committing: the version bump commits with them."""
+    await bump_version(db, REWARDS_CACHE_NAME)
+    await db.commit()
+    # Först efter commit: en ombyggnad före den skulle läsa gamla data under den gamla versionen
+    reward_catalog.invalidate()
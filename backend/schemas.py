@@ -50,6 +50,7 @@ class CarResponse(CarBase):
     id: int
     user_id: int
     name: str
+    updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -121,8 +122,10 @@ class UserRewardResponse(BaseModel):
     expires_at: Optional[datetime] = None
     used: bool
     redeemed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
     reward: RewardResponse
-    
+    redeem_token: Optional[str] = None   # sätts av redemption.attach_redeem_tokens; None när använd
+
     class Config:
         from_attributes = True
 
@@ -141,10 +144,24 @@ class DrivingSessionResponse(BaseModel):
     end_time: Optional[datetime] = None
     total_points: int
     duration: Optional[float] = None  # Duration in seconds
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+class SessionStats(BaseModel):
+    session_count: int = 0
+    total_points: int = 0
+    total_duration: float = 0.0          # sekunder
+    last_session_at: Optional[datetime] = None
+
+class ProfileSummaryResponse(BaseModel):
+    user: UserResponse
+    cars: List[CarResponse]
+    active_rewards: List[UserRewardResponse]
+    session_stats: SessionStats
+    recent_sessions: List[DrivingSessionResponse]
+
 class PhotoUploadCreate(BaseModel):
     user_id: int  # Vi anger user_id som query-param, inte i kroppen
 
@@ -153,6 +170,29 @@ class PhotoUploadResponse(BaseModel):
     user_id: int
     file_path: str
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class SyncDeleted(BaseModel):
+    entity: str          # 'cars', 'sessions', 'photos' eller 'user_rewards'
+    id: int
+
+class SyncResponse(BaseModel):
+    cursor: int          # skicka som `since` nästa gång
+    full: bool           # True = ersätt lokala listor helt, annars applicera som delta
+    cars: List[CarResponse]
+    sessions: List[DrivingSessionResponse]
+    photos: List[PhotoUploadResponse]
+    user_rewards: List[UserRewardResponse]
+    deleted: List[SyncDeleted]
+
+class ModelLoadRequest(BaseModel):
+    version: str
+    path: str                 # relativ till MODEL_DIR
+    activate: bool = False
+
+class ModelCanaryRequest(BaseModel):
+    version: Optional[str] = None   # None = stäng av canary
+    percent: float = Field(0.0, ge=0.0, le=100.0)
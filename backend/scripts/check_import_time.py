@@ -0,0 +1,91 @@
+# scripts/check_import_time.py
+#
+# Import-time regression check for CRUD-only API workers. Imports main.py
+# with INFERENCE_MODE=off under `python -X importtime` in a fresh interpreter
+# and fails if any ML library gets imported or the total import time exceeds
+# the budget. Prints the slowest top-level imports either way.
+#
+#   cd backend
+#   python scripts/check_import_time.py
+#   python scripts/check_import_time.py --budget-ms 800 --mode inline   # inline mode, report only
+#
+# Exit code 1 = a forbidden module was imported or the budget was exceeded.
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Får inte importeras av en CRUD-only worker
+FORBIDDEN = ("cv2", "onnxruntime", "torch", "torchvision", "scipy", "PIL", "inference", "model_registry")
+
+# "import time:      self [us] |  cumulative | imported package"
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str):
+    """[(module, self_us, cumulative_us, depth)] in import order."""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def measure(mode: str, workdir: str) -> list:
+    env = dict(os.environ)
+    env.update({
+        "INFERENCE_MODE": mode,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'import.db')}",
+        "PYTHONPATH": BACKEND_DIR,
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    env.pop("ASYNC_DATABASE_URL", None)
+    env.pop("READ_DATABASE_URL", None)
+    os.makedirs(os.path.join(workdir, "static"), exist_ok=True)   # main.py monterar static/
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                          cwd=workdir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"import main failed:\n{proc.stderr[-3000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", default="off", choices=("off", "inline"))
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1000")))
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="safedrive-import-") as workdir:
+        rows = measure(args.mode, workdir)
+
+    top_level = [r for r in rows if r[3] == 0]
+    total_ms = sum(r[2] for r in top_level) / 1000
+    print(f"INFERENCE_MODE={args.mode}: {total_ms:.0f} ms for {len(rows)} modules\n")
+    print(f"{'cumulative ms':>14}  module")
+    for name, _, cumulative, _ in sorted(top_level, key=lambda r: -r[2])[:args.top]:
+        print(f"{cumulative / 1000:>14.1f}  {name}")
+
+    if args.mode != "off":
+        return
+    failures = []
+    forbidden = sorted({name for name, *_ in rows if name.split(".")[0] in FORBIDDEN})
+    if forbidden:
+        failures.append(f"ML modules imported by a CRUD-only worker: {', '.join(forbidden)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.0f} ms, budget {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"\nFAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# scripts/check_query_plans.py
+#
+# Query-plan regression check. Seeds a large dataset, runs EXPLAIN on every
+# hot repository/endpoint query and fails if any of them falls back to a full
+# table scan of the table it filters on.
+#
+#   cd backend
+#   python scripts/check_query_plans.py                     # temporary SQLite DB
+#   python scripts/check_query_plans.py --users 5000
+#   python scripts/check_query_plans.py --url mysql+mysqlconnector://.../scratch   # throwaway MySQL schema!
+#
+# Exit code 1 = at least one query does a full scan.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, func, text
+
+
+def build_checks(models, pagination):
+    """(name, table that must not be fully scanned, statement) for every hot query."""
+    (User, Car, DrivingSession, PointEvent, FeedbackReport, PhotoUpload, UserReward,
+     PasswordResetCode, UserQuizResult, QuizOption, PointsLedgerEntry) = models
+    now = datetime.utcnow()
+    cursor = pagination.encode_cursor(now - timedelta(days=30), 10 ** 6)
+    keyset = pagination.keyset_query
+    return [
+        ("get_user_by_email", "users",
+         select(User).where(User.email == "user42@example.com")),
+        ("get_user_cars", "cars",
+         select(Car).where(Car.user_id == 42)),
+        ("list_drive_records", "driving_sessions",
+         keyset(select(DrivingSession).where(DrivingSession.user_id == 42),
+                DrivingSession.start_time, DrivingSession.id, 50)),
+        ("list_drive_records (cursor)", "driving_sessions",
+         keyset(select(DrivingSession).where(DrivingSession.user_id == 42),
+                DrivingSession.start_time, DrivingSession.id, 50, cursor)),
+        ("list_photos_for_user", "photo_uploads",
+         keyset(select(PhotoUpload).where(PhotoUpload.user_id == 42),
+                PhotoUpload.created_at, PhotoUpload.id, 50, cursor)),
+        ("list_user_rewards", "user_rewards",
+         keyset(select(UserReward).where(UserReward.user_id == 42),
+                UserReward.claimed_at, UserReward.id, 50, cursor)),
+        ("session events (selectinload)", "point_events",
+         select(PointEvent).where(PointEvent.session_id.in_([1, 2, 3]))),
+        ("session feedbacks (selectinload)", "feedback_reports",
+         select(FeedbackReport).where(FeedbackReport.session_id.in_([1, 2, 3]))),
+        ("reset_password", "password_reset_codes",
+         select(PasswordResetCode).where(PasswordResetCode.user_id == 42,
+                                         PasswordResetCode.code == "123456",
+                                         PasswordResetCode.expires_at > now,
+                                         PasswordResetCode.used == False)),  # noqa: E712
+        ("user quiz results", "user_quiz_results",
+         select(UserQuizResult).where(UserQuizResult.user_id == 42).order_by(UserQuizResult.taken_at.desc())),
+        ("quiz options (selectinload)", "quiz_options",
+         select(QuizOption).where(QuizOption.question_id.in_([1, 2, 3]))),
+        ("compact_ledger per user", "points_ledger",
+         select(func.sum(PointsLedgerEntry.delta), func.count())
+         .where(PointsLedgerEntry.user_id == 42, PointsLedgerEntry.created_at < now)),
+    ]
+
+
+# ─── EXPLAIN ───────────────────────────────────────────────────────────
+
+_EXPLAIN = {"sqlite": "EXPLAIN QUERY PLAN "}
+
+
+def explain_rows(conn, stmt):
+    # Kompilerad till ren SQL och körd otypad: med satsen som ClauseElement
+    # ärvde EXPLAIN dess kolumntyper, och DateTime-processorerna kördes på planraderna
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    sql = _EXPLAIN.get(conn.dialect.name, "EXPLAIN ") + str(compiled)
+    return [dict(row._mapping) for row in conn.exec_driver_sql(sql)]
+
+
+def full_scans(dialect: str, plan, table: str) -> list:
+    """The plan lines that read all of `table` without an index."""
+    if dialect == "sqlite":
+        # "SCAN driving_sessions" = full scan; "SEARCH ... USING INDEX" / "SCAN ... USING COVERING INDEX" är ok
+        return [r["detail"] for r in plan
+                if r["detail"].startswith(f"SCAN {table}") and "USING" not in r["detail"]]
+    if dialect == "mysql":
+        return [f"type=ALL rows={r.get('rows')}" for r in plan
+                if r.get("table") == table and r.get("type") == "ALL"]
+    raise SystemExit(f"No plan checker for dialect {dialect!r}")
+
+
+def plan_text(dialect: str, plan) -> str:
+    if dialect == "sqlite":
+        return "; ".join(r["detail"] for r in plan)
+    return "; ".join(f"{r.get('table')}:{r.get('type')}/{r.get('key')}" for r in plan)
+
+
+# ─── Seed ──────────────────────────────────────────────────────────────
+
+def seed(conn, tables, users: int):
+    """Bulk insert a realistic-ish spread: many users, long histories for each."""
+    rnd = random.Random(1)
+    now = datetime.utcnow()
+
+    def ago(max_days):
+        return now - timedelta(minutes=rnd.randint(0, max_days * 24 * 60))
+
+    def insert(table, rows):
+        if rows:
+            conn.execute(tables[table].insert(), rows)
+
+    insert("users", [dict(id=u, firstname="F", lastname="L", gender="x", age=30, email=f"user{u}@example.com",
+                          hashed_password="!", points=0, created_at=ago(365)) for u in range(1, users + 1)])
+    insert("cars", [dict(user_id=u, name=f"car{u}") for u in range(1, users + 1)])
+    insert("rewards", [dict(id=r, title=f"reward{r}", cost_points=100) for r in range(1, 51)])
+    insert("quiz_questions", [dict(id=q, key=f"q{q}", question="?", correct="a") for q in range(1, 201)])
+    insert("quiz_options", [dict(question_id=q, text=t) for q in range(1, 201) for t in "abcd"])
+
+    session_id = 0
+    for u in range(1, users + 1):
+        sessions, events, feedbacks = [], [], []
+        for _ in range(20):
+            session_id += 1
+            sessions.append(dict(id=session_id, user_id=u, file_path="x.mp4", start_time=ago(365),
+                                 total_points=0, duration=60.0))
+            events += [dict(session_id=session_id, event_type="lane_keep", event_score=1) for _ in range(5)]
+            feedbacks.append(dict(session_id=session_id, summary="ok"))
+        insert("driving_sessions", sessions)
+        insert("point_events", events)
+        insert("feedback_reports", feedbacks)
+        insert("photo_uploads", [dict(user_id=u, file_path=f"static/{u}_{i}.jpg", created_at=ago(365))
+                                 for i in range(10)])
+        insert("user_rewards", [dict(user_id=u, reward_id=rnd.randint(1, 50), claimed_at=ago(365), used=False)
+                                for _ in range(5)])
+        insert("password_reset_codes", [dict(user_id=u, code=f"{rnd.randint(0, 999999):06d}",
+                                             expires_at=ago(365), used=True) for _ in range(3)])
+        insert("user_quiz_results", [dict(user_id=u, taken_at=ago(365), correct_count=5, total_questions=10,
+                                          points_awarded=50) for _ in range(5)])
+        insert("points_ledger", [dict(user_id=u, delta=10, reason="quiz", created_at=ago(365))
+                                 for _ in range(10)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="sync SQLAlchemy URL of a THROWAWAY database (default: temporary SQLite)")
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = args.url or f"sqlite:///{os.path.join(workdir, 'plans.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.pop("READ_DATABASE_URL", None)
+
+    # db.py läser DATABASE_URL vid import
+    from db import Base, engine, init_db
+    import pagination
+    from models import (User, Car, DrivingSession, PointEvent, FeedbackReport, PhotoUpload, UserReward,
+                        PasswordResetCode, UserQuizResult, QuizOption, PointsLedgerEntry)
+
+    dialect = engine.dialect.name
+    init_db()
+    with engine.begin() as conn:
+        print(f"Seeding {args.users} users on {dialect} ...")
+        seed(conn, Base.metadata.tables, args.users)
+        # planeraren behöver statistik för att välja index som i produktion
+        if dialect == "sqlite":
+            conn.execute(text("ANALYZE"))
+        elif dialect == "mysql":
+            for table in Base.metadata.tables:
+                conn.execute(text(f"ANALYZE TABLE {table}"))
+
+    checks = build_checks((User, Car, DrivingSession, PointEvent, FeedbackReport, PhotoUpload, UserReward,
+                           PasswordResetCode, UserQuizResult, QuizOption, PointsLedgerEntry), pagination)
+    failures = 0
+    with engine.connect() as conn:
+        for name, table, stmt in checks:
+            plan = explain_rows(conn, stmt)
+            scans = full_scans(dialect, plan, table)
+            failures += bool(scans)
+            print(f"{'❌' if scans else '✔️'} {name:<34} {plan_text(dialect, plan)}")
+    engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{failures} of {len(checks)} queries do a full table scan" if failures else "✔️ All queries use an index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
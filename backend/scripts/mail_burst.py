@@ -0,0 +1,76 @@
+# scripts/mail_burst.py
+#
+# Sends a burst of password-reset-sized mails through mailer.Mailer to a local
+# aiosmtpd server and reports delivery latency and how many SMTP connections
+# (= TLS handshakes against a real server) the burst needed.
+#
+#   cd backend
+#   python scripts/mail_burst.py --messages 200 --pool 2
+#
+# Exit code 1 if any message was not delivered.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiosmtpd.controller import Controller
+
+from mailer import Mailer, MailSettings, mail_delivery_seconds
+
+
+class CountingHandler:
+    def __init__(self):
+        self.messages = 0
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1   # en EHLO per anslutning
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return "250 OK"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--pool", type=int, default=2)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        mailer = Mailer(MailSettings(server="127.0.0.1", port=args.port, sender="noreply@example.com",
+                                     starttls=False), pool_size=args.pool, batch=args.batch)
+        mailer.start()
+        t0 = time.perf_counter()
+        for i in range(args.messages):
+            mailer.enqueue(f"user{i}@example.com", "SafeDrive - Återställningskod",
+                           f"Din återställningskod är: {i:06d}\n\nKoden är giltig i 10 minuter.")
+        await mailer.join()
+        elapsed = time.perf_counter() - t0
+        await mailer.stop()
+    finally:
+        controller.stop()
+
+    latency = mail_delivery_seconds.labels()
+    print(f"delivered={handler.messages}/{args.messages} in {elapsed:.2f}s "
+          f"({args.messages / elapsed:.0f} msg/s)")
+    print(f"smtp connections={handler.sessions} (mailer opened {mailer.connections})")
+    print(f"delivery latency p50<={latency.quantile(0.5) * 1000:.0f}ms p99<={latency.quantile(0.99) * 1000:.0f}ms")
+    ok = handler.messages == args.messages
+    print("✔️ All messages delivered" if ok else "❌ Messages lost")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -6,6 +6,7 @@ from pathlib import Path
 from sqlalchemy.exc import IntegrityError
 from db import SessionLocal, init_db
 from models import QuizQuestion, QuizOption
+from cache_versions import bump_version_sync
 
 def main():
     # ensure tables exist
@@ -58,6 +59,11 @@ def main():
             db.rollback()
             print(f"❌ Failed to commit {key!r}: {e}")
 
+    if added:
+        # få API-workers att ladda om quiz-cachen
+        bump_version_sync(db, "quiz")
+        db.commit()
+
     db.close()
     print(f"\nDone. {added} new questions added.")
 
@@ -0,0 +1,89 @@
+# scripts/stress_points.py
+#
+# Concurrency stress test for the points ledger. Runs many parallel credits and
+# debits against one user and checks that no update was lost:
+#   final balance == start balance + sum(successful deltas) == start + sum(ledger)
+#
+#   cd backend
+#   DATABASE_URL=sqlite:///./stress.db python scripts/stress_points.py --workers 50 --ops 20
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, func, delete
+
+from db import AsyncSessionLocal, init_db_async
+from models import User, PointsLedgerEntry
+from points import apply_points, get_balance, InsufficientPoints
+
+START_POINTS = 1000
+
+
+async def create_stress_user() -> int:
+    async with AsyncSessionLocal() as db:
+        user = User(firstname="Stress", lastname="Test", gender="x", age=30,
+                    email=f"stress-{random.getrandbits(32)}@example.com",
+                    hashed_password="!", points=START_POINTS)
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def worker(user_id: int, ops: int, applied: list, rejected: list):
+    for _ in range(ops):
+        delta = random.choice([10, 25, -30, -50, -120])
+        async with AsyncSessionLocal() as db:
+            for attempt in range(5):
+                try:
+                    await apply_points(db, user_id, delta, "stress")
+                    await db.commit()
+                    applied.append(delta)
+                    break
+                except InsufficientPoints:
+                    await db.rollback()
+                    rejected.append(delta)
+                    break
+                except Exception:
+                    # SQLite: "database is locked" under hård last – försök igen
+                    await db.rollback()
+                    await asyncio.sleep(0.01 * (attempt + 1))
+            else:
+                raise RuntimeError("gave up after 5 attempts")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=20)
+    args = parser.parse_args()
+
+    await init_db_async()
+    user_id = await create_stress_user()
+    applied, rejected = [], []
+    await asyncio.gather(*(worker(user_id, args.ops, applied, rejected) for _ in range(args.workers)))
+
+    async with AsyncSessionLocal() as db:
+        balance = await get_balance(db, user_id)
+        ledger_sum = await db.scalar(
+            select(func.coalesce(func.sum(PointsLedgerEntry.delta), 0)).where(PointsLedgerEntry.user_id == user_id)
+        )
+        # städa bort testanvändaren
+        await db.execute(delete(PointsLedgerEntry).where(PointsLedgerEntry.user_id == user_id))
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+
+    expected = START_POINTS + sum(applied)
+    print(f"applied={len(applied)} rejected={len(rejected)} balance={balance} "
+          f"expected={expected} ledger={START_POINTS + ledger_sum}")
+    ok = balance == expected == START_POINTS + ledger_sum and balance >= 0
+    print("✔️ No lost updates" if ok else "❌ Lost or phantom updates detected")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
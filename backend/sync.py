@@ -0,0 +1,100 @@
+# sync.py
+#
+# Delta sync for the mobile app. Every user has a change counter
+# (users.sync_version). Any insert/update/delete of one of the user's cars,
+# sessions, photos or claimed rewards bumps it, and the changed row (or a
+# tombstone for a deleted row) is stamped with the new value. A client keeps
+# the last counter it saw as its cursor and asks for rows stamped above it.
+#
+# The bump is an UPDATE of the user row, which holds the row lock until
+# commit, so a user's changes commit in counter order and a cursor never
+# skips a slower concurrent transaction.
+
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+
+from models import User, Car, DrivingSession, PhotoUpload, UserReward, SyncTombstone
+
+# Entity name in the API -> model
+SYNC_ENTITIES = {
+    "cars": Car,
+    "sessions": DrivingSession,
+    "photos": PhotoUpload,
+    "user_rewards": UserReward,
+}
+_ENTITY_BY_MODEL = {model: name for name, model in SYNC_ENTITIES.items()}
+
+
+def bump_sync_version(session: Session, user_id: int) -> int:
+    """Increment the user's change counter inside the current transaction and return the new value."""
+    conn = session.connection()
+    conn.execute(
+        update(User).where(User.id == user_id)
+        .values(sync_version=User.sync_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return conn.execute(select(User.sync_version).where(User.id == user_id)).scalar_one()
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_changes(session: Session, flush_context, instances):
+    """Stamp every changed synced row with its user's next sync_version (one bump per user per flush)."""
+    deleted_users = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    versions = {}
+
+    def version_for(user_id):
+        if user_id not in versions:
+            versions[user_id] = bump_sync_version(session, user_id)
+        return versions[user_id]
+
+    for obj in list(session.new) + list(session.dirty):
+        entity = _ENTITY_BY_MODEL.get(type(obj))
+        if entity is None or obj.user_id is None:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        obj.sync_version = version_for(obj.user_id)
+
+    for obj in list(session.deleted):
+        entity = _ENTITY_BY_MODEL.get(type(obj))
+        if entity is None or obj.user_id in deleted_users:
+            continue
+        session.add(SyncTombstone(user_id=obj.user_id, entity=entity, entity_id=obj.id,
+                                  sync_version=version_for(obj.user_id)))
+
+
+async def get_sync_version(db: AsyncSession, user_id: int):
+    """The user's current change counter (a primary key lookup), or None if the user does not exist."""
+    return await db.scalar(select(User.sync_version).where(User.id == user_id))
+
+
+async def get_changes(db: AsyncSession, user_id: int, since: int, until: int) -> dict:
+    """
+    Rows stamped in (since, until] per entity, plus tombstones. since=None is a
+    full sync: every live row and no tombstones.
+    """
+    changes = {}
+    for name, model in SYNC_ENTITIES.items():
+        stmt = select(model).where(model.user_id == user_id, model.sync_version <= until)
+        if since is not None:
+            stmt = stmt.where(model.sync_version > since)
+        if model is UserReward:
+            stmt = stmt.options(selectinload(UserReward.reward))
+        changes[name] = (await db.execute(stmt.order_by(model.id))).scalars().all()
+
+    deleted = []
+    if since is not None:
+        deleted = (await db.execute(
+            select(SyncTombstone.entity, SyncTombstone.entity_id)
+            .where(SyncTombstone.user_id == user_id,
+                   SyncTombstone.sync_version > since,
+                   SyncTombstone.sync_version <= until)
+            .order_by(SyncTombstone.id)
+        )).all()
+    changes["deleted"] = [{"entity": entity, "id": entity_id} for entity, entity_id in deleted]
+    return changes
+
+
+def sync_etag(user_id: int, version: int) -> str:
+    return f'"sync-{user_id}-{version}"'
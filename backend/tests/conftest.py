@@ -0,0 +1,15 @@
+# tests/conftest.py
+#
+# Backend modules read their configuration at import, so point them at a
+# throwaway SQLite database before any test imports them.
+#
+#   cd backend
+#   python -m pytest -q tests
+
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="safedrive-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,79 @@
+# tests/test_cache_versions.py
+#
+# A VersionedCache asked through a read-replica session must still be built
+# from the primary, since write paths share the same cached value, and a
+# value built across an invalidate() must not be trusted afterwards.
+
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import cache_versions
+from db import Base
+from models import CacheVersion
+
+
+class _VersionCache(cache_versions.VersionedCache):
+    name = "test"
+
+    async def _load(self, db, version):
+        return version
+
+
+def test_replica_session_reloads_from_primary(monkeypatch):
+    async def main():
+        workdir = tempfile.mkdtemp(prefix="safedrive-cache-")
+        primary = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'primary.db')}")
+        replica = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'replica.db')}")
+        # Repliken ligger efter: version 1 där, 2 på primären
+        for engine, version in ((primary, 2), (replica, 1)):
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with async_sessionmaker(engine)() as db:
+                db.add(CacheVersion(name="test", version=version))
+                await db.commit()
+
+        monkeypatch.setattr(cache_versions, "async_engine", primary)
+        monkeypatch.setattr(cache_versions, "async_read_engine", replica)
+        monkeypatch.setattr(cache_versions, "AsyncSessionLocal", async_sessionmaker(primary))
+
+        cache = _VersionCache(revalidate_seconds=0)
+        async with async_sessionmaker(replica)() as db:
+            value = await cache.get(db)
+        await primary.dispose()
+        await replica.dispose()
+        return value, cache.version
+
+    assert asyncio.run(main()) == (2, 2)
+
+
+def test_invalidate_during_rebuild_forces_another_check(monkeypatch):
+    class _RacingCache(cache_versions.VersionedCache):
+        name = "test"
+        loads = 0
+
+        async def _load(self, db, version):
+            self.loads += 1
+            if self.loads == 1:
+                self.invalidate()   # en commit + invalidate hinner ske medan bygget läser
+            return version
+
+    async def main():
+        path = os.path.join(tempfile.mkdtemp(prefix="safedrive-cache-"), "c.db")
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        monkeypatch.setattr(cache_versions, "async_engine", engine)
+        monkeypatch.setattr(cache_versions, "async_read_engine", engine)
+        cache = _RacingCache(revalidate_seconds=60)
+        async with async_sessionmaker(engine)() as db:
+            db.add(CacheVersion(name="test", version=1))
+            await db.commit()
+            await cache.get(db)
+            await cache.get(db)
+        await engine.dispose()
+        return cache.loads
+
+    assert asyncio.run(main()) == 2
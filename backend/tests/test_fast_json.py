@@ -0,0 +1,38 @@
+# tests/test_fast_json.py
+#
+# The fast path must write the same JSON keys as FastAPI's response_model
+# serialization (by_alias=True), so FAST_JSON_ENABLED never changes the wire format.
+
+import json
+from types import SimpleNamespace
+
+from fast_json import dump_list, model_response
+from schemas import UserResponse
+
+
+def _user(**overrides):
+    fields = dict(id=1, firstname="Ada", lastname="Lovelace", email="ada@example.com",
+                  points=10, current_car_id=None, avatar_url="/static/avatars/1.png")
+    fields.update(overrides)
+    return SimpleNamespace(**fields)
+
+
+def _expected(obj) -> dict:
+    # Det FastAPI skriver för response_model=UserResponse
+    return UserResponse.model_validate(obj, from_attributes=True).model_dump(mode="json", by_alias=True)
+
+
+def test_dump_list_uses_aliases():
+    rows = [_user(), _user(id=2, avatar_url=None)]
+    body = json.loads(dump_list(UserResponse, rows))
+    assert body == [_expected(r) for r in rows]
+    assert "avatar_url" in body[0] and "avatarUrl" not in body[0]
+
+
+def test_model_response_uses_aliases():
+    user = _user()
+    response = model_response(UserResponse, user)
+    body = json.loads(response.body)
+    assert body == _expected(user)
+    assert body["avatar_url"] == "/static/avatars/1.png"
+    assert "avatarUrl" not in body
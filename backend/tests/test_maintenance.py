@@ -0,0 +1,37 @@
+# tests/test_maintenance.py
+#
+# A DB error while taking a job's lease is logged and counted; the scheduler
+# keeps ticking, and stop() ends the loop it started.
+
+import asyncio
+
+from sqlalchemy.exc import OperationalError
+
+from maintenance import MaintenanceScheduler
+
+
+class _BrokenSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, *args, **kwargs):
+        raise OperationalError("UPDATE scheduler_leases", {}, Exception("connection lost"))
+
+    async def rollback(self):
+        pass
+
+
+def test_lease_error_does_not_stop_the_scheduler():
+    async def main():
+        scheduler = MaintenanceScheduler(_BrokenSession, owner="test")
+        job = scheduler.add("noop", None, 0)
+        scheduler._task = asyncio.create_task(scheduler.run_forever(tick=0.01))
+        await asyncio.sleep(0.1)
+        alive = not scheduler._task.done()
+        await scheduler.stop()
+        return alive, job.failures > 1, scheduler._task
+
+    assert asyncio.run(main()) == (True, True, None)
@@ -0,0 +1,69 @@
+# tests/test_pagination.py
+#
+# Keyset pages must cover every row exactly once, including rows without a
+# timestamp, and unpaged requests keep the endpoint's old order.
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db import Base
+from models import User, PhotoUpload
+from pagination import paginate
+
+
+def _run(coro_fn):
+    async def main():
+        path = os.path.join(tempfile.mkdtemp(prefix="safedrive-pagination-"), "p.db")
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+            db.add(User(id=1, firstname="Ada", lastname="Lovelace", gender="x", age=30,
+                        email="ada@example.com", hashed_password="!", points=0))
+            await db.commit()   # sync.py stämplar foton mot användarraden, som måste finnas
+            base = datetime(2024, 1, 1)
+            # id 1-3 och 6 har tidsstämpel (två med samma), 4-5 saknar
+            stamps = [base, base + timedelta(days=1), base + timedelta(days=1), None, None, base - timedelta(days=1)]
+            for i, ts in enumerate(stamps, start=1):
+                db.add(PhotoUpload(id=i, user_id=1, file_path=f"static/{i}.jpg", created_at=ts))
+            await db.commit()
+            # created_at har default; sätt NULL explicit
+            for photo in (await db.execute(select(PhotoUpload).where(PhotoUpload.id.in_([4, 5])))).scalars():
+                photo.created_at = None
+            await db.commit()
+            result = await coro_fn(db)
+        await engine.dispose()
+        return result
+
+    return asyncio.run(main())
+
+
+def _stmt():
+    return select(PhotoUpload).where(PhotoUpload.user_id == 1)
+
+
+def test_pages_cover_rows_without_timestamp():
+    async def walk(db):
+        ids, cursor = [], None
+        for _ in range(10):
+            rows, cursor = await paginate(db, _stmt(), PhotoUpload.created_at, PhotoUpload.id, 2, cursor)
+            ids += [r.id for r in rows]
+            if cursor is None:
+                return ids
+        raise AssertionError("pagination did not terminate")
+
+    assert _run(walk) == [3, 2, 1, 6, 5, 4]
+
+
+def test_unpaged_request_keeps_old_order():
+    async def unpaged(db):
+        rows, cursor = await paginate(db, _stmt(), PhotoUpload.created_at, PhotoUpload.id,
+                                      unpaged_order=(PhotoUpload.id,))
+        return [r.id for r in rows], cursor
+
+    assert _run(unpaged) == ([1, 2, 3, 4, 5, 6], None)
@@ -0,0 +1,58 @@
+# tests/test_quiz_grading.py
+#
+# grade_quiz against the cached answer key: every option with the correct
+# text counts, and an unknown user is rejected even when no points are won.
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db import Base
+from models import User, QuizQuestion, QuizOption, UserQuizResult
+from points import UserNotFound
+from quiz_cache import quiz_answer_key
+from repository import grade_quiz
+
+
+def _run(coro_fn):
+    async def main():
+        path = os.path.join(tempfile.mkdtemp(prefix="safedrive-quiz-"), "q.db")
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        quiz_answer_key.invalidate()
+        async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+            db.add(User(id=1, firstname="Ada", lastname="Lovelace", gender="x", age=30,
+                        email="ada@example.com", hashed_password="!", points=0))
+            db.add(QuizQuestion(id=1, key="stop", question="Stop sign?", correct="Stop"))
+            # Två alternativ med samma rätta text
+            db.add_all([QuizOption(id=1, question_id=1, text="Stop"), QuizOption(id=2, question_id=1, text="Go"),
+                        QuizOption(id=3, question_id=1, text="Stop")])
+            await db.commit()
+            result = await coro_fn(db)
+        await engine.dispose()
+        return result
+
+    return asyncio.run(main())
+
+
+def test_every_option_with_the_correct_text_counts():
+    async def grade(db):
+        return [(await grade_quiz(db, 1, [{"question_id": 1, "selected_option_id": option}])).correct_count
+                for option in (1, 2, 3)]
+
+    assert _run(grade) == [1, 0, 1]
+
+
+def test_unknown_user_is_rejected_without_points():
+    async def grade(db):
+        with pytest.raises(UserNotFound):
+            await grade_quiz(db, 999, [{"question_id": 1, "selected_option_id": 2}])
+        await db.rollback()
+        return await db.scalar(select(func.count()).select_from(UserQuizResult))
+
+    assert _run(grade) == 0
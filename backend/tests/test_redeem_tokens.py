@@ -0,0 +1,29 @@
+# tests/test_redeem_tokens.py
+#
+# schemas.py stays free of the ORM and jose; the redeem token is attached to
+# UserReward rows before they are serialized.
+
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+from models import Reward, UserReward
+from redemption import attach_redeem_tokens, verify_redeem_token
+from schemas import UserRewardResponse
+
+
+def test_schemas_import_stays_light():
+    code = "import sys, schemas; print(sorted(m for m in ('jose', 'models', 'redemption', 'sync') if m in sys.modules))"
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", code], cwd=backend, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+
+def test_unused_rewards_carry_a_valid_token():
+    reward = Reward(id=1, title="Coffee", cost_points=10)
+    rows = [UserReward(id=i, user_id=2, reward_id=1, claimed_at=datetime(2030, 1, 1), used=used, reward=reward)
+            for i, used in ((1, False), (2, True))]
+    body = [UserRewardResponse.model_validate(ur).model_dump() for ur in attach_redeem_tokens(rows)]
+    assert verify_redeem_token(body[0]["redeem_token"])["ur"] == 1
+    assert body[1]["redeem_token"] is None
@@ -0,0 +1,235 @@
+# thread_budget.py
+#
+# Host-wide CPU thread budget for the ML pipeline. Every conversion job takes
+# a lease; the configured cores (CPU_THREAD_BUDGET, default all) minus a
+# reserve for the live endpoints (ENDPOINT_THREAD_RESERVE) are split evenly
+# over the active jobs, and each job sizes OpenCV's pool and its FFmpeg
+# decoder to its share. Shares are recomputed as jobs start and finish, in
+# this process and in the other workers on the host: jobs are registered as
+# files in THREAD_BUDGET_DIR, named by pid so a crashed worker's jobs are
+# ignored and cleaned up. A running job re-reads its share while it decodes
+# (other workers are looked up at most every THREAD_BUDGET_REFRESH_SECONDS),
+# so a job started elsewhere shrinks it mid-video.
+#
+# ORT is sized once instead: every model version has a single session with
+# session_threads() intra-op threads, loaded by model_registry, and
+# concurrent runs share that pool. Inline, each of the WEB_CONCURRENCY
+# workers loads its own sessions, so they get the budget divided by the
+# worker count. With INFERENCE_SOCKET the sessions live only in
+# inference_server.py, which sizes them to the whole budget; a worker's job
+# share then covers only OpenCV and the decoder.
+#
+# THREAD_BUDGET_ENABLED=false keeps the library defaults (every session and
+# decoder sized to the whole machine), as before.
+
+import itertools
+import os
+import threading
+import time
+
+from metrics import metrics
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))   # respekterar taskset/cgroup-cpuset
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+THREAD_BUDGET_ENABLED = os.getenv("THREAD_BUDGET_ENABLED", "true").lower() in ("1", "true", "yes")
+CPU_THREAD_BUDGET = int(os.getenv("CPU_THREAD_BUDGET", "0")) or _available_cores()
+# Kärnor som hålls lediga för lane_overlay/depth_map medan jobb körs
+ENDPOINT_THREAD_RESERVE = int(os.getenv("ENDPOINT_THREAD_RESERVE", "1"))
+# Tom sträng = bara jobben i den här processen räknas
+THREAD_BUDGET_DIR = os.getenv("THREAD_BUDGET_DIR", "/tmp/safedrive-thread-budget")
+# Hur ofta ett jobb tittar efter jobb i andra workers
+THREAD_BUDGET_REFRESH_SECONDS = float(os.getenv("THREAD_BUDGET_REFRESH_SECONDS", "1.0"))
+# Workers på värden som laddar egna ORT-sessioner (samma variabel som uvicorn/gunicorn läser)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass   # finns, men tillhör en annan användare
+    return True
+
+
+class JobLease:
+    """One conversion job's claim on the budget. `threads` follows rebalancing."""
+
+    def __init__(self, budget: "ThreadBudget", name: str, key: str):
+        self.budget = budget
+        self.name = name
+        self.key = key
+
+    @property
+    def threads(self):
+        """Current share, or None with the budget disabled (library defaults)."""
+        return self.budget.job_threads() if self.budget.enabled else None
+
+
+class ThreadBudget:
+    def __init__(self, total: int = CPU_THREAD_BUDGET, endpoint_reserve: int = ENDPOINT_THREAD_RESERVE,
+                 directory: str = THREAD_BUDGET_DIR, refresh_seconds: float = THREAD_BUDGET_REFRESH_SECONDS,
+                 enabled: bool = THREAD_BUDGET_ENABLED, processes: int = WEB_CONCURRENCY):
+        self.total = max(1, total)
+        self.processes = max(1, processes)   # inference_server.py sätter 1: enda sessionerna på värden
+        self.endpoint_reserve = max(0, min(endpoint_reserve, self.total - 1))
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = {}              # key -> JobLease
+        self._ids = itertools.count(1)
+        self._host_jobs = 0
+        self._checked_at = 0.0
+        self._applied = None          # senaste andel som gavs till lyssnarna
+        self._listeners = []
+        self.rebalances = 0
+        if enabled and directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # ─── Andelar ──────────────────────────────────────────────────────
+
+    def share(self, jobs: int) -> int:
+        """Threads per job with `jobs` active on the host (the whole budget when idle)."""
+        if jobs <= 0:
+            return self.total
+        return max(1, (self.total - self.endpoint_reserve) // jobs)
+
+    def active_jobs(self) -> int:
+        self._refresh()
+        return self._host_jobs
+
+    def job_threads(self) -> int:
+        return self.share(self.active_jobs())
+
+    def session_threads(self):
+        """Intra-op threads for every ORT session in this process, shared by all callers; None = ORT's own default."""
+        return max(1, self.total // self.processes) if self.enabled else None
+
+    # ─── Jobb ─────────────────────────────────────────────────────────
+
+    def job(self, name: str) -> "_JobContext":
+        """`with thread_budget.job(name) as lease:` around one conversion job."""
+        return _JobContext(self, name)
+
+    def _register(self, name: str) -> JobLease:
+        key = f"{os.getpid()}-{next(self._ids)}"
+        lease = JobLease(self, name, key)
+        with self._lock:
+            self._local[key] = lease
+        if self.directory:
+            with open(os.path.join(self.directory, key), "w") as f:
+                f.write(name)
+        self._refresh(force=True)
+        return lease
+
+    def _release(self, lease: JobLease):
+        with self._lock:
+            self._local.pop(lease.key, None)
+        if self.directory:
+            try:
+                os.unlink(os.path.join(self.directory, lease.key))
+            except FileNotFoundError:
+                pass
+        self._refresh(force=True)
+
+    def _count_host_jobs(self) -> int:
+        if not self.directory:
+            return len(self._local)
+        count = 0
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return len(self._local)
+        for entry in entries:
+            pid = entry.split("-", 1)[0]
+            if not pid.isdigit():
+                continue
+            if _pid_alive(int(pid)):
+                count += 1
+            else:
+                try:
+                    os.unlink(os.path.join(self.directory, entry))   # kvar efter en krasch
+                except FileNotFoundError:
+                    pass
+        return count
+
+    def _refresh(self, force: bool = False):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_seconds:
+            return
+        jobs = self._count_host_jobs()
+        with self._lock:
+            self._host_jobs, self._checked_at = jobs, now
+            threads = self.share(jobs)
+            changed = threads != self._applied
+            if changed:
+                self._applied = threads
+                self.rebalances += 1
+            listeners = list(self._listeners)
+        if changed:
+            for fn in listeners:
+                fn(threads)
+
+    # ─── Bibliotek ────────────────────────────────────────────────────
+
+    def on_rebalance(self, fn):
+        """Call fn(threads_per_job) now and whenever the share changes (e.g. cv2.setNumThreads)."""
+        if self.enabled:
+            fn(self.job_threads())
+        with self._lock:
+            self._listeners.append(fn)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "total": self.total,
+            "endpoint_reserve": self.endpoint_reserve,
+            "session_threads": self.session_threads(),
+            "host_jobs": self._host_jobs,
+            "local_jobs": sorted(lease.name for lease in list(self._local.values())),
+            "threads_per_job": self.share(self._host_jobs),
+            "rebalances": self.rebalances,
+        }
+
+
+class _JobContext:
+    def __init__(self, budget: ThreadBudget, name: str):
+        self.budget = budget
+        self.name = name
+        self.lease = None
+
+    def __enter__(self) -> JobLease:
+        self.lease = self.budget._register(self.name) if self.budget.enabled else JobLease(self.budget, self.name, "")
+        return self.lease
+
+    def __exit__(self, *exc):
+        if self.budget.enabled:
+            self.budget._release(self.lease)
+        return False
+
+
+thread_budget = ThreadBudget()
+
+
+def _collect_thread_budget_metrics():
+    return [
+        ("safedrive_thread_budget_jobs", "gauge", "Conversion jobs sharing the CPU budget on this host.",
+         [({}, thread_budget._host_jobs)]),
+        ("safedrive_thread_budget_threads_per_job", "gauge", "Threads each conversion job may use.",
+         [({}, thread_budget.share(thread_budget._host_jobs))]),
+        ("safedrive_thread_budget_rebalances_total", "counter", "Times the per-job thread share changed.",
+         [({}, thread_budget.rebalances)]),
+    ]
+
+
+metrics.register_collector(_collect_thread_budget_metrics)
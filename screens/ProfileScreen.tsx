@@ -56,6 +56,7 @@ type UserReward = {
   expires_at?: string | null;      // Personlig giltighet (från user_rewards)
   used?: boolean;                  // Om rewarden är använd (från user_rewards)
   redeemed_at?: string | null;     // När rewarden användes (från user_rewards)
+  redeem_token?: string | null;    // Signerad QR-token (null när använd)
   reward: {
     id: number;
     title: string;
@@ -232,7 +233,9 @@ export default function ProfileScreen({ navigation, onLogout }: { navigation: an
   }, [loadProfile]);
 
   const qrValue = selectedReward && user
-    ? `https://docs.mysafedriveapp.org/docs/redeem?user_reward_id=${selectedReward.id}&user_id=${user.id}&reward_id=${selectedReward.reward.id}`
+    ? selectedReward.redeem_token
+      ? `https://docs.mysafedriveapp.org/docs/redeem?token=${encodeURIComponent(selectedReward.redeem_token)}`
+      : `https://docs.mysafedriveapp.org/docs/redeem?user_reward_id=${selectedReward.id}&user_id=${user.id}&reward_id=${selectedReward.reward.id}`
     : '';
 
   // ─═══ Steg 2: Spara grundläggande profiländringar ┐ ════════════════